@@ -9,11 +9,19 @@ Created on Mar 1, 2013
 @author: danny
 '''
 import threading, traceback, sys, time, random, struct, os, subprocess
-from Queue import PriorityQueue, Empty
 import multiprocessing 
-from pox.openflow.libopenflow_01 import ofp_packet_in, ofp_flow_mod
+from pox.openflow.libopenflow_01 import ofp_packet_in, ofp_flow_mod, ofp_packet_out, \
+     ofp_flow_removed, ofp_stats_request, ofp_stats_reply, OFPST_FLOW, \
+     ofp_barrier_request, ofp_barrier_reply
 import async_redis
 import pcap
+from lib.scheduler import DeadlineScheduler
+from lib.delay_profile import DelayProfiler
+from lib.syn_ring import SynRing
+from lib.lane_pool import LanePool
+from lib.delay_trace import DelayTrace
+from lib.load_model import LoadModel, MessageType
+from lib.tcam_model import EmulatedFlowTable
 
 
 # ==============================================================================
@@ -23,9 +31,44 @@ DELAY_PROFILE_TYPE = 'original'  # CHANGE THIS: either 'original' or 'modified'
 
 REDIS_PORT = 6379
 
+# If True, delays are interpolated between the bins of the profile CSVs.
+INTERPOLATE_DELAY_PROFILE = False
+
+# If set, delays are not drawn from the profile CSVs but replayed in order from
+# the pkt_in_trace.csv and flow_mod_trace.csv in this directory, as written by
+# timing_analysis.py. Every connection replays from the start of the traces.
+REPLAY_TRACE_DIR = os.environ.get('REPLAY_TRACE_DIR')
+
+# If set, pkt-in and flow-mod delays are stretched according to the current
+# pkt-in, flow-mod and pkt-out rates of each emulated switch, using the sweep
+# of the real switch in this CSV from control_path_profiler.py, or in one of
+# the lookup tables. For example: './data/old/hp_sensitivity_1500_byte.csv' or
+# './lookup-table/hp-full-frame.csv'
+LOAD_SENSITIVITY_CSV = None
+
 # If True, then we don't impose any delay at all.
 NO_OP = False
 
+# If > 0, jobs run on a process-wide pool of this many worker threads. Jobs of
+# the same connection and message class still run one at a time in FIFO order,
+# but those of other connections and classes no longer wait for them, except
+# for the messages of ORDERED_CLASSES. If 0, each connection runs its jobs one
+# at a time on its own thread.
+EXECUTION_WORKER_COUNT = 0
+
+# With the worker pool, a message of these classes waits until all earlier jobs
+# of its connection have run, and later ones wait for it, as they would if
+# they went through the switch one at a time: a barrier reply must follow the
+# flow-mods before it, stats must count them, and a flow-removed must not
+# overtake the packet-ins that came before it.
+ORDERED_CLASSES = (ofp_barrier_request, ofp_barrier_reply, ofp_stats_request,
+                   ofp_stats_reply, ofp_flow_removed)
+
+# Jobs that are due within this many seconds of each other are released
+# together, so that e.g. the flow-mods in one release can be coalesced into a
+# single socket write. No job is released earlier than this.
+RELEASE_TOLERANCE = 0.0002
+
 # Some artificial value we have to subtract off the overhead.
 MAGIC_OVERHEAD = 0
 
@@ -78,106 +121,69 @@ elif FLOW_TABLE_PROFILE == 'none':
     rate_limit(0, 0)
 else:
     raise RuntimeError('Invalid FLOW_TABLE_PROFILE.')
-    
 
+# Whether flow-mods that find the hardware table full go to a software table
+# (reported as table 2 in flow stats), or are rejected.
+DEMOTE_TO_SOFTWARE_TABLE = (FLOW_TABLE_PROFILE == 'hp')
 
-class DelayProfiler:
-    
+# If True, flow stats requests are answered from the emulated flow tables
+# instead of being forwarded to the switch. The emulated rules then no longer
+# see the switch's flow stats, so their idle timeouts run out at install time
+# + idle_timeout even while their flows are active, and all counters are
+# zero. Set ANSWER_FLOW_STATS_LOCALLY=1 in the environment to enable.
+ANSWER_FLOW_STATS_LOCALLY = str(os.environ.get('ANSWER_FLOW_STATS_LOCALLY')).lower() in ('1', 'true')
     
-    def __init__(self, profile_file=None):
-        """
-        Loads file that contains the delays on the real switch. If not
-        specified, there'd be no delays.
-        
-        """
-        if profile_file is None:
-            self._delay_bins = [0]
-            self._bin_count = 1
-            return
-
-        # List of delays in seconds.
-        raw_delay_list = []
-        with open(profile_file) as f:
-            for line in f:
-                sep = None
-                if ',' in line:
-                    sep = ','
-                delay, _ = line.strip().split(sep, 1)
-                raw_delay_list += [ float(delay) / 1000.0 ]
-
-        raw_delay_list.sort()
-        
-        # Chop up the delays into equal-sized bins.
-        delay_count = len(raw_delay_list)
-        bin_size = int(delay_count / delay_count)
-        
-        self._delay_bins = []
-        for index in range(0, delay_count, bin_size):
-            self._delay_bins += [ raw_delay_list[index] ]
-        self._bin_count = len(self._delay_bins)
-        
-        print 'Loaded', self._bin_count, 'bins from', profile_file
-        
-    
-    
-    def get_delay(self):
-        
-        p = random.randint(0, self._bin_count - 1)
-        return self._delay_bins[p]
-
-
-    def get_conditional_delay(self, percentile):
-        """ where 0 <= percentile <= 1 """
-
-        scaled_p = int(round(percentile * self._bin_count))
-        return self._delay_bins[scaled_p]
-    
-    
-    def find_delay_percentile(self, delay):
-        """ Returns the percentile [0, 1] of a given delay. """
-        index = self._bin_count - 1
-        while index >= 0:
-            if delay >= self._delay_bins[index]:
-                return index * 1.0 / self._bin_count
-            index -= 1
-        return 0
-        
-        
-
-
-
-
-
-
 
 
 class RandomDelayedAction(threading.Thread):
     
-    def __init__(self):
-                
+    def __init__(self, receive_func=None):
+        """
+        receive_func(msg) hands a message to the controller as if the switch
+        had sent it.
+        
+        """
         threading.Thread.__init__(self)
+        self._receive_func = receive_func
 
-        # Job queue
-        self._pq = PriorityQueue()
-        self._pq_lock = threading.RLock()
+        # Jobs keyed on the absolute time at which they are due.
+        self._scheduler = DeadlineScheduler()
         self._exec_lock = threading.RLock()
+        self._worker_pool = _get_worker_pool()
+
+        # Callbacks to run after the jobs of the current release. Only touched
+        # by this thread.
+        self._after_release_list = []
 
         if NO_OP:
             return
 
-        # Capture ingress SYN/ACK traffic into queue in a separate process.
-        self._pkt_queue = multiprocessing.Queue()
+        # Capture ingress SYN/ACK traffic into a shared-memory ring in a
+        # separate process.
+        self._syn_ring = SynRing()
         pcap_p = multiprocessing.Process(target=_pcap_process,
-                                         args=(self._pkt_queue,))
+                                         args=(self._syn_ring,))
         pcap_p.daemon = True
         pcap_p.start()
         
         # Introduce packet delays based on real performance.
-        self._pkt_in_profiler = DelayProfiler('./profile/%s/%s-pkt-in.csv' % (DELAY_PROFILE_TYPE, DELAY_PROFILE))
-        self._flow_mod_profiler = DelayProfiler('./profile/%s/%s-flow-mod.csv' % (DELAY_PROFILE_TYPE, DELAY_PROFILE))
+        if REPLAY_TRACE_DIR:
+            self._pkt_in_profiler = DelayTrace(os.path.join(REPLAY_TRACE_DIR, 'pkt_in_trace.csv'))
+            self._flow_mod_profiler = DelayTrace(os.path.join(REPLAY_TRACE_DIR, 'flow_mod_trace.csv'))
+        else:
+            self._pkt_in_profiler = DelayProfiler('./profile/%s/%s-pkt-in.csv' % (DELAY_PROFILE_TYPE, DELAY_PROFILE),
+                                                  interpolate=INTERPOLATE_DELAY_PROFILE)
+            self._flow_mod_profiler = DelayProfiler('./profile/%s/%s-flow-mod.csv' % (DELAY_PROFILE_TYPE, DELAY_PROFILE),
+                                                    interpolate=INTERPOLATE_DELAY_PROFILE)
         
         # Part of the ovs overhead that has not been accounted for.
         self._unused_ovs_overhead = 0
+
+        # Rates of this switch's control-plane messages.
+        if LOAD_SENSITIVITY_CSV:
+            self._load_model = LoadModel(LOAD_SENSITIVITY_CSV)
+        else:
+            self._load_model = None
         
         # Start loop that executes jobs and that processes tcpdump output.
         self.daemon = True
@@ -196,23 +202,63 @@ class RandomDelayedAction(threading.Thread):
             return 0
 
         if isinstance(filter_obj, ofp_packet_in):
-            return self._pkt_in_profiler.get_delay()
+            return self._next_delay(self._pkt_in_profiler)
             
         elif isinstance(filter_obj, ofp_flow_mod):
-            return self._flow_mod_profiler.get_delay()
+            return self._next_delay(self._flow_mod_profiler)
         
         return 0    
+
+
+
+    def _next_delay(self, profiler, percentile=None):
+        """
+        Returns the next delay from profiler, conditioned on percentile if
+        it is given. A trace that has been replayed to its end without loop
+        has no more delays, so messages are no longer delayed.
         
+        """
+        if percentile is None:
+            delay = profiler.get_delay()
+        else:
+            delay = profiler.get_conditional_delay(percentile)
+        if delay is None:
+            return 0
+        return delay
+        
+        
+        
+    def _get_slowdown(self, filter_obj):
+        """
+        Records filter_obj in the load model, and returns the factor by which
+        its delay is stretched at the current load.
+        
+        """
+        if self._load_model is None:
+            return 1.0
+
+        if isinstance(filter_obj, ofp_packet_in):
+            msg_type = MessageType.pkt_in
+        elif isinstance(filter_obj, ofp_flow_mod):
+            msg_type = MessageType.flow_mod
+        elif isinstance(filter_obj, ofp_packet_out):
+            self._load_model.record(MessageType.pkt_out)
+            return 1.0
+        else:
+            return 1.0
+
+        self._load_model.record(msg_type)
+        return self._load_model.get_slowdown(msg_type)
         
         
         
                 
     def add_job(self, filter_obj, func, *args, **kwargs):
                 
-        delay = self._get_delay(filter_obj) - MAGIC_OVERHEAD
+        delay = self._get_delay(filter_obj) * self._get_slowdown(filter_obj) - MAGIC_OVERHEAD
 
         if delay <= 0.002:
-            return self._execute(func, *args, **kwargs)
+            return self._dispatch(filter_obj, func, args, kwargs)
         elif delay > 5:
             return # Drop straight away
 
@@ -228,11 +274,11 @@ class RandomDelayedAction(threading.Thread):
                 delay = delay - ovs_overhead
                 if delay <= 0:
                     #self._unused_ovs_overhead += 0.0 - delay #TODO: Should we do this? 
-                    return self._execute(func, *args, **kwargs)
+                    return self._dispatch(filter_obj, func, args, kwargs)
 
         # Add event to job queue.
-        with self._pq_lock:
-            self._pq.put((delay + current_time, func, args, kwargs))
+        self._scheduler.add(delay + current_time, self._dispatch,
+                            (filter_obj, func, args, kwargs))
                 
         
         
@@ -244,70 +290,122 @@ class RandomDelayedAction(threading.Thread):
         
         while True:
         
-            # Peek
-            current_time = time.time()    
-            try:
-                with self._pq_lock:
-                    (next_time, _, _, _) = self._pq.queue[0]
-                if current_time < next_time:
-                    raise IndexError
-                
-            except IndexError:
-                time.sleep(0.001)
-                continue 
-                            
-            # Pop
-            try:
-                with self._pq_lock:
-                    (_, func, args, kwargs) = self._pq.get_nowait()
-            except Empty:
-                continue
-
-            # Run the job.            
-            self._execute(func, *args, **kwargs)
+            # Sleeps until the earliest job is due, then dispatches all due
+            # jobs.
+            for (func, args, kwargs) in self._scheduler.pop_due(early=RELEASE_TOLERANCE):
+                func(*args, **kwargs)
+
+            while self._after_release_list:
+                (func, args) = self._after_release_list.pop(0)
+                _run_job(func, args, {})
+
+
+
+    def call_after_release(self, func, *args):
+        """
+        If called from a job that this DelayedAction is releasing on its own
+        thread, arranges for func(*args) to run once all jobs of the current
+        release have run, and returns True. Otherwise, returns False and the
+        caller has to run func itself.
+
+        """
+        if threading.current_thread() is not self:
+            return False
+
+        self._after_release_list.append((func, args))
+        return True
             
     
     
     
     
-    def _get_ovs_overhead(self, src_port, dst_port, current_time, max_attempt=5):
+    def _get_ovs_overhead(self, src_port, dst_port, current_time):
         """
-        Continuously asks if pcap has seen <src_port, dst_port>. Stops when it
-        appears in the pcap history. Extract the pcap time. Based on the current
-        time, we can compute and return the overhead as a result of OVS.
+        Asks if pcap has seen <src_port, dst_port>. Extract the pcap time. Based
+        on the current time, we can compute and return the overhead as a result
+        of OVS. Returns 0 if the SYN has not been captured.
         
         """
-        # Average loop count is around 2.
-        for _ in range(max_attempt):
-            
-            try:
-                (timestamp, src, dst) = self._pkt_queue.get_nowait()
-            except Empty:
-                return 0 # What usually happens is pcap cannot keep up
-            
-            if src == src_port and dst == dst_port:
-                return current_time - timestamp  + 0.001 # Magic number 
-    
-        return 0 # Almost never happens.
+        timestamp = self._syn_ring.pop_timestamp(src_port, dst_port)
+        if timestamp is None:
+            return 0 # pcap has not caught up
+
+        return current_time - timestamp  + 0.001 # Magic number 
+
+
+
+    def get_ovs_overhead_stats(self):
+        """
+        Returns a dict of counters of how many packet-ins found their SYN in
+        the pcap history ('hit'), did not ('miss'), and how many captured SYNs
+        were never claimed ('expired') or overwritten in the ring ('lost').
+        
+        """
+        if NO_OP:
+            return {}
+        return self._syn_ring.get_stats()
 
             
     
+    def _dispatch(self, filter_obj, func, args, kwargs):
+        """
+        Runs the job in this thread, or hands it to the lane of this connection
+        and the class of filter_obj in the worker pool. Jobs for messages of
+        ORDERED_CLASSES are barriers across all lanes of this connection.
+        
+        """
+        if self._worker_pool is None:
+            return self._execute(func, *args, **kwargs)
+
+        lane = (self, filter_obj.__class__)
+        barrier = isinstance(filter_obj, ORDERED_CLASSES)
+        self._worker_pool.submit(lane, _run_job, (func, args, kwargs),
+                                 group=self, barrier=barrier)
+
+
+
     def _execute(self, func, *args, **kwargs):
         
-        try:
-            with self._exec_lock:
-                func(*args, **kwargs)
-        except Exception, err:
-            print >> sys.stderr, 'DelayedAction exception:', err
-            print >> sys.stderr, traceback.format_exc()
+        with self._exec_lock:
+            _run_job(func, args, kwargs)
         
     
 
 
-def _pcap_process(pkt_queue):
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+def _get_worker_pool():
+    """ Returns the shared LanePool, or None if EXECUTION_WORKER_COUNT is 0. """
+
+    global _worker_pool
+
+    if not EXECUTION_WORKER_COUNT:
+        return None
+
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = LanePool(EXECUTION_WORKER_COUNT)
+        return _worker_pool
+
+
+
+
+def _run_job(func, args, kwargs):
+    
+    try:
+        func(*args, **kwargs)
+    except Exception, err:
+        print >> sys.stderr, 'DelayedAction exception:', err
+        print >> sys.stderr, traceback.format_exc()
+        
+    
+
+
+def _pcap_process(syn_ring):
     """
     Continuously adds captured packet tuples (time, src_port, dst_port) into the
-    queue.
+    ring.
     
     """
     # Captures the first 64 bytes of all Redis SYN-SYNACK traffic. This is
@@ -328,7 +426,8 @@ def _pcap_process(pkt_queue):
             if pkt:
                 (_, data, timestamp) = pkt
                 (src_port, dst_port) = _get_tcp_src_dst_ports(data)
-                pkt_queue.put((timestamp, src_port, dst_port))
+                if src_port and dst_port:
+                    syn_ring.put(timestamp, src_port, dst_port)
 
 
 
@@ -353,13 +452,17 @@ def _get_tcp_src_dst_ports(raw_pkt):
 
 class ConditionalDelayedAction(RandomDelayedAction):
     
-    def __init__(self):
+    def __init__(self, receive_func=None):
         
+        # Rules installed on this switch, if its flow table is limited.
         if MAX_FLOW_MOD_COUNT:
-            self._flow_mod_count = 0
+            self._flow_table = EmulatedFlowTable(MAX_FLOW_MOD_COUNT, DEMOTE_TO_SOFTWARE_TABLE)
+        else:
+            self._flow_table = None
         
-        self._ovs_pkt_in_profiler = DelayProfiler('./profile/ovs-pkt-in.csv')
-        RandomDelayedAction.__init__(self)
+        self._ovs_pkt_in_profiler = DelayProfiler('./profile/ovs-pkt-in.csv',
+                                                  interpolate=INTERPOLATE_DELAY_PROFILE)
+        RandomDelayedAction.__init__(self, receive_func)
         
         self._stats = []
         t = threading.Thread(target=self._save_stat)
@@ -374,17 +477,26 @@ class ConditionalDelayedAction(RandomDelayedAction):
 
     def add_job(self, filter_obj, func, *args, **kwargs):
 
-        # Limit the number of flow-mods
-        if MAX_FLOW_MOD_COUNT and isinstance(filter_obj, ofp_flow_mod):
-            if self._flow_mod_count >= MAX_FLOW_MOD_COUNT:
+        # Drop the flow-mods that do not fit into the flow tables.
+        if self._flow_table is not None:
+            if isinstance(filter_obj, ofp_flow_mod):
+                if not self._flow_table.process_flow_mod(filter_obj):
+                    return
+            elif isinstance(filter_obj, ofp_flow_removed):
+                self._flow_table.process_flow_removed(filter_obj)
+            elif isinstance(filter_obj, ofp_stats_reply) and filter_obj.type == OFPST_FLOW:
+                self._flow_table.process_flow_stats(filter_obj)
+            elif ANSWER_FLOW_STATS_LOCALLY and self._receive_func and \
+                    isinstance(filter_obj, ofp_stats_request) and filter_obj.type == OFPST_FLOW:
+                for stats_reply in self._flow_table.flow_stats_replies(filter_obj):
+                    self._receive_func(stats_reply)
                 return
-            else:
-                self._flow_mod_count += 1
 
         if NO_OP:
-            return self._execute(func, *args, **kwargs)
+            return self._dispatch(filter_obj, func, args, kwargs)
+        slowdown = self._get_slowdown(filter_obj)
         if not (isinstance(filter_obj, ofp_packet_in) or isinstance(filter_obj, ofp_flow_mod)):
-            return self._execute(func, *args, **kwargs)
+            return self._dispatch(filter_obj, func, args, kwargs)
 
         delay = 0                
         current_time = time.time()                
@@ -395,30 +507,49 @@ class ConditionalDelayedAction(RandomDelayedAction):
             (src_port, dst_port) = _get_tcp_src_dst_ports(pkt_in.data)
             if src_port and dst_port:
                 ovs_overhead = self._get_ovs_overhead(src_port, dst_port, current_time)
-                if ovs_overhead > 0:
+                if REPLAY_TRACE_DIR:
+                    # The recorded delay already determines the percentile.
+                    percentile = None
+                    if ovs_overhead <= 0:
+                        ovs_overhead = 0.001
+                elif ovs_overhead > 0:
                     percentile = self._ovs_pkt_in_profiler.find_delay_percentile(ovs_overhead)
                 else:
                     percentile = random.uniform(0, 0.40) # Randomly break ties.
                     ovs_overhead = 0.001
-                delay = self._pkt_in_profiler.get_conditional_delay(percentile) - ovs_overhead
+                delay = self._next_delay(self._pkt_in_profiler, percentile) * slowdown - ovs_overhead
 
         # Find the flow-mod delay randomly.
         elif isinstance(filter_obj, ofp_flow_mod):
-            delay = self._flow_mod_profiler.get_delay()
+            delay = self._next_delay(self._flow_mod_profiler) * slowdown
 
         delay = delay - MAGIC_OVERHEAD
         if delay <= 0.002:
-            return self._execute(func, *args, **kwargs)
+            return self._dispatch(filter_obj, func, args, kwargs)
         elif delay > 5:
             return # Drop straight away
 
         # Add event to job queue.
-        with self._pq_lock:
-            self._pq.put((delay + current_time, func, args, kwargs))
+        self._scheduler.add(delay + current_time, self._dispatch,
+                            (filter_obj, func, args, kwargs))
                     
 
 
 
+    def get_flow_table_stats(self):
+        """
+        Returns a dict with the number of rules in the hardware ('hw') and
+        software ('sw') tables, and counters of how many flow-mods were
+        admitted, demoted and rejected, and of how many rules were promoted,
+        expired and removed. Empty if the flow table is not limited.
+        
+        """
+        if self._flow_table is None:
+            return {}
+        return self._flow_table.get_stats()
+
+
+
     def _save_stat(self):
         time.sleep(60)
         with open('data/delays.csv', 'w') as f:
@@ -430,6 +561,34 @@ class ConditionalDelayedAction(RandomDelayedAction):
     
     
 DelayedAction = ConditionalDelayedAction    
+
+
+
+def test():
+    """ Replays a trace without loop through _get_delay() past its end. """
+
+    import tempfile
+
+    (fd, trace_file) = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w') as f:
+        print >> f, '10.0,0.0'
+        print >> f, '20.0,0.1'
+
+    action = RandomDelayedAction.__new__(RandomDelayedAction)
+    action._pkt_in_profiler = DelayTrace(trace_file, loop=False)
+    action._flow_mod_profiler = action._pkt_in_profiler
+    delay_list = [action._get_delay(ofp_packet_in()) for _ in range(2)] + \
+                 [action._get_delay(ofp_flow_mod())]
+    assert delay_list == [0.01, 0.02, 0], delay_list
+    assert action._next_delay(action._pkt_in_profiler, percentile=0.5) == 0
+    print 'Exhausted traces fall back to no delay.'
+
+    os.remove(trace_file)
+
+
+
+if __name__ == '__main__':
+    test()
     
     
 
@@ -0,0 +1,147 @@
+'''
+Replays the delays recorded on a real switch, in the order they were recorded.
+
+A trace is a CSV with one delay (in ms) per line, optionally followed by the
+time of the event, as written by timing_analysis.py into data/*_trace.csv.
+Unlike DelayProfiler, which draws delays independently, DelayTrace returns
+them in sequence, so bursts of slow events and their autocorrelation are
+reproduced exactly, and every run sees the same delays.
+
+The trace is read lazily through a buffered file, so multi-million-event
+traces do not sit in memory. At the end of the trace we start over, unless
+loop is False.
+
+Created on Oct 17, 2026
+'''
+import threading, time
+
+
+class DelayTrace:
+
+
+    def __init__(self, trace_file, loop=True):
+
+        self._trace_file = trace_file
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._f = open(trace_file)
+        self.replay_count = 0
+        self.exhausted = False
+
+        # Fail now rather than on the first message.
+        for line in self._f:
+            if line.strip():
+                try:
+                    _parse_delay(line)
+                except ValueError:
+                    self._f.close()
+                    raise ValueError('Bad delay in %s: %r' % (trace_file, line))
+                break
+        else:
+            self._f.close()
+            raise ValueError('No delays in %s' % trace_file)
+        self._f.seek(0)
+
+        print 'Replaying delays from', trace_file
+
+
+
+    def get_delay(self):
+        """
+        Returns the next delay in seconds. Once the trace is exhausted, returns
+        None if loop is False.
+
+        """
+        with self._lock:
+            rewound = False
+            while True:
+                line = self._f.readline()
+                if not line:
+                    if not self._loop or rewound:
+                        if not self.exhausted:
+                            self.exhausted = True
+                            print 'No more delays in', self._trace_file
+                        return None
+                    self._f.seek(0)
+                    rewound = True
+                    continue
+                line = line.strip()
+                if line:
+                    self.replay_count += 1
+                    break
+
+        return _parse_delay(line)
+
+
+
+    def get_conditional_delay(self, percentile):
+        """ Traces are replayed in order, so the percentile is ignored. """
+
+        return self.get_delay()
+
+
+
+    def close(self):
+
+        with self._lock:
+            self._f.close()
+
+
+
+
+def _parse_delay(line):
+    """ Returns the delay in seconds on a line of a trace. """
+
+    sep = None
+    if ',' in line:
+        sep = ','
+    return float(line.split(sep, 1)[0]) / 1000.0
+
+
+
+
+def test(event_count=1000000):
+
+    import os, random, tempfile
+
+    (fd, trace_file) = tempfile.mkstemp(suffix='.csv')
+    delay_list = [random.uniform(1, 100) for _ in xrange(1000)]
+    with os.fdopen(fd, 'w') as f:
+        for delay in delay_list:
+            print >> f, '%.4f,%.6f' % (delay, time.time())
+
+    trace = DelayTrace(trace_file)
+    for delay in delay_list:
+        assert abs(trace.get_delay() - delay / 1000.0) < 1e-6
+    assert abs(trace.get_delay() - delay_list[0] / 1000.0) < 1e-6
+
+    start_time = time.time()
+    for _ in xrange(event_count):
+        trace.get_delay()
+    print 'get_delay: %.0f delays/s' % (event_count / (time.time() - start_time))
+
+    trace.close()
+
+    # Without loop, the trace runs out.
+    trace = DelayTrace(trace_file, loop=False)
+    for delay in delay_list:
+        assert trace.get_delay() is not None
+    assert trace.get_delay() is None
+    trace.close()
+
+    # Traces without delays are refused up front, even with loop.
+    for content in ('', '\n\n', 'delay,time\n'):
+        with open(trace_file, 'w') as f:
+            f.write(content)
+        try:
+            DelayTrace(trace_file)
+        except ValueError:
+            pass
+        else:
+            assert False, 'accepted %r' % content
+    os.remove(trace_file)
+
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,312 @@
+'''
+Pool of worker threads that runs jobs in FIFO order per lane.
+
+Jobs are submitted with a lane key. Jobs of the same lane run one at a time in
+the order they were submitted; jobs of different lanes run in parallel on any
+idle worker. A slow job therefore only holds up its own lane.
+
+A lane is queued on the ready queue at most once, whenever it has pending jobs
+and no worker is running one of its jobs.
+
+Lanes can be put in a group, e.g. the lanes of the message classes of one
+connection. A job submitted as a barrier of its group waits until all jobs
+submitted to the group before it have finished, and the jobs submitted to the
+group after it wait until it has finished. So barriers keep their place in
+the order across all lanes of the group, while other jobs only keep theirs
+within their lane.
+
+Run this module directly for a stress test of the order that jobs run in, and
+one that compares the delays that jobs actually experience with the delay
+profile, with and without the pool.
+
+Created on Oct 17, 2026
+'''
+import collections, sys, threading, traceback
+from Queue import Queue
+
+
+
+class _Group:
+
+
+    def __init__(self):
+
+        # Jobs handed to their lanes and not yet finished.
+        self.outstanding = 0
+        # Whether one of those is a barrier.
+        self.fenced = False
+        # (lane, job) that wait for a barrier, starting with the barrier.
+        self.held = collections.deque()
+
+
+
+
+class LanePool:
+
+
+    def __init__(self, num_workers):
+
+        # Maps lane key -> deque of (func, args, kwargs, group, barrier). A
+        # lane is in this dict iff it is on the ready queue or one of its
+        # jobs is running.
+        self._lane_dict = {}
+        # Maps group key -> _Group, while it has outstanding or held jobs.
+        self._group_dict = {}
+        self._lock = threading.Lock()
+        self._ready_queue = Queue()
+
+        for _ in range(num_workers):
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+
+
+
+    def submit(self, lane, func, args=(), kwargs={}, group=None, barrier=False):
+        """
+        Runs func(*args, **kwargs) after the jobs submitted to lane before it.
+        If barrier is True, it also runs after, and before, all the other
+        jobs submitted to group before, and after, it.
+
+        """
+        job = (func, args, kwargs, group, barrier)
+        with self._lock:
+            if group is None:
+                ready = self._release(lane, job)
+            else:
+                g = self._group_dict.get(group)
+                if g is None:
+                    g = self._group_dict[group] = _Group()
+                if g.held or g.fenced or (barrier and g.outstanding):
+                    g.held.append((lane, job))
+                    return
+                ready = self._release_in_group(g, lane, job)
+
+        if ready:
+            self._ready_queue.put(lane)
+
+
+
+    def _release(self, lane, job):
+        """
+        Appends job to its lane. Returns True if the lane has to be put on the
+        ready queue. Called with the lock held.
+
+        """
+        try:
+            self._lane_dict[lane].append(job)
+            return False
+        except KeyError:
+            self._lane_dict[lane] = collections.deque([job])
+            return True
+
+
+
+    def _release_in_group(self, g, lane, job):
+
+        g.outstanding += 1
+        if job[4]:
+            g.fenced = True
+        return self._release(lane, job)
+
+
+
+    def _finish_in_group(self, group, barrier):
+        """
+        Accounts for a finished job of group, and releases the held jobs that
+        no longer have to wait. Returns the lanes to put on the ready queue.
+        Called with the lock held.
+
+        """
+        g = self._group_dict[group]
+        g.outstanding -= 1
+        if barrier:
+            g.fenced = False
+
+        ready_list = []
+        while g.held and not g.fenced:
+            (lane, job) = g.held[0]
+            if job[4] and g.outstanding:
+                break
+            g.held.popleft()
+            if self._release_in_group(g, lane, job):
+                ready_list.append(lane)
+
+        if not (g.outstanding or g.held):
+            del self._group_dict[group]
+        return ready_list
+
+
+
+    def _worker(self):
+
+        while True:
+
+            lane = self._ready_queue.get()
+            with self._lock:
+                (func, args, kwargs, group, barrier) = self._lane_dict[lane].popleft()
+
+            try:
+                func(*args, **kwargs)
+            except Exception, err:
+                print >> sys.stderr, 'LanePool exception:', err
+                print >> sys.stderr, traceback.format_exc()
+
+            with self._lock:
+                if group is None:
+                    ready_list = []
+                else:
+                    ready_list = self._finish_in_group(group, barrier)
+                if self._lane_dict[lane]:
+                    ready_list.append(lane)
+                else:
+                    del self._lane_dict[lane]
+
+            for ready_lane in ready_list:
+                self._ready_queue.put(ready_lane)
+
+
+
+
+def test_order(job_count=20000, connection_count=8, class_count=4,
+               num_workers=8):
+    """
+    Submits jobs of class_count message classes on each of connection_count
+    connections, with a lane per connection and class, a group per connection
+    and one job in twenty a barrier. Asserts that the jobs of each lane run in
+    order, and that no job of a connection overtakes a barrier of it or is
+    overtaken by one.
+
+    """
+    import random, time
+
+    pool = LanePool(num_workers)
+    event_lock = threading.Lock()
+    # Maps (connection, seq) -> [start event, end event], with events counted
+    # in the order they happen.
+    event_dict = {}
+    event_count = [0]
+
+    def event(key):
+        with event_lock:
+            event_dict.setdefault(key, []).append(event_count[0])
+            event_count[0] += 1
+
+    def job(key):
+        event(key)
+        if random.random() < 0.01:
+            time.sleep(0.001)
+        event(key)
+
+    submitted = []
+    for seq in xrange(job_count):
+        conn = random.randint(0, connection_count - 1)
+        lane = (conn, random.randint(0, class_count - 1))
+        barrier = random.random() < 0.05
+        submitted.append((conn, seq, lane, barrier))
+        pool.submit(lane, job, ((conn, seq),), group=conn, barrier=barrier)
+
+    deadline = time.time() + 30
+    while len(event_dict) < job_count or \
+            any(len(v) < 2 for v in event_dict.values()):
+        assert time.time() < deadline, 'LanePool lost jobs'
+        time.sleep(0.01)
+
+    for conn in xrange(connection_count):
+        jobs = [(seq, lane, barrier)
+                for (c, seq, lane, barrier) in submitted if c == conn]
+        last_end = {}
+        for (i, (seq, lane, barrier)) in enumerate(jobs):
+            (start, end) = event_dict[(conn, seq)]
+            assert start > last_end.get(lane, -1), 'lane out of order'
+            last_end[lane] = end
+            if barrier:
+                for (other, _, _) in jobs[:i]:
+                    assert event_dict[(conn, other)][1] < start, \
+                        'job overtook a barrier'
+                for (other, _, _) in jobs[i + 1:]:
+                    assert event_dict[(conn, other)][0] > end, \
+                        'barrier overtook a job'
+
+    print 'LanePool(%d): order kept for %d jobs' % (num_workers, job_count)
+
+
+
+def test(profile_file='profile/original/hp-flow-mod.csv', rate=5000,
+         run_time=4, connection_count=8, num_workers=8):
+    """
+    Emulates connection_count connections whose jobs are delayed according to
+    profile_file. One job in fifty is a slow handler that takes 5 ms. We
+    compare the percentiles of the delays the jobs actually experienced with
+    those of the profile, (a) when all jobs run under one lock as in the
+    original DelayedAction, and (b) on a LanePool with a lane per connection.
+
+    """
+    import random, time
+    from lib.scheduler import DeadlineScheduler, percentile
+    from lib.delay_profile import DelayProfiler
+
+    profiler = DelayProfiler(profile_file)
+
+    # DelayedAction drops messages delayed by more than 5 seconds.
+    expected_list = [profiler.get_delay() for _ in xrange(rate * run_time)]
+    expected_list = sorted(delay for delay in expected_list if delay <= 5)
+
+    for use_pool in (False, True):
+
+        scheduler = DeadlineScheduler()
+        pool = LanePool(num_workers)
+        exec_lock = threading.Lock()
+        actual_list = []
+        job_count = len(expected_list)
+
+        def job(add_time, slow):
+            actual_list.append(time.time() - add_time)
+            if slow:
+                time.sleep(0.005)
+
+        def run_locked(func, args, kwargs):
+            with exec_lock:
+                func(*args, **kwargs)
+
+        def consume():
+            while len(actual_list) < job_count:
+                for (func, args, kwargs) in scheduler.pop_due(timeout=1):
+                    if use_pool:
+                        pool.submit(args[0], func, args[1:], kwargs)
+                    else:
+                        run_locked(func, args[1:], kwargs)
+
+        consumer = threading.Thread(target=consume)
+        consumer.daemon = True
+        consumer.start()
+
+        start_time = time.time()
+        added = 0
+        while added < job_count:
+            target = min(int((time.time() - start_time) * rate) + 1, job_count)
+            while added < target:
+                delay = profiler.get_delay()
+                if delay > 5:
+                    continue
+                add_time = time.time()
+                lane = random.randint(0, connection_count - 1)
+                slow = random.random() < 0.02
+                scheduler.add(add_time + delay, job, (lane, add_time, slow))
+                added += 1
+            time.sleep(0.001)
+
+        consumer.join(timeout=run_time + 30)
+        actual_list.sort()
+
+        print '%s:' % ('LanePool(%d)' % num_workers if use_pool else 'Single lock')
+        for p in (50, 90, 99):
+            print '    p%d: profile = %.3f ms, actual = %.3f ms' % \
+                (p, percentile(expected_list, p) * 1000.0,
+                 percentile(actual_list, p) * 1000.0)
+
+
+
+if __name__ == '__main__':
+    test_order()
+    test()
@@ -0,0 +1,242 @@
+'''
+Makes the emulated control-plane delays depend on the current load.
+
+The sensitivity sweeps of control_path_profiler.py (and the lookup tables in
+lookup-table/*-full-frame.csv, which hold the same columns without a header)
+record, for each offered ingress, flow-mod and pkt-out rate, the pkt-in and
+rule-installation rates the real switch actually achieved. They record no
+latencies. Instead, each row tells how busy the switch's pkt-in and flow-mod
+paths were: the capacity of a path is the highest rate it achieved in any row
+with about the same load on the other paths, and its utilization is the rate
+it was offered over that capacity. A path that falls behind is saturated. We
+turn utilization rho into a latency multiplier of 1 / (1 - rho), as for an
+M/M/1 queue, capped at MAX_SLOWDOWN for saturated paths.
+
+LoadModel keeps sliding-window rate estimates of the pkt-ins, flow-mods and
+pkt-outs of one emulated switch. These are the rates seen on the control
+channel, so they are looked up on the pkt_in_pps, flow_mod_pps and
+pkt_out_pps columns (the achieved pkt-in rate, not the offered ingress
+rate), and the delays drawn from the unloaded profile are scaled by the
+multipliers of the nearest row.
+
+The sweeps only record rates, not delay distributions, so the distribution at
+each load is the profile's distribution stretched by that load's multiplier.
+
+Created on Oct 17, 2026
+'''
+import csv, math, threading, time
+
+
+class MessageType:
+    pkt_in = 0
+    flow_mod = 1
+    pkt_out = 2
+
+
+
+class RateEstimator:
+    """
+    Counts events in bucket_count buckets that together span the last window
+    seconds. Recording an event and reading the rate are both O(1) amortized.
+
+    """
+
+    def __init__(self, window=1.0, bucket_count=10):
+
+        self._bucket_width = window / bucket_count
+        self._window = window
+        self._counts = [0] * bucket_count
+        self._total = 0
+        self._current_bucket = int(time.time() / self._bucket_width)
+
+
+
+    def _advance(self, current_time):
+
+        bucket = int(current_time / self._bucket_width)
+        stale = bucket - self._current_bucket
+        if stale <= 0:
+            return
+        bucket_count = len(self._counts)
+        if stale >= bucket_count:
+            self._counts = [0] * bucket_count
+            self._total = 0
+        else:
+            for b in xrange(self._current_bucket + 1, bucket + 1):
+                index = b % bucket_count
+                self._total -= self._counts[index]
+                self._counts[index] = 0
+        self._current_bucket = bucket
+
+
+
+    def record(self, current_time=None):
+
+        if current_time is None:
+            current_time = time.time()
+        self._advance(current_time)
+        self._counts[self._current_bucket % len(self._counts)] += 1
+        self._total += 1
+
+
+
+    def get_rate(self, current_time=None):
+        """ Returns the events per second over the window. """
+
+        if current_time is None:
+            current_time = time.time()
+        self._advance(current_time)
+        return self._total / self._window
+
+
+
+
+# Latency multiplier of a saturated path.
+MAX_SLOWDOWN = 10.0
+
+# Rows whose rates on the other paths are within this factor of each other
+# count as having the same background load when finding a path's capacity.
+SAME_LOAD_FACTOR = 1.5
+
+# Columns of the sweeps. The lookup tables have the first six, in this order,
+# and no header.
+_COLUMN_LIST = ['ingress_pps', 'flow_mod_pps', 'pkt_out_pps', 'pkt_in_pps',
+                'rule_pps', 'egress_pps']
+
+
+
+def load_slowdown_table(sensitivity_csv):
+    """
+    Parses a sensitivity CSV of control_path_profiler.py, or a lookup table
+    in lookup-table/. Returns a list of (rates, slowdowns) with one item per
+    row, where rates is the (pkt_in, flow_mod, pkt_out) rates on the control
+    channel, and slowdowns is (pkt_in_slowdown, flow_mod_slowdown).
+
+    """
+    with open(sensitivity_csv) as f:
+        row_list = list(csv.reader(f))
+    if row_list and row_list[0][0] == _COLUMN_LIST[0]:
+        index_list = [row_list[0].index(col) for col in _COLUMN_LIST]
+        row_list = row_list[1:]
+    else:
+        index_list = range(len(_COLUMN_LIST))
+    sweep = [dict((col, float(row[i])) for (col, i) in zip(_COLUMN_LIST, index_list))
+             for row in row_list if row]
+
+    def is_same_load(row, other, col_list):
+        for col in col_list:
+            (low, high) = sorted((row[col], other[col]))
+            if high > low * SAME_LOAD_FACTOR:
+                return False
+        return True
+
+    def slowdown(row, offered_col, achieved_col, load_col_list):
+        capacity = max(other[achieved_col] for other in sweep
+                       if is_same_load(row, other, load_col_list))
+        if capacity <= 0:
+            return MAX_SLOWDOWN
+        utilization = row[offered_col] / capacity
+        if utilization >= 1 - 1 / MAX_SLOWDOWN:
+            return MAX_SLOWDOWN
+        return 1 / (1 - utilization)
+
+    return [((row['pkt_in_pps'], row['flow_mod_pps'], row['pkt_out_pps']),
+             (slowdown(row, 'ingress_pps', 'pkt_in_pps', ['flow_mod_pps', 'pkt_out_pps']),
+              slowdown(row, 'flow_mod_pps', 'rule_pps', ['ingress_pps', 'pkt_out_pps'])))
+            for row in sweep]
+
+
+
+
+def _distance(rates, other_rates):
+    """ Distance between two (pkt_in, flow_mod, pkt_out) rates, on a log scale. """
+
+    return sum((math.log1p(rate) - math.log1p(other_rate)) ** 2
+               for (rate, other_rate) in zip(rates, other_rates))
+
+
+
+
+class LoadModel:
+
+
+    def __init__(self, sensitivity_csv, window=1.0):
+
+        self._slowdown_table = load_slowdown_table(sensitivity_csv)
+        self._rate_estimators = [RateEstimator(window) for _ in range(3)]
+        self._lock = threading.Lock()
+
+        # Maps rates -> slowdowns of the nearest row. The estimates only take
+        # multiples of 1 / window, so there are few distinct rates.
+        self._slowdown_cache = {}
+
+        print 'Loaded', len(self._slowdown_table), 'load buckets from', sensitivity_csv
+
+
+
+    def record(self, msg_type, current_time=None):
+
+        with self._lock:
+            self._rate_estimators[msg_type].record(current_time)
+
+
+
+    def get_rates(self, current_time=None):
+        """ Returns the current (pkt_in, flow_mod, pkt_out) rates. """
+
+        with self._lock:
+            return tuple(estimator.get_rate(current_time)
+                         for estimator in self._rate_estimators)
+
+
+
+    def get_slowdown(self, msg_type, current_time=None):
+        """
+        Returns the factor by which delays of msg_type (pkt_in or flow_mod)
+        are stretched at the current load.
+
+        """
+        if msg_type not in (MessageType.pkt_in, MessageType.flow_mod):
+            return 1.0
+        rates = self.get_rates(current_time)
+        slowdowns = self._slowdown_cache.get(rates)
+        if slowdowns is None:
+            if not self._slowdown_table:
+                return 1.0
+            (_, slowdowns) = min(self._slowdown_table,
+                                 key=lambda item: _distance(rates, item[0]))
+            if len(self._slowdown_cache) >= 10000:
+                self._slowdown_cache.clear()
+            self._slowdown_cache[rates] = slowdowns
+        return slowdowns[msg_type]
+
+
+
+
+def test(sensitivity_csv='data/old/hp_sensitivity_1500_byte.csv'):
+
+    for (rates, slowdowns) in load_slowdown_table(sensitivity_csv)[::6]:
+        print 'rates = (%7.1f, %7.1f, %7.1f): pkt-in slowdown = %5.2f, flow-mod slowdown = %5.2f' % \
+            (rates + slowdowns)
+
+    for rates in [(10, 10, 10), (10, 100, 10), (10, 1000, 10),
+                  (1000, 10, 10), (1000, 1000, 1000)]:
+        model = LoadModel(sensitivity_csv)
+        base_time = time.time()
+        for (msg_type, rate) in enumerate(rates):
+            for i in range(rate):
+                model.record(msg_type, base_time + i * 1.0 / rate)
+        print 'rates = %-20s pkt-in slowdown = %6.2f, flow-mod slowdown = %6.2f' % \
+            (rates, model.get_slowdown(MessageType.pkt_in, base_time + 0.99),
+             model.get_slowdown(MessageType.flow_mod, base_time + 0.99))
+
+    estimator = RateEstimator()
+    start_time = time.time()
+    for _ in xrange(100000):
+        estimator.record()
+    print 'RateEstimator.record: %.0f events/s' % (100000 / (time.time() - start_time))
+
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,411 @@
+'''
+Emulated flow tables of a hardware switch.
+
+The real switches hold a limited number of rules in their TCAM. Once it is
+full, some switches (e.g. HP) install further rules into a slower software
+table, which shows up as table 2 in flow stats, while the others reject them.
+EmulatedFlowTable tracks the rules that the controller installs on one
+emulated switch, so that admission follows the actual occupancy instead of
+the number of flow-mods sent so far: rules leave the tables when they time
+out, when they are deleted, or when the switch reports them removed, and
+software rules move into the hardware table as it frees up.
+
+Timeouts are kept in a heap of (deadline, seq, key, entry). Hard deadlines
+are exact. Idle deadlines are computed from the last time the entry was
+touched; when one comes up and the entry has been touched since, it is
+pushed back with its new deadline instead of being removed.
+
+The model does not see the traffic itself. Entries are touched when the
+flow stats of the real switch pass by (see process_flow_stats()) and show
+that their packet counts went up, so idle timeouts are only as accurate as
+the controller's polling: a rule that keeps seeing traffic stays until the
+next poll after its idle timeout at the latest, and one that falls idle is
+kept until its idle timeout after the poll that last saw it count up. If
+nobody polls, idle_timeout rules expire at install time + idle_timeout, as
+if they never saw a packet.
+
+Run this module directly for a benchmark of steady-state churn.
+
+Created on Oct 17, 2026
+'''
+import collections, heapq, threading, time
+from pox.openflow.libopenflow_01 import ofp_stats_reply, OFPST_FLOW, \
+     OFPSF_REPLY_MORE, OFPP_NONE, OFPFC_ADD, OFPFC_MODIFY, OFPFC_MODIFY_STRICT, \
+     OFPFC_DELETE, OFPFC_DELETE_STRICT
+from pox.openflow.flow_table import TableEntry
+from pox.openflow.util import iter_flow_stats
+
+
+# Table IDs that the real switches report in flow stats.
+HW_TABLE_ID = 0
+SW_TABLE_ID = 2
+
+# Table ID of flow stats requests for all tables.
+ALL_TABLES = 0xff
+
+# Largest body of an ofp_stats_reply, whose length field is 16 bits and
+# includes the 12 bytes of header, type and flags.
+MAX_STATS_BODY_LENGTH = 0xffff - 12
+
+
+
+class EmulatedFlowTable:
+
+
+    def __init__(self, hw_capacity, demote=False):
+        """
+        hw_capacity is the number of rules the hardware table holds. If demote
+        is True, rules that do not fit go to an unbounded software table;
+        otherwise they are rejected.
+
+        """
+        self._hw_capacity = hw_capacity
+        self._demote = demote
+        self._lock = threading.Lock()
+
+        # Maps table ID -> {(packed match, priority) -> TableEntry}.
+        self._table_dict = {HW_TABLE_ID: {}, SW_TABLE_ID: {}}
+
+        # (key, entry) of software rules in the order they were installed, so
+        # that the oldest ones are promoted first. May contain stale items for
+        # entries that have left the software table since.
+        self._promotion_queue = collections.deque()
+
+        self._expiry_heap = []
+        self._seq = 0
+
+        self.admit_count = 0
+        self.demote_count = 0
+        self.reject_count = 0
+        self.promote_count = 0
+        self.expiry_count = 0
+        self.removal_count = 0
+
+
+
+    def __len__(self):
+
+        return sum(len(table) for table in self._table_dict.itervalues())
+
+
+
+    def process_flow_mod(self, flow_mod, now=None):
+        """
+        Applies flow_mod to the tables. Returns False if it adds a rule that
+        fits in neither table, in which case the switch would reject it.
+
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            self._expire(now)
+            command = flow_mod.command
+
+            if command == OFPFC_ADD:
+                return self._add(flow_mod, now)
+
+            if command in (OFPFC_MODIFY, OFPFC_MODIFY_STRICT):
+                entry_list = self._find(flow_mod, command == OFPFC_MODIFY_STRICT)
+                if not entry_list:
+                    return self._add(flow_mod, now)
+                for (_, _, entry) in entry_list:
+                    entry.actions = flow_mod.actions
+                return True
+
+            if command in (OFPFC_DELETE, OFPFC_DELETE_STRICT):
+                for (table_id, key, _) in self._find(flow_mod, command == OFPFC_DELETE_STRICT):
+                    del self._table_dict[table_id][key]
+                    self.removal_count += 1
+                self._promote()
+
+            return True
+
+
+
+    def process_flow_removed(self, flow_removed, now=None):
+        """ Forgets the rule that the switch reports removed. """
+
+        key = _get_key(flow_removed.match, flow_removed.priority)
+        with self._lock:
+            for table in self._table_dict.itervalues():
+                if table.pop(key, None) is not None:
+                    self.removal_count += 1
+            self._expire(now if now is not None else time.time())
+            self._promote()
+
+
+
+    def process_flow_stats(self, stats_reply, now=None):
+        """
+        Touches the rules whose packet counts went up in an OFPST_FLOW
+        ofp_stats_reply part from the real switch, so that their idle
+        timeouts start over.
+
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            for stats in iter_flow_stats([stats_reply]):
+                key = _get_key(stats.match, stats.priority)
+                for table in self._table_dict.itervalues():
+                    entry = table.get(key)
+                    if entry is None:
+                        continue
+                    counters = entry.counters
+                    packet_count = stats.packet_count - counters['packets']
+                    if packet_count > 0:
+                        entry.touch_packet(stats.byte_count - counters['bytes'], now,
+                                           packet_count=packet_count)
+            self._expire(now)
+
+
+
+    def flow_stats(self, stats_request=None, now=None):
+        """
+        Returns a list of ofp_flow_stats for the rules selected by the
+        ofp_flow_stats_request, or for all rules.
+
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            self._expire(now)
+
+            table_id_list = [HW_TABLE_ID, SW_TABLE_ID]
+            match = None
+            out_port = None
+            if stats_request is not None:
+                if stats_request.table_id != ALL_TABLES:
+                    table_id_list = [stats_request.table_id]
+                match = stats_request.match
+                if stats_request.out_port != OFPP_NONE:
+                    out_port = stats_request.out_port
+
+            stats_list = []
+            for table_id in table_id_list:
+                for entry in self._table_dict.get(table_id, {}).itervalues():
+                    if match is not None and not entry.is_matched_by(match, out_port=out_port):
+                        continue
+                    stats = entry.flow_stats(now)
+                    stats.table_id = table_id
+                    stats.length = len(stats)
+                    stats_list.append(stats)
+
+        return stats_list
+
+
+
+    def flow_stats_replies(self, stats_request, now=None):
+        """
+        Returns the list of ofp_stats_reply parts with which the switch would
+        answer the OFPST_FLOW ofp_stats_request. All but the last one have
+        OFPSF_REPLY_MORE set.
+
+        """
+        body_list = [[]]
+        body_length = 0
+        for stats in self.flow_stats(stats_request.body, now):
+            data = stats.pack()
+            if body_length + len(data) > MAX_STATS_BODY_LENGTH:
+                body_list.append([])
+                body_length = 0
+            body_list[-1].append(data)
+            body_length += len(data)
+
+        reply_list = [ofp_stats_reply(xid=stats_request.xid, type=OFPST_FLOW,
+                                      flags=OFPSF_REPLY_MORE, body=b''.join(body))
+                      for body in body_list]
+        reply_list[-1].flags = 0
+        return reply_list
+
+
+
+    def get_stats(self):
+
+        with self._lock:
+            return {'hw': len(self._table_dict[HW_TABLE_ID]),
+                    'sw': len(self._table_dict[SW_TABLE_ID]),
+                    'admitted': self.admit_count,
+                    'demoted': self.demote_count,
+                    'rejected': self.reject_count,
+                    'promoted': self.promote_count,
+                    'expired': self.expiry_count,
+                    'removed': self.removal_count}
+
+
+
+    def _add(self, flow_mod, now):
+
+        entry = TableEntry(flow_mod.priority, flow_mod.cookie, flow_mod.idle_timeout,
+                           flow_mod.hard_timeout, flow_mod.match, flow_mod.actions,
+                           now=now)
+        key = _get_key(flow_mod.match, flow_mod.priority)
+
+        # A rule with the same match and priority is replaced in place.
+        for (table_id, table) in self._table_dict.iteritems():
+            if key in table:
+                table[key] = entry
+                if table_id == SW_TABLE_ID:
+                    self._promotion_queue.append((key, entry))
+                self._schedule(key, entry)
+                return True
+
+        if len(self._table_dict[HW_TABLE_ID]) < self._hw_capacity:
+            self._table_dict[HW_TABLE_ID][key] = entry
+            self.admit_count += 1
+        elif self._demote:
+            self._table_dict[SW_TABLE_ID][key] = entry
+            self._promotion_queue.append((key, entry))
+            self.demote_count += 1
+        else:
+            self.reject_count += 1
+            return False
+
+        self._schedule(key, entry)
+        return True
+
+
+
+    def _find(self, flow_mod, strict):
+        """ Returns a list of (table_id, key, entry) that flow_mod applies to. """
+
+        out_port = None
+        if flow_mod.out_port != OFPP_NONE:
+            out_port = flow_mod.out_port
+
+        if strict:
+            key = _get_key(flow_mod.match, flow_mod.priority)
+            entry_list = []
+            for (table_id, table) in self._table_dict.iteritems():
+                entry = table.get(key)
+                if entry is not None and entry.is_matched_by(flow_mod.match, flow_mod.priority,
+                                                             True, out_port):
+                    entry_list.append((table_id, key, entry))
+            return entry_list
+
+        return [(table_id, key, entry)
+                for (table_id, table) in self._table_dict.iteritems()
+                for (key, entry) in table.iteritems()
+                if entry.is_matched_by(flow_mod.match, out_port=out_port)]
+
+
+
+    def _schedule(self, key, entry):
+
+        deadline = _get_deadline(entry)
+        if deadline is not None:
+            self._seq += 1
+            heapq.heappush(self._expiry_heap, (deadline, self._seq, key, entry))
+
+
+
+    def _expire(self, now):
+
+        heap = self._expiry_heap
+        expired = False
+        while heap and heap[0][0] <= now:
+            (_, _, key, entry) = heapq.heappop(heap)
+            table_id = self._locate(key, entry)
+            if table_id is None:
+                continue # Replaced or removed since.
+            deadline = _get_deadline(entry)
+            if deadline > now:
+                self._seq += 1
+                heapq.heappush(heap, (deadline, self._seq, key, entry))
+                continue
+            del self._table_dict[table_id][key]
+            self.expiry_count += 1
+            expired = True
+
+        if expired:
+            self._promote()
+
+
+
+    def _locate(self, key, entry):
+        """ Returns the ID of the table that holds entry under key, or None. """
+
+        for (table_id, table) in self._table_dict.iteritems():
+            if table.get(key) is entry:
+                return table_id
+        return None
+
+
+
+    def _promote(self):
+        """ Moves the oldest software rules into free hardware slots. """
+
+        hw_table = self._table_dict[HW_TABLE_ID]
+        sw_table = self._table_dict[SW_TABLE_ID]
+        queue = self._promotion_queue
+        while queue and len(hw_table) < self._hw_capacity:
+            (key, entry) = queue.popleft()
+            if sw_table.get(key) is entry:
+                del sw_table[key]
+                hw_table[key] = entry
+                self.promote_count += 1
+
+
+
+
+def _get_key(match, priority):
+
+    return (match.pack(), priority)
+
+
+
+def _get_deadline(entry):
+    """ Returns the time at which entry times out, or None if it never does. """
+
+    deadline_list = []
+    if entry.hard_timeout > 0:
+        deadline_list.append(entry.counters['created'] + entry.hard_timeout)
+    if entry.idle_timeout > 0:
+        deadline_list.append(entry.counters['last_touched'] + entry.idle_timeout)
+    if deadline_list:
+        return min(deadline_list)
+    return None
+
+
+
+
+def test(hw_capacity=1500, rate=1000, run_time=60):
+    """
+    Installs rate rules per second with a 10-second hard timeout for run_time
+    emulated seconds, so that about 10 * rate rules are installed at any time.
+
+    """
+    from pox.openflow.libopenflow_01 import ofp_flow_mod, ofp_match, ofp_action_output
+
+    def make_flow_mod(i):
+        match = ofp_match(dl_type=0x800, nw_proto=6, tp_src=i % 65536, tp_dst=6379)
+        return ofp_flow_mod(match=match, hard_timeout=10,
+                            action=ofp_action_output(port=1))
+
+    flow_mod_list = [make_flow_mod(i) for i in xrange(rate * run_time)]
+
+    for demote in (False, True):
+        table = EmulatedFlowTable(hw_capacity, demote)
+        start_time = time.time()
+        for (i, flow_mod) in enumerate(flow_mod_list):
+            table.process_flow_mod(flow_mod, now=i * 1.0 / rate)
+        elapsed = time.time() - start_time
+        print 'demote=%s: %.0f flow-mods/s' % (demote, len(flow_mod_list) / elapsed)
+        print '    ', table.get_stats()
+
+        stats_list = table.flow_stats(now=run_time)
+        print '    flow stats: %d in table 0, %d in table 2' % \
+            (len([s for s in stats_list if s.table_id == HW_TABLE_ID]),
+             len([s for s in stats_list if s.table_id == SW_TABLE_ID]))
+
+    # The old counter admitted the first hw_capacity flow-mods and nothing else.
+    print 'A flow-mod counter would have rejected %d of %d flow-mods.' % \
+        (len(flow_mod_list) - hw_capacity, len(flow_mod_list))
+
+
+
+if __name__ == '__main__':
+    test()
@@ -101,6 +101,21 @@ def dictify(obj, max_level=5):
         for key in obj_dict:
             obj_dict[key] = dictify(obj_dict[key], max_level=max_level-1)
         return obj_dict
+
+    elif hasattr(obj, '__slots__') and max_level > 0:
+        # Slots that back a property (e.g. ofp_match._dl_src) are shown under
+        # the property's name.
+        obj_dict = {}
+        for cls in type(obj).__mro__:
+            slot_list = getattr(cls, '__slots__', ())
+            if isinstance(slot_list, basestring):
+                slot_list = [slot_list]
+            for key in slot_list:
+                if hasattr(obj, key.lstrip('_')):
+                    key = key.lstrip('_')
+                if hasattr(obj, key):
+                    obj_dict[key] = dictify(getattr(obj, key), max_level=max_level-1)
+        return obj_dict
     
     else:
         return obj
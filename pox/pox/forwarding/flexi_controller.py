@@ -15,6 +15,7 @@ Nov 14, 2012
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 from pox.lib.revent import *
+from pox.lib.packet.ethernet import ethernet
 from pox.lib.util import dpidToStr
 from pox.lib.util import str_to_bool
 import time, random, traceback, threading, re
@@ -24,6 +25,11 @@ from lib.looper import Looper
 import subprocess
 import Queue
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 mylog = Logger('flexi_controller.log', write_log_to_file=False)
 
@@ -82,6 +88,9 @@ class LearningSwitch (EventMixin):
         self.connection = connection
         self.transparent = transparent
 
+        # Set while the switch isn't taking our messages fast enough.
+        self.send_backlog_high = False
+
         # We want to hear PacketIn messages, as well as flow-stat messages.
         self.listenTo(connection)
         core.openflow.addListenerByName("FlowStatsReceived", self.handle_flow_stats)
@@ -114,17 +123,21 @@ class LearningSwitch (EventMixin):
         self.flow_mod_stat = (0, None, None)
         self.pkt_out_stat = (0, None, None)
         
-        # OF event time queue. Each contains a tuple (time, packet).
+        # OF event time queue. Each contains a tuple (time, match).
         self.pkt_in_queue = Queue.Queue()
         self.flow_mod_queue = Queue.Queue()
 
         # Maps time at which switch is polled for stats to flow_count.
         self.flow_stat_interval = 2 # TODO: default 5
         self.flow_count_dict = {} 
+
+        # What compare_flow_stats() needs from the previous flow stats.
+        self.prev_flow_stats = None
         
         # A special packet that "triggers" the special operations. Subsequent
         # special flow-mod or pkt-out operations will match against this packet.
         self.trigger_event = None
+        self.flow_mod_template = None # Built from the trigger event.
 
         # How long should our garbage pkt-out packets be?
         self.pkt_out_length = 1500
@@ -153,26 +166,32 @@ class LearningSwitch (EventMixin):
 
 
 
-    def _is_relevant_packet(self, event, packet):
+    def _is_relevant_packet(self, event):
         """ 
         Sanity check to make sure we deal with experimental traffic only.
-        Otherwise, returns False.
+        Otherwise, returns False. Looks at event.match only, so that the
+        packet is parsed just for logging rejected ones.
         
         """        
         mylog('zzzz inport =', event.port)
+        match = event.match
         
         if not self.transparent:
-            if packet.type == packet.LLDP_TYPE or packet.dst.isBridgeFiltered():
+            # Untagged LLDP, i.e. packet.type == LLDP_TYPE
+            is_lldp = match.dl_vlan == of.OFP_VLAN_NONE and match.dl_type == ethernet.LLDP_TYPE
+            if is_lldp or match.dl_dst.isBridgeFiltered():
+                packet = event.parse()
                 mylog('pkt_in: Rejected packet LLDP or BridgeFiltered:', packet, repr(packet), dictify(packet))
                 self._drop(event)
                 return False
 
         if event.port not in SWITCH_PORT_LIST:
+            packet = event.parse()
             mylog('pkt_in: Rejected packet: invalid port', packet, repr(packet), dictify(packet))
             self._drop(event)
             return False
 
-        if packet.dst.isMulticast():
+        if match.dl_dst.isMulticast():
             self.do_pkt_out(event) 
             return False
                 
@@ -202,10 +221,14 @@ class LearningSwitch (EventMixin):
         Adds time->flow_count into the flow_count dictionary.
         
         """
-        flow_count_list = [len([f for f in event.stats if f.table_id == i]) \
-                           for i in range(10)]
+        cols = event.columns()
+        table_counts = cols.table_counts()
+        flow_count_list = [table_counts.get(i, 0) for i in range(10)]
         print 'flow_count_list =', flow_count_list # TODO: xxx
         mylog('flow_count_list =', flow_count_list)
+
+        (promoted_count, bytes_per_sec) = self.compare_flow_stats(cols, time.time())
+        mylog('promoted =', promoted_count, 'bytes/s =', bytes_per_sec)
         
         # TODO: xxx
         for (table_type, table_id) in [('hw', 0), ('sw', 2)]:
@@ -216,14 +239,7 @@ class LearningSwitch (EventMixin):
             self.flow_count_dict[time.time()] = flow_count_list[0]
 #            (flow_mod_count, _, _) = self.flow_mod_stat
 #
-#        # Find how many rules were promoted.        
-#        current_hw_table = set([(f.match._tp_src, f.match._tp_dst) for f in event.stats if f.table_id == 0])
-#        current_sw_table = set([(f.match._tp_src, f.match._tp_dst) for f in event.stats if f.table_id == 2])
-#        if not hasattr(self, 'prev_sw_table'):
-#            self.prev_sw_table = set()
-#        promoted_set = self.prev_sw_table & current_hw_table
-#        self.prev_sw_table = current_sw_table 
-#        
+#
 #        # Find how many packets sent/received on eth1
 #        sender_output = run_ssh('ifconfig eth1', hostname='172.22.14.208', stdout=subprocess.PIPE, stderr=subprocess.PIPE, verbose=False).communicate()[0]
 #        sent_KB = int(re.search('TX bytes:(\d+)', sender_output).group(1)) / 1000
@@ -231,15 +247,63 @@ class LearningSwitch (EventMixin):
 #        received_KB = int(re.search('RX bytes:(\d+)', receiver_output).group(1)) / 1000
 #
 #        # Print space-separated result
-#        print time.time(), len(current_hw_table), len(current_sw_table), len(promoted_set), sent_KB, flow_mod_count, received_KB
+#        print time.time(), flow_count_list[0], flow_count_list[2], promoted_count, sent_KB, flow_mod_count, received_KB
 
 #        # Also write all the flow entries to file.
-#        flow_entries = [(time.time(), f.table_id, f.match._tp_src, f.match._tp_dst, flow_mod_count) for f in event.stats]
+#        flow_entries = [(time.time(), t, tp_src, tp_dst, flow_mod_count) for (t, tp_src, tp_dst) in zip(cols.table_id, cols.tp_src, cols.tp_dst)]
 #        with open(FLOW_TABLE_FILE, 'a') as table_f:
 #            print >> table_f, repr(flow_entries)
 
 
 
+    def compare_flow_stats(self, cols, current_time):
+        """
+        Compares the flow stats columns with those of the previous poll.
+        Returns (promoted_count, bytes_per_sec): how many rules moved from
+        the software table (2) into the hardware table (0) since, and the
+        bytes per second that the rules in both polls forwarded in between.
+        Rules are told apart by their (tp_src, tp_dst).
+
+        """
+        if np is not None:
+            tp_key = (cols.tp_src.astype(np.uint32) << 16) | cols.tp_dst
+            hw_table = np.unique(tp_key[cols.table_id == 0])
+            sw_table = np.unique(tp_key[cols.table_id == 2])
+            order = np.argsort(tp_key, kind='mergesort')
+            (tp_key, byte_count) = (tp_key[order], cols.byte_count[order].astype(np.int64))
+        else:
+            tp_key = [(tp_src << 16) | tp_dst for (tp_src, tp_dst) in zip(cols.tp_src, cols.tp_dst)]
+            hw_table = set(key for (key, table_id) in zip(tp_key, cols.table_id) if table_id == 0)
+            sw_table = set(key for (key, table_id) in zip(tp_key, cols.table_id) if table_id == 2)
+            byte_dict = dict(zip(tp_key, cols.byte_count))
+
+        (promoted_count, bytes_per_sec) = (0, 0.0)
+        if self.prev_flow_stats is not None:
+            (prev_time, prev_sw_table, prev_bytes) = self.prev_flow_stats
+            elapsed = current_time - prev_time
+            if np is not None:
+                promoted_count = len(np.intersect1d(prev_sw_table, hw_table, assume_unique=True))
+                (prev_key, prev_byte_count) = prev_bytes
+                index = np.searchsorted(prev_key, tp_key)
+                found = index < len(prev_key)
+                found[found] = prev_key[index[found]] == tp_key[found]
+                delta = byte_count[found] - prev_byte_count[index[found]]
+                byte_delta = int(delta.clip(0).sum())
+            else:
+                promoted_count = len(prev_sw_table & hw_table)
+                byte_delta = sum(max(0, byte_count - prev_bytes[key])
+                                 for (key, byte_count) in byte_dict.iteritems() if key in prev_bytes)
+            if elapsed > 0:
+                bytes_per_sec = byte_delta / elapsed
+
+        if np is not None:
+            self.prev_flow_stats = (current_time, sw_table, (tp_key, byte_count))
+        else:
+            self.prev_flow_stats = (current_time, sw_table, byte_dict)
+        return (promoted_count, bytes_per_sec)
+
+
+
     def flow_stat_thread(self):
 
         while True:
@@ -253,10 +317,9 @@ class LearningSwitch (EventMixin):
                                             ('flow_mod', self.flow_mod_queue)]:
                     while not queue.empty():
                         try:
-                            (start_time, packet) = queue.get()
+                            (start_time, match) = queue.get()
                         except Queue.Empty():
                             break
-                        match = of.ofp_match.from_packet(packet)
                         print >> timing_f, '%.8f,%s,%s,%s' % (start_time,
                                                               event_name,
                                                               match.tp_src,
@@ -278,6 +341,20 @@ class LearningSwitch (EventMixin):
 
 
 
+    def _handle_SendBacklogHigh(self, event):
+        mylog('Send backlog high:', event.backlog, 'bytes; pausing flow-mods')
+        with self.lock:
+            self.send_backlog_high = True
+
+
+
+    def _handle_SendBacklogLow(self, event):
+        mylog('Send backlog low:', event.backlog, 'bytes; resuming flow-mods')
+        with self.lock:
+            self.send_backlog_high = False
+
+
+
     def _handle_PacketIn(self, event):
         """
         Handles packet in messages from the switch to implement above algorithm.
@@ -293,17 +370,16 @@ class LearningSwitch (EventMixin):
         
     def _handle_pkt_in_helper(self, event):
 
-        packet = event.parse()
         current_time = time.time() 
                             
         # There are just packets that we don't care about.
-        if not self._is_relevant_packet(event, packet):
+        if not self._is_relevant_packet(event):
             return
 
-        self.pkt_in_queue.put((current_time, packet))
+        match = event.match
+        self.pkt_in_queue.put((current_time, match))
 
         # Count packet-in events only if they're from the pktgen.
-        match = of.ofp_match.from_packet(packet)
         if (not USE_LIMITER) or (USE_LIMITER and self.dyn_limiter.to_forward_packet(DynamicLimiter.PacketType.PktIn)):
             if match.tp_src == 10000 and match.tp_dst == 9:
                 with self.lock:
@@ -324,16 +400,18 @@ class LearningSwitch (EventMixin):
         """
         If the event is not specified, then issues a flow mod with random src
         and dst ports; all the other fields will match against the trigger event
-        saved earlier. Does not issue pkt_out.
+        saved earlier. Does not issue pkt_out. These flow mods are stamped out
+        of a template that is packed once per trigger event.
         
         Otherwise, does a normal flow_mod.
         
         """
-        msg = of.ofp_flow_mod()
-
         # Normal flow-mod
         if event:
-            msg.match = of.ofp_match.from_packet(event.parse())
+            msg = of.ofp_flow_mod()
+            msg.idle_timeout = IDLE_TIMEOUT
+            msg.hard_timeout = HARD_TIMEOUT
+            msg.match = event.match
             msg.actions.append(of.ofp_action_output(port=get_the_other_port(event.port)))
             msg.buffer_id = event.ofp.buffer_id
             
@@ -341,19 +419,29 @@ class LearningSwitch (EventMixin):
             if msg.match.tp_dst == TRIGGER_PORT:
                 with self.lock:
                     self.trigger_event = event
+                    self.flow_mod_template = None
                 mylog('Received trigger event. Trigger event.parse() =', pretty_dict(dictify(event.parse())))
             
             mylog('Installed flow:', pretty_dict(dictify(msg.match)))
             
-        # Special flow-mod that generates random source/dst ports.
+        # Special flow-mod that generates random source/dst ports. Skipped
+        # while the switch is behind on reading.
         else:
             with self.lock:
                 assert self.trigger_event
-                trigger_packet = func_cache(self.trigger_event.parse)
-                msg.match = of.ofp_match.from_packet(trigger_packet)
-                msg.actions.append(of.ofp_action_output(port=get_the_other_port(self.trigger_event.port)))
-            msg.match.tp_dst = random.randint(10, 65000)
-            msg.match.tp_src = random.randint(10, 65000)
+                if self.send_backlog_high:
+                    return
+                template = self.flow_mod_template
+                if template is None:
+                    template_msg = of.ofp_flow_mod()
+                    template_msg.match = self.trigger_event.match
+                    template_msg.actions.append(of.ofp_action_output(port=get_the_other_port(self.trigger_event.port)))
+                    template_msg.idle_timeout = IDLE_TIMEOUT
+                    template_msg.hard_timeout = HARD_TIMEOUT
+                    template = of.flow_mod_template(template_msg)
+                    self.flow_mod_template = template
+            msg = template.make(tp_src=random.randint(10, 65000),
+                                tp_dst=random.randint(10, 65000))
             
         current_time = time.time()
         with self.lock:
@@ -361,13 +449,11 @@ class LearningSwitch (EventMixin):
             if start is None: start = current_time
             self.flow_mod_stat = (count + 1, start, current_time)
 
-        msg.idle_timeout = IDLE_TIMEOUT
-        msg.hard_timeout = HARD_TIMEOUT
-
         if (not USE_LIMITER) or (USE_LIMITER and self.flow_mod_limiter.to_forward_packet()):
             self._of_send(msg)
         
-        self.flow_mod_queue.put((current_time, event.parse()))
+        if event:
+            self.flow_mod_queue.put((current_time, event.match))
 
 
 
@@ -229,7 +229,7 @@ class LearningSwitch (EventMixin):
         
         """                
         msg = of.ofp_flow_mod()
-        msg.match = of.ofp_match.from_packet(packet)
+        msg.match = event.match.clone()
         msg.idle_timeout = idle_timeout
         msg.hard_timeout = HARD_TIMEOUT
         msg.actions.append(of.ofp_action_output(port=outport))
@@ -308,7 +308,7 @@ def handle_flow_stats (event):
     Adds time->flow_count into the flow_count dictionary.
     
     """
-    flow_count_0 = len([f for f in event.stats if f.table_id == 0])
+    flow_count_0 = event.table_counts().get(0, 0)
 #    flow_count_1 = len([f for f in event.stats if f.table_id == 1])
 #    flow_count_2 = len([f for f in event.stats if f.table_id == 2])
     with exp_control.lock:
@@ -100,3 +100,68 @@ class EpollSelect(object):
 
   def close(self):
     self.epoll.close()
+
+
+class EdgeTriggeredEpoll(object):
+  """ persistent, edge-triggered epoll registration of sockets.
+      Unlike EpollSelect, nothing is re-registered per call, so a poll costs
+      in proportion to the number of ready sockets, not the number registered.
+      Readiness is only reported when it changes, so the caller must read from
+      (or accept on) a reported socket until it would block.
+      The epoll fd itself is readable while events are pending, so instances
+      can be passed to select() or a recoco Select.
+  """
+
+  def __init__(self):
+    self.epoll = select.epoll()
+    self.fd_to_obj = {}
+    self.obj_to_fd = {}
+
+  def fileno(self):
+    return self.epoll.fileno()
+
+  def __len__(self):
+    return len(self.fd_to_obj)
+
+  def __contains__(self, obj):
+    return obj in self.obj_to_fd
+
+  def register(self, obj, mask=select.EPOLLIN|select.EPOLLPRI):
+    """ obj is a raw fd or an object that answers to #fileno() """
+    fd = obj.fileno() if hasattr(obj, "fileno") else obj
+    self.epoll.register(fd, mask | select.EPOLLET)
+    self.fd_to_obj[fd] = obj
+    self.obj_to_fd[obj] = fd
+
+  def unregister(self, obj):
+    fd = self.obj_to_fd.pop(obj, None)
+    if fd is None:
+      return
+    del self.fd_to_obj[fd]
+    try:
+      self.epoll.unregister(fd)
+    except (IOError, OSError, ValueError):
+      # Closing an fd removes it from the epoll set already
+      pass
+
+  def poll(self, timeout=0):
+    """ returns the (rlist, wlist, xlist) of registered objects that became
+        ready, like select.select() """
+    retrl = []
+    retwl = []
+    retxl = []
+    for (fd, event) in self.epoll.poll(timeout):
+      obj = self.fd_to_obj.get(fd)
+      if obj is None:
+        continue
+      if event & (select.EPOLLIN|select.EPOLLPRI|select.EPOLLRDNORM|select.EPOLLRDBAND):
+        retrl.append(obj)
+      if event & (select.EPOLLOUT|select.EPOLLWRNORM|select.EPOLLWRBAND):
+        retwl.append(obj)
+      if event & (select.EPOLLERR|select.EPOLLHUP):
+        retxl.append(obj)
+
+    return (retrl, retwl, retxl)
+
+  def close(self):
+    self.epoll.close()
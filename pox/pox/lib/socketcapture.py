@@ -38,6 +38,11 @@ class SocketWedge (object):
     self._recv_out(r)
     return r
 
+  def recv_into (self, buf, nbytes = 0, *args, **kw):
+    r = self._socket.recv_into(buf, nbytes, *args, **kw)
+    self._recv_out(memoryview(buf)[:r].tobytes())
+    return r
+
   def __getattr__ (self, n):
     return getattr(self._socket, n)
 
@@ -60,6 +60,29 @@ class ConnectionDown (Event):
     self.connection = connection
     self.dpid = connection.dpid
 
+class SendBacklogHigh (Event):
+  """
+  Raised when more than Connection.send_high_water bytes wait for the
+  switch's socket.  Whoever generates messages at a high rate should hold
+  off until SendBacklogLow.  Raised in the thread that sent the message.
+  """
+  def __init__ (self, connection):
+    Event.__init__(self)
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.backlog = connection.send_backlog
+
+class SendBacklogLow (Event):
+  """
+  Raised after SendBacklogHigh once the backlog has drained to
+  Connection.send_low_water bytes.  Raised in the OpenFlow task.
+  """
+  def __init__ (self, connection):
+    Event.__init__(self)
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.backlog = connection.send_backlog
+
 class PortStatus (Event):
   """
   Fired in response to port status changes.
@@ -125,7 +148,53 @@ class SwitchDescReceived (StatsReply):
   pass
 
 class FlowStatsReceived (StatsReply):
-  pass
+  """
+  The entries in stats are unpacked from the raw replies in ofp when it is
+  first accessed.  iter_stats() and table_counts() go through them without
+  building the whole list, and columns() decodes them into one array per
+  field.
+  """
+  def __init__ (self, connection, ofp, stats = None):
+    StatsReply.__init__(self, connection, ofp, stats)
+    self._columns = None
+
+  @property
+  def stats (self):
+    if self._stats is None:
+      self._stats = list(self.iter_stats())
+    return self._stats
+
+  @stats.setter
+  def stats (self, stats):
+    self._stats = stats
+
+  def iter_stats (self):
+    """ Yields the ofp_flow_stats entries, unpacking one at a time """
+    if self._stats is not None:
+      return iter(self._stats)
+    # Not imported at the top, since pox.openflow.util imports this package
+    from pox.openflow.util import iter_flow_stats
+    return iter_flow_stats(self.ofp)
+
+  def table_counts (self):
+    """ Returns a dict of table_id -> number of entries """
+    if self._stats is not None:
+      counts = {}
+      for s in self._stats:
+        counts[s.table_id] = counts.get(s.table_id, 0) + 1
+      return counts
+    from pox.openflow.util import count_flow_stats
+    return count_flow_stats(self.ofp)
+
+  def columns (self):
+    """
+    Returns the entries as a pox.openflow.util.FlowStatsColumns, i.e. as
+    numpy arrays if numpy is available.  Only works on the raw replies.
+    """
+    if self._columns is None:
+      from pox.openflow.util import FlowStatsColumns
+      self._columns = FlowStatsColumns(self.ofp)
+    return self._columns
 
 class AggregateFlowStatsReceived (StatsReply):
   pass
@@ -145,6 +214,7 @@ class PacketIn (Event):
   port (int) - number of port the packet came in on
   data (bytes) - raw packet data
   parsed (packet subclasses) - pox.lib.packet's parsed version
+  match (ofp_match) - the packet's fields, without in_port
   """
   def __init__ (self, connection, ofp):
     Event.__init__(self)
@@ -153,6 +223,7 @@ class PacketIn (Event):
     self.port = ofp.in_port
     self.data = ofp.data
     self._parsed = None
+    self._match = None
     self.dpid = connection.dpid
 
   def parse (self):
@@ -160,6 +231,16 @@ class PacketIn (Event):
       self._parsed = ethernet(self.data)
     return self._parsed
 
+  @property
+  def match (self):
+    """
+    ofp_match.from_raw(data), made once and shared by all handlers, so
+    clone() it before changing it.  Does not parse the packet.
+    """
+    if self._match is None:
+      self._match = of.ofp_match.from_raw(self.data)
+    return self._match
+
   @property
   def parsed (self):
     """
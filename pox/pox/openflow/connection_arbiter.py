@@ -51,6 +51,8 @@ class OpenFlowNexus (EventMixin):
     PortStatsReceived,
     QueueStatsReceived,
     FlowRemoved,
+    SendBacklogHigh,
+    SendBacklogLow,
   ])
 
   # Bytes to send to controller when a packet misses all flows
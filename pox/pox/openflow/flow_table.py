@@ -9,27 +9,89 @@ from collections import namedtuple
 from libopenflow_01 import *
 from pox.lib.revent import *
 
+import array
+import bisect
+import heapq
+import itertools
+import operator
 import time
 
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+class _FlowCounters (object):
+  """
+  The counters of the entries in a FlowTable, in parallel arrays indexed by
+  the entries' slots.  Free slots are zero and get reused.  Byte and packet
+  counts are doubles, which are exact up to 2**53.
+  """
+  def __init__ (self, size=1024):
+    self.created = array.array('d', [0.0]) * size
+    self.last_touched = array.array('d', [0.0]) * size
+    self.bytes = array.array('d', [0.0]) * size
+    self.packets = array.array('d', [0.0]) * size
+    self._free = range(size - 1, -1, -1)
+
+  def allocate (self, created, last_touched, byte_count, packet_count):
+    if not self._free:
+      size = len(self.created)
+      for a in (self.created, self.last_touched, self.bytes, self.packets):
+        a.extend(array.array('d', [0.0]) * size)
+      self._free = range(2 * size - 1, size - 1, -1)
+    i = self._free.pop()
+    self.created[i] = created
+    self.last_touched[i] = last_touched
+    self.bytes[i] = byte_count
+    self.packets[i] = packet_count
+    return i
+
+  def release (self, i):
+    """ Frees slot i and returns its (created, last_touched, bytes, packets) """
+    r = (self.created[i], self.last_touched[i], int(self.bytes[i]),
+         int(self.packets[i]))
+    self.created[i] = self.last_touched[i] = self.bytes[i] = self.packets[i] = 0.0
+    self._free.append(i)
+    return r
+
+  def totals (self, slots=None):
+    """ (bytes, packets) summed over the given slots, or over all of them """
+    if slots is None:
+      return (int(sum(self.bytes)), int(sum(self.packets)))
+    slots = list(slots)
+    if np is not None:
+      slots = np.array(slots, dtype=np.intp)
+      return (int(np.frombuffer(self.bytes)[slots].sum()),
+              int(np.frombuffer(self.packets)[slots].sum()))
+    return (int(sum(map(self.bytes.__getitem__, slots))),
+            int(sum(map(self.packets.__getitem__, slots))))
+
 # FlowTable Entries:
 #   match - ofp_match (13-tuple)
-#   counters - hash from name -> count. May be stale
+#   counters - hash from name -> count. A snapshot
 #   actions - ordered list of ofp_action_*s to apply for matching packets
 class TableEntry (object):
   """
   Models a flow table entry, with a match, actions, and options/flags/counters.
   Note: the current time can either be specified explicitely with the optional 'now' parameter or is taken from time.time()
+
+  While the entry is in a FlowTable, its counters live in the table's
+  _FlowCounters, at _slot.  Otherwise they are kept in the entry.
   """
+  __slots__ = ('priority', 'cookie', 'idle_timeout', 'hard_timeout', 'match',
+               'actions', 'buffer_id', '_created', '_last_touched', '_bytes',
+               '_packets', '_counters', '_slot')
 
   def __init__(self,priority=OFP_DEFAULT_PRIORITY, cookie = 0, idle_timeout=0, hard_timeout=0, match=ofp_match(), actions=[], buffer_id=None, now=None):
     # overriding __new__ instead of init to make fields optional. There's probably a better way to do this.
     if now==None: now = time.time()
-    self.counters = {
-        'created': now,
-        'last_touched': now,
-        'bytes': 0,
-        'packets': 0
-    }
+    self._created = now
+    self._last_touched = now
+    self._bytes = 0
+    self._packets = 0
+    self._counters = None
+    self._slot = None
     self.priority = priority
     self.cookie = cookie
     self.idle_timeout = idle_timeout
@@ -62,17 +124,75 @@ class TableEntry (object):
     else:
       return match.matches_with_wildcards(self.match) and check_port()
 
-  def touch_packet(self, byte_count, now=None):
-    """ update the counters and expiry timer of this entry for a packet with a given byte count"""
+  def __getstate__(self):
+    return (self.priority, self.cookie, self.idle_timeout, self.hard_timeout,
+            self.match, self.actions, self.buffer_id) + self._get_counters()
+
+  def __setstate__(self, state):
+    (self.priority, self.cookie, self.idle_timeout, self.hard_timeout,
+     self.match, self.actions, self.buffer_id, self._created,
+     self._last_touched, self._bytes, self._packets) = state
+    self._counters = None
+    self._slot = None
+
+  def _attach(self, counters):
+    """ move the counters into a FlowTable's _FlowCounters """
+    if self._counters is None:
+      self._slot = counters.allocate(self._created, self._last_touched, self._bytes, self._packets)
+      self._counters = counters
+
+  def _detach(self, counters):
+    """ take the counters back from a FlowTable's _FlowCounters """
+    if self._counters is counters:
+      (self._created, self._last_touched, self._bytes, self._packets) = counters.release(self._slot)
+      self._counters = None
+      self._slot = None
+
+  def _get_counters(self):
+    """ return (created, last_touched, bytes, packets) """
+    c = self._counters
+    if c is None:
+      return (self._created, self._last_touched, self._bytes, self._packets)
+    i = self._slot
+    return (c.created[i], c.last_touched[i], int(c.bytes[i]), int(c.packets[i]))
+
+  @property
+  def counters(self):
+    (created, last_touched, byte_count, packet_count) = self._get_counters()
+    return { 'created': created, 'last_touched': last_touched, 'bytes': byte_count, 'packets': packet_count }
+
+  def touch_packet(self, byte_count, now=None, packet_count=1):
+    """ update the counters and expiry timer of this entry for a packet with a given byte count
+    (or for packet_count packets with that many bytes in all) """
     if now==None: now = time.time()
-    self.counters["bytes"] += byte_count
-    self.counters["packets"] += 1
-    self.counters["last_touched"] = now
+    c = self._counters
+    if c is None:
+      self._bytes += byte_count
+      self._packets += packet_count
+      self._last_touched = now
+    else:
+      i = self._slot
+      c.bytes[i] += byte_count
+      c.packets[i] += packet_count
+      c.last_touched[i] = now
 
   def is_expired(self, now=None):
     """" return whether this flow entry is expired due to its idle timeout or hard timeout"""
     if now==None: now = time.time()
-    return (self.hard_timeout > 0 and now - self.counters["created"] > self.hard_timeout) or (self.idle_timeout > 0 and now - self.counters["last_touched"] > self.idle_timeout)
+    (created, last_touched, byte_count, packet_count) = self._get_counters()
+    return (self.hard_timeout > 0 and now - created > self.hard_timeout) or (self.idle_timeout > 0 and now - last_touched > self.idle_timeout)
+
+  def expiry_time(self):
+    """ return the time after which this entry is expired, or None if it has no timeouts.
+    touch_packet() may move it later. """
+    if self.hard_timeout <= 0 and self.idle_timeout <= 0:
+      return None
+    (created, last_touched, byte_count, packet_count) = self._get_counters()
+    if self.hard_timeout > 0:
+      if self.idle_timeout > 0:
+        return min(created + self.hard_timeout, last_touched + self.idle_timeout)
+      return created + self.hard_timeout
+    return last_touched + self.idle_timeout
 
   def __str__ (self):
     return self.__class__.__name__ + "\n  " + self.show()
@@ -86,7 +206,8 @@ class TableEntry (object):
 
   def flow_stats(self, now=None):
     if now == None: now = time.time()
-    duration = now - self.counters["created"]
+    (created, last_touched, byte_count, packet_count) = self._get_counters()
+    duration = now - created
     return ofp_flow_stats (
         match = self.match,
         duration_sec = int(duration),
@@ -95,8 +216,8 @@ class TableEntry (object):
         idle_timeout = self.idle_timeout,
         hard_timeout = self.hard_timeout,
         cookie = self.cookie,
-        packet_count = self.counters["packets"],
-        byte_count = self.counters["last_touched"],
+        packet_count = packet_count,
+        byte_count = byte_count,
         actions = self.actions
         )
 
@@ -106,51 +227,329 @@ class FlowTableModification (Event):
     self.added = added
     self.removed = removed
 
+# (wildcard bit, ofp_match slot) of the fields that FlowTable hashes on,
+# other than nw_src and nw_dst
+_INDEX_FIELDS = [
+  (OFPFW_IN_PORT, '_in_port'),
+  (OFPFW_DL_VLAN, '_dl_vlan'),
+  (OFPFW_DL_SRC, '_dl_src'),
+  (OFPFW_DL_DST, '_dl_dst'),
+  (OFPFW_DL_TYPE, '_dl_type'),
+  (OFPFW_NW_PROTO, '_nw_proto'),
+  (OFPFW_TP_SRC, '_tp_src'),
+  (OFPFW_TP_DST, '_tp_dst'),
+  (OFPFW_DL_VLAN_PCP, '_dl_vlan_pcp'),
+  (OFPFW_NW_TOS, '_nw_tos'),
+]
+_INDEX_BITS = reduce(operator.or_, [bit for bit, slot in _INDEX_FIELDS])
+
+# Rank of exact-match entries, which go before all wildcarded ones (whose
+# rank is their priority)
+_EXACT_RANK = (1 << 16) + 1
+
+def _prefix_len (wildcards, shift):
+  """ The prefix length of nw_src or nw_dst; 0 if fully wildcarded """
+  w = (wildcards >> shift) & ((1 << OFPFW_NW_SRC_BITS) - 1)
+  return 32 - w if w < 32 else 0
+
+def _prefix_mask (prefix):
+  return (0xffffffff << (32 - prefix)) & 0xffffffff
+
+def _match_mask (match):
+  """ The fields a match hashes on, as (wildcard bits, src prefix, dst prefix) """
+  w = match.wildcards
+  return (w & _INDEX_BITS, _prefix_len(w, OFPFW_NW_SRC_SHIFT),
+          _prefix_len(w, OFPFW_NW_DST_SHIFT))
+
+class _MaskGroup (object):
+  """
+  The entries of a FlowTable that have the same mask (see _match_mask()),
+  hashed by the values of the fields they match on.  Exact-match entries
+  have a group of their own.  Each bucket is a list of ((-rank, seq),
+  entry), in table order.
+  """
+  def __init__ (self, mask):
+    self.mask = mask
+    bits, self.src_prefix, self.dst_prefix = mask
+    self.src_mask = _prefix_mask(self.src_prefix)
+    self.dst_mask = _prefix_mask(self.dst_prefix)
+    # Wildcard bits that a looked-up match must not have set
+    self.required = _INDEX_BITS & ~bits
+    self._fields = [(bit, slot) for bit, slot in _INDEX_FIELDS if not bits & bit]
+    slots = [slot for bit, slot in self._fields]
+    if len(slots) == 0:
+      self._get = lambda match: ()
+    elif len(slots) == 1:
+      get = operator.attrgetter(slots[0])
+      self._get = lambda match: (get(match),)
+    else:
+      self._get = operator.attrgetter(*slots)
+    self.buckets = {}
+    self._ranks = {} # rank -> number of entries
+    self.max_rank = -1
+    # Index of a field in the key -> value -> keys with it.  Built for the
+    # fields that non-strict matches have asked for.
+    self._inverted = {}
+
+  def __len__ (self):
+    return len(self._ranks)
+
+  def entry_key (self, match):
+    return (self._get(match),
+            match._nw_src if self.src_prefix else None,
+            match._nw_dst if self.dst_prefix else None)
+
+  def lookup_key (self, match):
+    return (self._get(match),
+            match._nw_src & self.src_mask if self.src_prefix else None,
+            match._nw_dst & self.dst_mask if self.dst_prefix else None)
+
+  def add (self, key, order, entry):
+    """ Returns whether max_rank changed """
+    bucket = self.buckets.get(key)
+    if bucket is None:
+      bucket = self.buckets[key] = []
+      for i, index in self._inverted.iteritems():
+        index.setdefault(key[0][i], set()).add(key)
+    bisect.insort(bucket, (order, entry))
+    r = -order[0]
+    self._ranks[r] = self._ranks.get(r, 0) + 1
+    if r > self.max_rank:
+      self.max_rank = r
+      return True
+    return False
+
+  def remove (self, key, order, entry):
+    """ Returns whether max_rank changed """
+    bucket = self.buckets[key]
+    del bucket[bisect.bisect_left(bucket, (order,))]
+    if not bucket:
+      del self.buckets[key]
+      for i, index in self._inverted.iteritems():
+        keys = index[key[0][i]]
+        keys.discard(key)
+        if not keys:
+          del index[key[0][i]]
+    r = -order[0]
+    n = self._ranks[r] - 1
+    if n:
+      self._ranks[r] = n
+      return False
+    del self._ranks[r]
+    if r == self.max_rank:
+      self.max_rank = max(self._ranks) if self._ranks else -1
+      return True
+    return False
+
+  def matched_by (self, match, bits, src_prefix, dst_prefix):
+    """
+    Returns the (order, entry) of the entries that match covers, as in
+    ofp_match.matches_with_wildcards().  bits are the index fields that
+    match does not wildcard, and the caller has checked that this group
+    doesn't wildcard them either, nor has shorter prefixes.
+    """
+    if (bits == self.required and src_prefix == self.src_prefix in (0, 32)
+        and dst_prefix == self.dst_prefix in (0, 32)):
+      # match fixes the whole key
+      return list(self.buckets.get(self.entry_key(match), ()))
+
+    idx = [i for i, (bit, slot) in enumerate(self._fields) if bits & bit]
+    want = tuple(getattr(match, self._fields[i][1]) for i in idx)
+    if len(idx) == 1:
+      i = idx[0]
+      get = lambda values: (values[i],)
+    elif idx:
+      get = operator.itemgetter(*idx)
+    else:
+      get = lambda values: ()
+    src_mask = _prefix_mask(src_prefix)
+    dst_mask = _prefix_mask(dst_prefix)
+    src = match._nw_src if src_prefix else 0
+    dst = match._nw_dst if dst_prefix else 0
+    # An equal match is covered even if its addresses have host bits
+    own = self.entry_key(match) if self.mask == _match_mask(match) else None
+
+    # Only look at the keys with the rarest of the values that match asks for
+    keys = self.buckets
+    for i, value in zip(idx, want):
+      index = self._inverted.get(i)
+      if index is None:
+        index = self._inverted[i] = {}
+        for key in self.buckets:
+          index.setdefault(key[0][i], set()).add(key)
+      candidates = index.get(value, ())
+      if len(candidates) < len(keys):
+        keys = candidates
+    if own is not None and own in self.buckets:
+      keys = set(keys)
+      keys.add(own)
+
+    found = []
+    for key in keys:
+      values, entry_src, entry_dst = key
+      if ((get(values) == want and (entry_src or 0) & src_mask == src
+           and (entry_dst or 0) & dst_mask == dst) or key == own):
+        found += self.buckets[key]
+    return found
+
 class FlowTable (EventMixin):
   _eventMixin_events = set([FlowTableModification])
 
   """
   General model of a flow table. Maintains an ordered list of flow entries, and finds
   matching entries for packets and other entries. Supports expiration of flows.
+
+  Lookups for packets don't scan the list: the entries are hashed by the
+  fields they match on, in one hash per mask (tuple space search).  The
+  masks are tried in order of their highest priority (exact matches first),
+  until no remaining mask can beat what was found.  Non-strict matching
+  skips the masks that can't be covered, and checks the others by their
+  hash keys.
+
+  Expiry goes through a heap of (expiry time, seq, entry).  Idle timeouts
+  are not rescheduled on every packet: when an entry comes up that has been
+  touched since, it is pushed back with its new expiry time.  Items of
+  entries that were removed otherwise are skipped, and dropped when the heap
+  gets too big.
+
+  Removed entries leave None in their slot of the ordered list, so that
+  removing k entries costs O(k log n).  The list is compacted once more than
+  half of it is empty, or when entries is read.
+
+  The counters of the entries are kept in the table's _FlowCounters, so
+  that aggregate_stats() can add them up in bulk.
+
+  Entries must not change their match, priority or timeouts while in the
+  table.
   """
   def __init__(self):
     EventMixin.__init__(self)
-    # For now we represent the table as a multidimensional array.
-    #
-    # [ (cookie, match, counters, actions),
-    #   (cookie, match, counters, actions),
-    #    ...                        ]
-    # 
-    # Implies O(N) lookup for now. TODO: fix
+    # The entries in lookup order: exact matches first, then by descending
+    # priority, in insertion order within each.  _order holds their sort
+    # keys, (-priority, seq), for bisecting.  Slots of removed entries are
+    # None in _table (_dead of them) until _compact().
     self._table = []
+    self._order = []
+    self._dead = 0
+    self._seq = 0
+
+    # mask -> _MaskGroup, and the groups by descending max_rank (None when
+    # it needs to be rebuilt)
+    self._groups = {}
+    self._group_order = None
+    # (match key, priority) -> entries, for strict matching
+    self._strict = {}
+    # entry -> (sort key, mask, hash key, strict key)
+    self._entry_keys = {}
+    self._expiry_heap = []
+    self._counters = _FlowCounters()
 
   @property
   def entries(self):
+    if self._dead:
+      self._compact()
     return self._table
 
   def __len__(self):
-    return len(self._table)
+    return len(self._entry_keys)
 
   def add_entry(self, entry):
     if not isinstance(entry, TableEntry):
       raise "Not an Entry type"
-    self._table.append(entry)
-
-    # keep table sorted by descending priority, with exact matches always going first
-    # note: python sort is stable
-    self._table.sort(key=lambda(e): (e.priority if e.match.is_wildcarded else (1<<16) + 1), reverse=True)
-
+    self._insert(entry)
     self.raiseEvent(FlowTableModification(added=[entry]))
 
   def remove_entry(self, entry):
     if not isinstance(entry, TableEntry):
       raise "Not an Entry type"
-    self._table.remove(entry)
+    self._remove([entry])
     self.raiseEvent(FlowTableModification(removed=[entry]))
 
+  def _insert(self, entry):
+    match = entry.match
+    match_key = match._key()
+    self._seq += 1
+    if match.is_wildcarded:
+      order = (-entry.priority, self._seq)
+    else:
+      order = (-_EXACT_RANK, self._seq)
+    mask = _match_mask(match)
+    group = self._groups.get(mask)
+    if group is None:
+      group = self._groups[mask] = _MaskGroup(mask)
+    key = group.entry_key(match)
+    if group.add(key, order, entry):
+      self._group_order = None
+    strict_key = (match_key, entry.priority)
+    self._strict.setdefault(strict_key, []).append(entry)
+    self._entry_keys[entry] = (order, mask, key, strict_key)
+
+    i = bisect.bisect_right(self._order, order)
+    self._order.insert(i, order)
+    self._table.insert(i, entry)
+    entry._attach(self._counters)
+    self._schedule(entry)
+
+  def _remove(self, entries):
+    """ remove entries (a list without duplicates) from the table and its indexes """
+    for entry in entries:
+      if entry not in self._entry_keys:
+        raise ValueError("entry not in table")
+    orders = []
+    for entry in entries:
+      order, mask, key, strict_key = self._entry_keys.pop(entry)
+      orders.append(order)
+      group = self._groups[mask]
+      if group.remove(key, order, entry):
+        self._group_order = None
+      if len(group) == 0:
+        del self._groups[mask]
+      self._remove_from(self._strict, strict_key, entry)
+      entry._detach(self._counters)
+
+    for order in orders:
+      self._table[bisect.bisect_left(self._order, order)] = None
+    self._dead += len(orders)
+    if self._dead * 2 > len(self._table):
+      self._compact()
+
+    if len(self._expiry_heap) > 2 * len(self._entry_keys) + 64:
+      # Mostly items of entries that are gone.  It takes that many removals
+      # to get here again, so this is O(1) per removal.
+      self._expiry_heap[:] = []
+      for entry in self._entry_keys:
+        self._schedule(entry, push=False)
+      heapq.heapify(self._expiry_heap)
+
+  def _compact(self):
+    """ drop the slots of removed entries from _table and _order """
+    keep = [entry is not None for entry in self._table]
+    self._order[:] = itertools.compress(self._order, keep)
+    self._table[:] = itertools.compress(self._table, keep)
+    self._dead = 0
+
+  def _schedule(self, entry, push=True):
+    t = entry.expiry_time()
+    if t is not None:
+      self._seq += 1
+      if push:
+        heapq.heappush(self._expiry_heap, (t, self._seq, entry))
+      else:
+        self._expiry_heap.append((t, self._seq, entry))
+
+  @staticmethod
+  def _remove_from(index, key, entry):
+    entries = index[key]
+    for i, e in enumerate(entries):
+      if e is entry:
+        del entries[i]
+        break
+    if not entries:
+      del index[key]
+
   def entries_for_port(self, port_no):
     entries = []
-    for entry in self._table:
+    for entry in self.entries:
       actions = entry.actions
       if len(actions) > 0:
         last_action = actions[-1]
@@ -161,38 +560,118 @@ class FlowTable (EventMixin):
     return entries
 
   def matching_entries(self, match, priority=0, strict=False, out_port=None):
-    return [ entry for entry in self._table if entry.is_matched_by(match, priority, strict, out_port) ]
+    if strict:
+      entries = self._strict.get((match._key(), priority), ())
+      return [ entry for entry in entries if entry.is_matched_by(match, priority, strict, out_port) ]
+
+    bits, src_prefix, dst_prefix = _match_mask(match)
+    bits = _INDEX_BITS & ~bits
+    if bits == 0 and src_prefix == 0 and dst_prefix == 0:
+      # Covers everything
+      found = list(self.entries)
+      if out_port is None:
+        return found
+      return [ entry for entry in found if entry.is_matched_by(match, out_port=out_port) ]
+
+    found = []
+    for group in self._groups.itervalues():
+      if (bits & ~group.required or group.src_prefix < src_prefix or
+          group.dst_prefix < dst_prefix):
+        continue
+      found += group.matched_by(match, bits, src_prefix, dst_prefix)
+    if len(found) * 8 > len(self):
+      found = set(entry for order, entry in found)
+      found = [ entry for entry in self.entries if entry in found ]
+    else:
+      found.sort()
+      found = [ entry for order, entry in found ]
+    if out_port is None:
+      return found
+    return [ entry for entry in found if entry.is_matched_by(match, out_port=out_port) ]
 
   def flow_stats(self, match, out_port=None, now=None):
-    return ( e.flow_stats() for e in self.matching_entries(match=match, strict=False, out_port=out_port))
+    if out_port == OFPP_NONE: out_port = None
+    return ( e.flow_stats(now) for e in self.matching_entries(match=match, strict=False, out_port=out_port))
+
+  def aggregate_stats(self, match, out_port=None):
+    if out_port == OFPP_NONE: out_port = None
+    entries = self.matching_entries(match=match, strict=False, out_port=out_port)
+    if len(entries) == len(self):
+      (byte_count, packet_count) = self._counters.totals()
+    else:
+      (byte_count, packet_count) = self._counters.totals(e._slot for e in entries)
+    return ofp_aggregate_stats(packet_count=packet_count, byte_count=byte_count, flow_count=len(entries))
 
   def expired_entries(self, now=None):
-    return [ entry for entry in self._table if entry.is_expired(now) ]
+    if now is None: now = time.time()
+    # The heap items that are due form a subtree at the top of the heap
+    heap = self._expiry_heap
+    expired = set()
+    todo = [0]
+    while todo:
+      i = todo.pop()
+      if i < len(heap) and heap[i][0] < now:
+        entry = heap[i][2]
+        if entry in self._entry_keys and entry.expiry_time() < now:
+          expired.add(entry)
+        todo += (2 * i + 1, 2 * i + 2)
+    return sorted(expired, key=lambda entry: self._entry_keys[entry][0])
 
   def remove_expired_entries(self, now=None):
-    remove_flows = self.expired_entries(now)
-    for entry in remove_flows:
-        self._table.remove(entry)
+    """ remove the expired entries, in one FlowTableModification. Only looks at the entries that
+    are due, so it is cheap to call often. """
+    if now is None: now = time.time()
+    heap = self._expiry_heap
+    remove_flows = []
+    expired = set()
+    while heap and heap[0][0] < now:
+      entry = heapq.heappop(heap)[2]
+      if entry not in self._entry_keys or entry in expired:
+        continue # removed since
+      if entry.expiry_time() < now:
+        remove_flows.append(entry)
+        expired.add(entry)
+      else:
+        self._schedule(entry) # touched since
+    self._remove(remove_flows)
     self.raiseEvent(FlowTableModification(removed=remove_flows))
     return remove_flows
 
   def remove_matching_entries(self, match, priority=0, strict=False):
     remove_flows = self.matching_entries(match, priority, strict)
-    for entry in remove_flows:
-        self._table.remove(entry)
+    self._remove(remove_flows)
     self.raiseEvent(FlowTableModification(removed=remove_flows))
     return remove_flows
 
   def entry_for_packet(self, packet, in_port):
     """ return the highest priority flow table entry that matches the given packet 
     on the given in_port, or None if no matching entry is found. """
-    packet_match = ofp_match.from_packet(packet, in_port)
+    return self.entry_for_match(ofp_match.from_packet(packet, in_port))
 
-    for entry in self._table:
-      if entry.match.matches_with_wildcards(packet_match, consider_other_wildcards=False):
-        return entry
-    else:
+  def entry_for_match(self, packet_match):
+    """
+    Same as entry_for_packet(), for the ofp_match of the packet (as from
+    ofp_match.from_packet() or from_raw())
+    """
+    if self._group_order is None:
+      self._group_order = sorted(self._groups.itervalues(),
+                                 key=lambda g: -g.max_rank)
+    w = packet_match.wildcards
+    src_prefix = _prefix_len(w, OFPFW_NW_SRC_SHIFT)
+    dst_prefix = _prefix_len(w, OFPFW_NW_DST_SHIFT)
+    best = None
+    for group in self._group_order:
+      if best is not None and group.max_rank < -best[0][0]:
+        break
+      if (w & group.required or group.src_prefix > src_prefix or
+          group.dst_prefix > dst_prefix):
+        continue
+      bucket = group.buckets.get(group.lookup_key(packet_match))
+      if bucket and (best is None or bucket[0][0] < best[0]):
+        best = bucket[0]
+    if best is None:
       return None
+    return best[1]
 
 class SwitchFlowTable(FlowTable):
   """ 
@@ -213,12 +692,10 @@ class SwitchFlowTable(FlowTable):
       return ("added", self.add_entry(TableEntry.from_flow_mod(flow_mod)))
     elif flow_mod.command == OFPFC_MODIFY or flow_mod.command == OFPFC_MODIFY_STRICT:
       is_strict = (flow_mod.command == OFPFC_MODIFY_STRICT)
-      modified = []
-      for entry in self._table:
+      modified = self.matching_entries(flow_mod.match, flow_mod.priority, strict=is_strict)
+      for entry in modified:
         # update the actions field in the matching flows
-        if(entry.is_matched_by(flow_mod.match, priority=flow_mod.priority, strict=is_strict)):
-          entry.actions = flow_mod.actions
-          modified.append(entry)
+        entry.actions = flow_mod.actions
       if(len(modified) == 0):
         # if no matching entry is found, modify acts as add
         return ("added", self.add_entry(TableEntry.from_flow_mod(flow_mod)))
@@ -227,7 +704,7 @@ class SwitchFlowTable(FlowTable):
 
     elif flow_mod.command == OFPFC_DELETE or flow_mod.command == OFPFC_DELETE_STRICT:
       is_strict = (flow_mod.command == OFPFC_DELETE_STRICT)
-      return ("removed", self.remove_matching_entries(flow_mod.match, flow_mod.priority, strict=True))
+      return ("removed", self.remove_matching_entries(flow_mod.match, flow_mod.priority, strict=is_strict))
     else:
       raise AttributeError("Command not yet implemented: %s" % flow_mod.command)
 
@@ -44,8 +44,62 @@ _PAD3 = _PAD*3
 _PAD4 = _PAD*4
 _PAD6 = _PAD*6
 
+# Precompiled structs for the most common messages
+_header_struct = struct.Struct("!BBHL")
+_match_struct = struct.Struct("!LH6s6sHBxHBBxxLLHH")
+_action_header_struct = struct.Struct("!HH")
+_action_output_struct = struct.Struct("!HHHH")
+_flow_mod_struct = struct.Struct("!QHHHHLHH")
+_packet_in_struct = struct.Struct("!LHHBx")
+_packet_out_struct = struct.Struct("!LHH")
+_flow_stats_head_struct = struct.Struct("!HBx")
+_flow_stats_struct = struct.Struct("!LLHHH6xQQQ")
+
+# Whether pack() runs the _assert() checks.  Turning this off saves time
+# when the messages are known to be well formed.
+ASSERT_STRUCTS = True
 
 EMPTY_ETH = EthAddr(None)
+_EMPTY_ETH_RAW = EMPTY_ETH.toRaw()
+
+def _eth_to_raw (addr):
+  """ Returns the 6 raw bytes of anything EthAddr() understands """
+  if type(addr) is EthAddr: return addr._value
+  if type(addr) is bytes and len(addr) == 6: return addr
+  return EthAddr(addr).toRaw()
+
+def _eth_from_raw (raw):
+  """ Returns an EthAddr for 6 raw bytes """
+  addr = EthAddr.__new__(EthAddr)
+  addr._value = raw
+  return addr
+
+# See IPAddr.__init__()
+_ip_host_struct = struct.Struct("I")
+_ip_net_struct = struct.Struct("!i")
+
+# For ofp_match.from_raw(): ethertype, 802.1Q tag, IPv4 header (version and
+# header length, tos, total length, protocol, addresses), ARP header (up to
+# the opcode), and the first two fields of TCP, UDP and ICMP headers
+_raw_uint16_struct = struct.Struct("!H")
+_raw_vlan_struct = struct.Struct("!HH")
+_raw_ipv4_struct = struct.Struct("!BBH5xB2xLL")
+_raw_arp_struct = struct.Struct("!4xBBH")
+_raw_ports_struct = struct.Struct("!HH")
+_raw_icmp_struct = struct.Struct("!BB")
+_raw_uint32_struct = struct.Struct("!L")
+
+def _ip_from_unsigned (value):
+  """ Returns an IPAddr for an int in host byte order """
+  addr = IPAddr.__new__(IPAddr)
+  addr._value = _ip_net_struct.unpack(_ip_host_struct.pack(value))[0]
+  return addr
+
+def _ip_to_unsigned (addr):
+  """ Returns an int or long for anything IPAddr() understands """
+  if type(addr) is int or type(addr) is long: return addr & 0xffFFffFF
+  if not isinstance(addr, IPAddr): addr = IPAddr(addr)
+  return addr.toUnsigned()
 
 MAX_XID = 0x7fFFffFF
 _nextXID = 1
@@ -94,20 +148,63 @@ class ofp_header (object):
   def pack (self, assertstruct=True):
     if self.xid is None:
       self.xid = generateXID()
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not ofp_header._assert(self)[0]):
         raise RuntimeError("assertstruct failed")
-    packed = ""
-    packed += struct.pack("!BBHL", self.version, self.header_type, self.length,
-                          self.xid)
-    return packed
+    return _header_struct.pack(self.version, self.header_type, self.length,
+                               self.xid)
 
   def unpack (self, binaryString):
     if (len(binaryString) < 8):
       return binaryString
-    (self.version, self.header_type, self.length, self.xid) = struct.unpack_from("!BBHL", binaryString, 0)
+    (self.version, self.header_type, self.length, self.xid) = _header_struct.unpack_from(binaryString, 0)
     return binaryString[8:]
 
+  @classmethod
+  def unpack_lazy (cls, binaryString):
+    """
+    Returns a message of this class with only the header unpacked from
+    binaryString.  The rest is unpacked on first access to any other
+    attribute, so binaryString must hold the whole message and must not
+    change afterwards.
+    """
+    self = cls.__new__(cls)
+    (self.version, self.header_type, self.length, self.xid) = _header_struct.unpack_from(binaryString, 0)
+    self._lazy_data = binaryString
+    return self
+
+  def __getattr__ (self, name):
+    # Only called for attributes that aren't set, which for a message from
+    # unpack_lazy() means that it hasn't been unpacked yet.
+    if name.startswith('__') or '_lazy_data' not in self.__dict__:
+      raise AttributeError("'%s' object has no attribute '%s'"
+                           % (type(self).__name__, name))
+    data = self.__dict__.pop('_lazy_data')
+    # Unpack into a new message so that fields which have already been set
+    # on this one (a new xid, say) are kept
+    unpacked = type(self)()
+    unpacked.unpack(data)
+    fields = self.__dict__
+    for k, v in unpacked.__dict__.iteritems():
+      if k not in fields:
+        fields[k] = v
+    return getattr(self, name)
+
+  def pack_lazy (self):
+    """
+    Like pack(), but a message from unpack_lazy() that hasn't been unpacked
+    since is packed by reusing its bytes.  Only the header fields can have
+    been set on such a message without unpacking it, so the header is
+    repacked from them.
+    """
+    fields = self.__dict__
+    data = fields.get('_lazy_data')
+    # Besides _lazy_data, only the four header fields are set until then
+    if data is None or len(fields) != 5 or self.length != len(data):
+      return self.pack()
+    return _header_struct.pack(self.version, self.header_type, self.length,
+                               self.xid) + data[8:]
+
   def __len__ (self):
     return self.length
 
@@ -160,7 +257,7 @@ class ofp_phy_port (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -267,7 +364,7 @@ class ofp_packet_queue (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -323,7 +420,7 @@ class ofp_queue_prop_header (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -367,7 +464,7 @@ class ofp_queue_prop_min_rate (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -403,6 +500,17 @@ class ofp_queue_prop_min_rate (object):
 
 ##2.3 Flow Match Structures
 class ofp_match (object):
+  """
+  The fields are kept in slots in their wire representation: addresses as
+  raw bytes (dl_src, dl_dst) and unsigned ints (nw_src, nw_dst), the rest
+  as ints.  The public attributes (in_port, dl_src, ...) are properties that
+  return None for wildcarded fields and EthAddr/IPAddr objects for
+  addresses, and set or clear the wildcards when assigned.
+  """
+  __slots__ = ('wildcards', '_in_port', '_dl_src', '_dl_dst', '_dl_vlan',
+               '_dl_vlan_pcp', '_dl_type', '_nw_tos', '_nw_proto', '_nw_src',
+               '_nw_dst', '_tp_src', '_tp_dst')
+
   @classmethod
   def from_packet (cls, packet, in_port = None):
     """ get a match that matches this packet, asuming it came in on in_port in_port
@@ -455,6 +563,97 @@ class ofp_match (object):
 
     return match
 
+  @classmethod
+  def from_raw (cls, data, in_port = None):
+    """
+    Same as from_packet(ethernet(data), in_port), but reads the fields
+    straight from the raw frame at their fixed offsets, without building
+    packet objects.  Frames with headers that pox.lib.packet would not
+    parse cleanly (truncated, bad IP header length, ...) go through
+    from_packet(), so the result is the same.  The only difference is that
+    payloads that do not show up in a match (e.g. LLDP) are not parsed, so
+    malformed ones do not raise.
+    """
+    n = len(data)
+    if n < 14:
+      return cls.from_packet(ethernet(data), in_port)
+
+    match = cls()
+    w = match.wildcards & ~(OFPFW_DL_SRC | OFPFW_DL_DST | OFPFW_DL_TYPE |
+                            OFPFW_DL_VLAN | OFPFW_DL_VLAN_PCP)
+    if in_port is not None:
+      match._in_port = in_port
+      w &= ~OFPFW_IN_PORT
+    match._dl_dst = data[0:6]
+    match._dl_src = data[6:12]
+    dl_type = _raw_uint16_struct.unpack_from(data, 12)[0]
+    offset = 14
+    if dl_type == ethernet.VLAN_TYPE:
+      if n < 18:
+        return cls.from_packet(ethernet(data), in_port)
+      tci, dl_type = _raw_vlan_struct.unpack_from(data, 14)
+      if dl_type == ethernet.VLAN_TYPE:
+        return cls.from_packet(ethernet(data), in_port)
+      match._dl_vlan = tci & 0x0fff
+      match._dl_vlan_pcp = tci >> 13
+      offset = 18
+    else:
+      match._dl_vlan = OFP_VLAN_NONE
+      match._dl_vlan_pcp = 0
+    match._dl_type = dl_type
+    dlen = n - offset
+
+    if dl_type == ethernet.IP_TYPE:
+      if dlen < 20:
+        return cls.from_packet(ethernet(data), in_port)
+      (vhl, tos, iplen, proto, src,
+       dst) = _raw_ipv4_struct.unpack_from(data, offset)
+      hl = (vhl & 0x0f) * 4
+      if vhl >> 4 != 4 or hl < 20 or iplen < 20 or hl >= iplen or hl > dlen:
+        return cls.from_packet(ethernet(data), in_port)
+      match._nw_tos = tos
+      match._nw_proto = proto
+      match._nw_src = src
+      match._nw_dst = dst
+      w &= ~(OFPFW_NW_TOS | OFPFW_NW_PROTO | OFPFW_NW_SRC_MASK |
+             OFPFW_NW_DST_MASK)
+
+      start = offset + hl
+      seglen = min(iplen, dlen) - hl
+      ports = None
+      if proto == ipv4.UDP_PROTOCOL:
+        if seglen >= 8:
+          ports = _raw_ports_struct.unpack_from(data, start)
+      elif proto == ipv4.TCP_PROTOCOL:
+        if seglen >= 20:
+          off = (ord(data[start + 12]) >> 4) * 4
+          # With options, only tcp itself knows whether it likes them
+          if off == 20 or (off > 20 and off <= seglen and
+                           tcp(raw=data[start:start + seglen]).parsed):
+            ports = _raw_ports_struct.unpack_from(data, start)
+      elif proto == ipv4.ICMP_PROTOCOL:
+        if seglen < 4:
+          return cls.from_packet(ethernet(data), in_port)
+        ports = _raw_icmp_struct.unpack_from(data, start)
+      if ports is not None:
+        match._tp_src, match._tp_dst = ports
+        w &= ~(OFPFW_TP_SRC | OFPFW_TP_DST)
+
+    elif dl_type == ethernet.ARP_TYPE or dl_type == ethernet.RARP_TYPE:
+      if dlen < 28:
+        return cls.from_packet(ethernet(data), in_port)
+      hwlen, protolen, opcode = _raw_arp_struct.unpack_from(data, offset)
+      if protolen != 4:
+        return cls.from_packet(ethernet(data), in_port)
+      if opcode <= 255:
+        match._nw_proto = opcode
+        match._nw_src = _raw_uint32_struct.unpack_from(data, offset + 14)[0]
+        match._nw_dst = _raw_uint32_struct.unpack_from(data, offset + 24)[0]
+        w &= ~(OFPFW_NW_PROTO | OFPFW_NW_SRC_MASK | OFPFW_NW_DST_MASK)
+
+    match.wildcards = w
+    return match
+
   def optimize (self):
     """
     Reduce the number of wildcards used.
@@ -472,7 +671,7 @@ class ofp_match (object):
           # Not IP or ARP
           self.nw_src = IPAddr(0)
           self.nw_dst = IPAddr(0)
-          eelf.nw_proto = 0
+          self.nw_proto = 0
         self.nw_tos = 0
         self.tp_src = 0
         self.tp_dst = 0
@@ -486,22 +685,41 @@ class ofp_match (object):
     return self # for chaining
 
   def clone (self):
-    n = ofp_match()
-    for k,v in ofp_match_data.iteritems():
-      setattr(n, '_' + k, getattr(self, '_' + k))
-    n.wildcards = self.wildcards
+    n = type(self).__new__(type(self))
+    n.__setstate__(self.__getstate__())
     return n
 
-  def __init__ (self, **kw):
-    for k,v in ofp_match_data.iteritems():
-      setattr(self, '_' + k, v[0])
+  def __getstate__ (self):
+    return (self.wildcards, self._in_port, self._dl_src, self._dl_dst,
+            self._dl_vlan, self._dl_vlan_pcp, self._dl_type, self._nw_tos,
+            self._nw_proto, self._nw_src, self._nw_dst, self._tp_src,
+            self._tp_dst)
 
-    self.wildcards = self._normalize_wildcards(OFPFW_ALL)
+  def __setstate__ (self, state):
+    (self.wildcards, self._in_port, self._dl_src, self._dl_dst,
+     self._dl_vlan, self._dl_vlan_pcp, self._dl_type, self._nw_tos,
+     self._nw_proto, self._nw_src, self._nw_dst, self._tp_src,
+     self._tp_dst) = state
+
+  def __init__ (self, **kw):
+    self.wildcards = _OFPFW_ALL_NORMALIZED
+    self._in_port = 0
+    self._dl_src = _EMPTY_ETH_RAW
+    self._dl_dst = _EMPTY_ETH_RAW
+    self._dl_vlan = 0
+    self._dl_vlan_pcp = 0
+    self._dl_type = 0
+    self._nw_tos = 0
+    self._nw_proto = 0
+    self._nw_src = 0
+    self._nw_dst = 0
+    self._tp_src = 0
+    self._tp_dst = 0
 
     # This is basically initHelper(), but tweaked slightly since this
     # class does some magic of its own.
     for k,v in kw.iteritems():
-      if not hasattr(self, '_'+k):
+      if k not in ofp_match_data:
         raise TypeError(self.__class__.__name__ + " constructor got "
           + "unexpected keyword argument '" + k + "'")
       setattr(self, k, v)
@@ -510,34 +728,33 @@ class ofp_match (object):
     if (self.wildcards & OFPFW_NW_DST_ALL) == OFPFW_NW_DST_ALL: return (None, 0)
 
     w = (self.wildcards & OFPFW_NW_DST_MASK) >> OFPFW_NW_DST_SHIFT
-    return (self._nw_dst,32-w if w <= 32 else 0)
+    return (_ip_from_unsigned(self._nw_dst),32-w if w <= 32 else 0)
 
   def get_nw_src (self):
     if (self.wildcards & OFPFW_NW_SRC_ALL) == OFPFW_NW_SRC_ALL: return (None, 0)
 
     w = (self.wildcards & OFPFW_NW_SRC_MASK) >> OFPFW_NW_SRC_SHIFT
-    return (self._nw_src,32-w if w <= 32 else 0)
+    return (_ip_from_unsigned(self._nw_src),32-w if w <= 32 else 0)
 
   def set_nw_dst (self, *args, **kw):
     a = self._make_addr(*args, **kw)
     if a == None:
-      self._nw_src = ofp_match_data['nw_dst'][0]
+      self._nw_dst = 0
       self.wildcards &= ~OFPFW_NW_DST_MASK
       self.wildcards |= ofp_match_data['nw_dst'][1]
       return
-    self._nw_dst = a[0]
+    self._nw_dst = _ip_to_unsigned(a[0])
     self.wildcards &= ~OFPFW_NW_DST_MASK
     self.wildcards |= ((32-a[1]) << OFPFW_NW_DST_SHIFT)
 
   def set_nw_src (self, *args, **kw):
     a = self._make_addr(*args, **kw)
-      # self.internal_links.add(Link(edge, edge.ports[port_no], host, host.interfaces[0]))
     if a == None:
-      self._nw_src = ofp_match_data['nw_src'][0]
+      self._nw_src = 0
       self.wildcards &= ~OFPFW_NW_SRC_MASK
       self.wildcards |= ofp_match_data['nw_src'][1]
       return
-    self._nw_src = a[0]
+    self._nw_src = _ip_to_unsigned(a[0])
     self.wildcards &= ~OFPFW_NW_SRC_MASK
     self.wildcards |= ((32-a[1]) << OFPFW_NW_SRC_SHIFT)
 
@@ -569,88 +786,49 @@ class ofp_match (object):
 
     return (ip, b)
 
-  def __setattr__ (self, name, value):
-    if name not in ofp_match_data:
-      self.__dict__[name] = value
-      return
-
-    if name == 'nw_dst' or name == 'nw_src':
-      # Special handling
-      getattr(self, 'set_' + name)(value)
-      return value
-
-    if value is None:
-      setattr(self, '_' + name, ofp_match_data[name][0])
-      self.wildcards |= ofp_match_data[name][1]
-    else:
-      setattr(self, '_' + name, value)
-      self.wildcards = self.wildcards & ~ofp_match_data[name][1]
-
-    return value
-
-  def __getattr__ (self, name):
-    if name in ofp_match_data:
-      if (self.wildcards & ofp_match_data[name][1]) == ofp_match_data[name][1]:
-        # It's wildcarded -- always return None
-        return None
-      if name == 'nw_dst' or name == 'nw_src':
-        # Special handling
-        return getattr(self, 'get_' + name)()[0]
-      return self.__dict__['_' + name]
-    raise AttributeError("attribute not found: "+name)
-
   def _assert (self):
-    #if not isinstance(self._dl_src, list):
-    #  return "self.dl_src is not list"
-    #if len(self._dl_src) != 6:
-    #  return "self.dl_src is not of size 6"
-    #if not isinstance(self._dl_dst, list):
-    #  return "self.dl_dst is not list"
     if len(self._dl_dst) != 6:
       return "self.dl_dst is not of size 6"
     return None
 
   def pack (self, assertstruct=True, flow_mod=False):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if self._assert() is not None:
         raise RuntimeError(self._assert())
 
-    packed = ""
-    packed += struct.pack("!LH", self._wire_wildcards(self.wildcards) if flow_mod else self.wildcards, self.in_port or 0)
-    if self.dl_src == None:
-      packed += EMPTY_ETH.toRaw()
-    elif type(self.dl_src) is bytes:
-      packed += self.dl_src
-    else:
-      packed += self.dl_src.toRaw()
-    if self.dl_dst == None:
-      packed += EMPTY_ETH.toRaw()
-    elif type(self.dl_dst) is bytes:
-      packed += self.dl_dst
+    # A wildcarded field packs as 0
+    w = self.wildcards
+    dl_type = None if w & OFPFW_DL_TYPE else self._dl_type
+    nw_proto = None if w & OFPFW_NW_PROTO else self._nw_proto
+
+    nw_tos = 0
+    nw_src = 0
+    nw_dst = 0
+    tp_src = 0
+    tp_dst = 0
+    if dl_type == 0x0800 or dl_type == 0x0806:
+      if (w & OFPFW_NW_SRC_ALL) != OFPFW_NW_SRC_ALL:
+        nw_src = self._nw_src
+      if (w & OFPFW_NW_DST_ALL) != OFPFW_NW_DST_ALL:
+        nw_dst = self._nw_dst
+      if dl_type == 0x0800:
+        nw_tos = 0 if w & OFPFW_NW_TOS else self._nw_tos
+        if nw_proto in (1,6,17):
+          tp_src = 0 if w & OFPFW_TP_SRC else self._tp_src
+          tp_dst = 0 if w & OFPFW_TP_DST else self._tp_dst
     else:
-      packed += self.dl_dst.toRaw()
-
-    def check_ip(val):
-      return (val or 0) if self.dl_type == 0x0800 else 0
-    def check_ip_or_arp(val):
-      return (val or 0) if self.dl_type == 0x0800 or self.dl_type == 0x0806 else 0
-    def check_tp(val):
-      return (val or 0) if self.dl_type == 0x0800 and self.nw_proto in (1,6,17) else 0
-
-    packed += struct.pack("!HB", self.dl_vlan or 0, self.dl_vlan_pcp or 0)
-    packed += _PAD # Hardcode padding
-    packed += struct.pack("!HBB", self.dl_type or 0, check_ip(self.nw_tos), check_ip_or_arp(self.nw_proto))
-    packed += _PAD2 # Hardcode padding
-    def fix (addr):
-      if addr is None: return 0
-      if type(addr) is int: return addr & 0xffFFffFF
-      if type(addr) is long: return addr & 0xffFFffFF
-      return addr.toUnsigned()
-    packed += struct.pack("!LLHH", check_ip_or_arp(fix(self.nw_src)), check_ip_or_arp(fix(self.nw_dst)),
-                          check_tp(self.tp_src), check_tp(self.tp_dst))
+      nw_proto = 0
+
+    return _match_struct.pack(self._wire_wildcards(w) if flow_mod else w,
+                              0 if w & OFPFW_IN_PORT else self._in_port,
+                              _EMPTY_ETH_RAW if w & OFPFW_DL_SRC else self._dl_src,
+                              _EMPTY_ETH_RAW if w & OFPFW_DL_DST else self._dl_dst,
+                              0 if w & OFPFW_DL_VLAN else self._dl_vlan,
+                              0 if w & OFPFW_DL_VLAN_PCP else self._dl_vlan_pcp,
+                              dl_type or 0, nw_tos, nw_proto or 0,
+                              nw_src, nw_dst, tp_src, tp_dst)
 #    if USE_MPLS_MATCH:
 #        packed += struct.pack("!IBxxx", self.mpls_label or 0, self.mpls_tc or 0)
-    return packed
 
   def _normalize_wildcards (self, wildcards):
     """ nw_src and nw_dst values greater than 32 mean the same thing as 32.
@@ -729,39 +907,52 @@ class ofp_match (object):
   def unpack (self, binaryString, flow_mod=False):
     if (len(binaryString) < self.__len__()):
       return binaryString
-    (wildcards, self._in_port) = struct.unpack_from("!LH", binaryString, 0)
-    self._dl_src = EthAddr(struct.unpack_from("!BBBBBB", binaryString, 6))
-    self._dl_dst = EthAddr(struct.unpack_from("!BBBBBB", binaryString, 12))
-    (self._dl_vlan, self._dl_vlan_pcp) = struct.unpack_from("!HB", binaryString, 18)
-    (self._dl_type, self._nw_tos, self._nw_proto) = struct.unpack_from("!HBB", binaryString, 22)
-    (self._nw_src, self._nw_dst, self._tp_src, self._tp_dst) = struct.unpack_from("!LLHH", binaryString, 28)
-    self._nw_src = IPAddr(self._nw_src)
-    self._nw_dst = IPAddr(self._nw_dst)
+    self._unpack_from(binaryString, 0, flow_mod)
+    return binaryString[self.__len__():]
+
+  def _unpack_from (self, binaryString, offset, flow_mod=False):
+    """
+    Unpacks the match at offset in binaryString, without slicing it
+    """
+    (wildcards, self._in_port, self._dl_src, self._dl_dst, self._dl_vlan,
+     self._dl_vlan_pcp, self._dl_type, self._nw_tos, self._nw_proto,
+     self._nw_src, self._nw_dst, self._tp_src, self._tp_dst) = \
+        _match_struct.unpack_from(binaryString, offset)
 #    if USE_MPLS_MATCH:
-#      (self.mpls_label, self.mpls_tc) = struct.unpack_from("!IBxxx", binaryString, 40)
+#      (self.mpls_label, self.mpls_tc) = struct.unpack_from("!IBxxx", binaryString, offset + 40)
     self.wildcards = self._normalize_wildcards(self._unwire_wildcards(wildcards) if flow_mod else wildcards) # Overide
-    return binaryString[self.__len__():]
 
   def __len__ (self):
  #   if USE_MPLS_MATCH:
  #     return 48
     return 40
 
+  def _key (self):
+    """
+    Returns a tuple of the wildcards and the fields, with the wildcarded
+    fields as None
+    """
+    w = self.wildcards
+    return (w,
+            None if w & OFPFW_IN_PORT else self._in_port,
+            None if w & OFPFW_DL_SRC else self._dl_src,
+            None if w & OFPFW_DL_DST else self._dl_dst,
+            None if w & OFPFW_DL_VLAN else self._dl_vlan,
+            None if w & OFPFW_DL_VLAN_PCP else self._dl_vlan_pcp,
+            None if w & OFPFW_DL_TYPE else self._dl_type,
+            None if w & OFPFW_NW_TOS else self._nw_tos,
+            None if w & OFPFW_NW_PROTO else self._nw_proto,
+            None if (w & OFPFW_NW_SRC_ALL) == OFPFW_NW_SRC_ALL else self._nw_src,
+            None if (w & OFPFW_NW_DST_ALL) == OFPFW_NW_DST_ALL else self._nw_dst,
+            None if w & OFPFW_TP_SRC else self._tp_src,
+            None if w & OFPFW_TP_DST else self._tp_dst)
+
   def hash_code (self):
     '''
     ofp_match is not properly hashable since it is mutable, but it can still be
     useful to easily generate a hash code.
     '''
-
-    h = self.wildcards
-    for f in ofp_match_data:
-      v = getattr(self, f)
-      if type(v) is int:
-        h ^= v
-      elif type(v) is long:
-        h ^= v
-
-    return int(h & 0x7fFFffFF)
+    return hash(self._key()) & 0x7fFFffFF
 
   def matches_with_wildcards (self, other, consider_other_wildcards=True):
     """
@@ -805,20 +996,7 @@ class ofp_match (object):
 
   def __eq__ (self, other):
     if type(self) != type(other): return False
-    if self.wildcards !=  other.wildcards: return False
-    if self.in_port !=  other.in_port: return False
-    if self.dl_src !=  other.dl_src: return False
-    if self.dl_dst !=  other.dl_dst: return False
-    if self.dl_vlan !=  other.dl_vlan: return False
-    if self.dl_vlan_pcp !=  other.dl_vlan_pcp: return False
-    if self.dl_type !=  other.dl_type: return False
-    if self.nw_tos !=  other.nw_tos: return False
-    if self.nw_proto !=  other.nw_proto: return False
-    if self.nw_src !=  other.nw_src: return False
-    if self.nw_dst !=  other.nw_dst: return False
-    if self.tp_src !=  other.tp_src: return False
-    if self.tp_dst !=  other.tp_dst: return False
-    return True
+    return self._key() == other._key()
 
   def __ne__ (self, other): return not self.__eq__(other)
 
@@ -851,7 +1029,7 @@ class ofp_match (object):
     outstr = ''
     outstr += prefix + 'wildcards: ' + show_wildcards(self.wildcards) + ' (' + binstr(self.wildcards) + ' = ' + hex(self.wildcards) + ')\n'
     def append (f, formatter=str):
-      v = self.__getattr__(f)
+      v = getattr(self, f)
       if v is None: return ''
       return prefix + f + ": " + formatter(v) + "\n"
     outstr += append('in_port')
@@ -897,6 +1075,10 @@ OFPFW_NW_DST_MASK      = 1032192
 # glob-all masks in the packet handling methods. (Esp. ofp_match.from_packet)
 # Otherwise, packets are not being matched as they should
 OFPFW_ALL              = ((1 << 22) - 1)
+# OFPFW_ALL with the nw_src and nw_dst wildcards normalized (see
+# ofp_match._normalize_wildcards())
+_OFPFW_ALL_NORMALIZED  = ((OFPFW_ALL & ~(OFPFW_NW_SRC_MASK | OFPFW_NW_DST_MASK))
+                          | (32 << OFPFW_NW_SRC_SHIFT) | (32 << OFPFW_NW_DST_SHIFT))
 
 ##2.4 Flow Action Structures
 ofp_action_type_rev_map = {
@@ -934,7 +1116,7 @@ class ofp_action_header (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -982,17 +1164,16 @@ class ofp_action_output (object):
   def pack (self, assertstruct=True):
     if self.port != OFPP_CONTROLLER:
       self.max_len = 0
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
-    packed = ""
-    packed += struct.pack("!HHHH", self.type, self.length, self.port, self.max_len)
-    return packed
+    return _action_output_struct.pack(self.type, self.length, self.port,
+                                      self.max_len)
 
   def unpack (self, binaryString):
     if (len(binaryString) < 8):
       return binaryString
-    (self.type, self.length, self.port, self.max_len) = struct.unpack_from("!HHHH", binaryString, 0)
+    (self.type, self.length, self.port, self.max_len) = _action_output_struct.unpack_from(binaryString, 0)
     return binaryString[8:]
 
   def __len__ (self):
@@ -1029,7 +1210,7 @@ class ofp_action_enqueue (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -1319,7 +1500,7 @@ class ofp_action_vlan_vid (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -1364,7 +1545,7 @@ class ofp_action_vlan_pcp (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -1424,7 +1605,7 @@ class ofp_action_dl_addr (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -1486,7 +1667,7 @@ class ofp_action_nw_addr (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -1529,7 +1710,7 @@ class ofp_action_nw_tos (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -1582,7 +1763,7 @@ class ofp_action_tp_port (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -1627,7 +1808,7 @@ class ofp_action_vendor_header (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -1682,7 +1863,7 @@ class ofp_features_reply (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -1769,7 +1950,7 @@ class ofp_switch_config (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -1850,24 +2031,26 @@ class ofp_flow_mod (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
-    packed = ""
     self.length = len(self)
-    packed += ofp_header.pack(self)
-    packed += self.match.pack(flow_mod=True)
-    packed += struct.pack("!QHHHHLHH", self.cookie, self.command, self.idle_timeout, self.hard_timeout, self.priority, self.buffer_id & 0xffffffff, self.out_port, self.flags)
+    parts = [ofp_header.pack(self), self.match.pack(flow_mod=True),
+             _flow_mod_struct.pack(self.cookie, self.command,
+                                   self.idle_timeout, self.hard_timeout,
+                                   self.priority,
+                                   self.buffer_id & 0xffffffff,
+                                   self.out_port, self.flags)]
     for i in self.actions:
-      packed += i.pack(assertstruct)
-    return packed
+      parts.append(i.pack(assertstruct))
+    return b''.join(parts)
 
   def unpack (self, binaryString):
     if (len(binaryString) < 72):
       return binaryString
-    ofp_header.unpack(self, binaryString[0:])
-    self.match.unpack(binaryString[8:], flow_mod=True)
-    (self.cookie, self.command, self.idle_timeout, self.hard_timeout, self.priority, self.buffer_id, self.out_port, self.flags) = struct.unpack_from("!QHHHHLHH", binaryString, 8 + len(self.match))
+    ofp_header.unpack(self, binaryString)
+    self.match._unpack_from(binaryString, 8, flow_mod=True)
+    (self.cookie, self.command, self.idle_timeout, self.hard_timeout, self.priority, self.buffer_id, self.out_port, self.flags) = _flow_mod_struct.unpack_from(binaryString, 8 + len(self.match))
     if self.buffer_id == 0xffffffff:
       self.buffer_id = -1
     self.actions, offset = _unpack_actions(binaryString, self.length-(32 + len(self.match)), 32 + len(self.match))
@@ -1916,6 +2099,66 @@ class ofp_flow_mod (ofp_header):
       outstr += obj.show(prefix + '  ')
     return outstr
 
+class flow_mod_template (object):
+  """
+  A flow-mod that is packed once, so that copies differing only in their
+  xid, in_port, tp_src, tp_dst, cookie or buffer_id can be made by writing
+  those fields into its bytes.
+  """
+  # Offsets into a packed ofp_flow_mod
+  _WILDCARDS = 8
+  _IN_PORT = 12
+  _TP_SRC = 44
+  _TP_DST = 46
+  _COOKIE = 48
+  _BUFFER_ID = 64
+
+  def __init__ (self, flow_mod):
+    self._data = bytearray(flow_mod.pack())
+    (self._wildcards,) = struct.unpack_from("!L", self._data,
+                                            self._WILDCARDS)
+    match = flow_mod.match
+    # Transport ports are only packed for TCP, UDP and ICMP over IP
+    self._has_tp = match.dl_type == 0x0800 and match.nw_proto in (1,6,17)
+
+  def pack (self, xid = None, in_port = None, tp_src = None, tp_dst = None,
+            cookie = None, buffer_id = None):
+    """
+    Returns the bytes of a flow-mod with the given fields changed.  Each
+    one gets a new xid unless xid is given.  Setting a match field clears
+    its wildcard.
+    """
+    data = bytearray(self._data)
+    w = self._wildcards
+    struct.pack_into("!L", data, 4, generateXID() if xid is None else xid)
+    if in_port is not None:
+      struct.pack_into("!H", data, self._IN_PORT, in_port)
+      w &= ~OFPFW_IN_PORT
+    if tp_src is not None or tp_dst is not None:
+      if not self._has_tp:
+        raise ValueError("flow-mod doesn't match on TCP, UDP or ICMP")
+      if tp_src is not None:
+        struct.pack_into("!H", data, self._TP_SRC, tp_src)
+        w &= ~OFPFW_TP_SRC
+      if tp_dst is not None:
+        struct.pack_into("!H", data, self._TP_DST, tp_dst)
+        w &= ~OFPFW_TP_DST
+    if w != self._wildcards:
+      struct.pack_into("!L", data, self._WILDCARDS, w)
+    if cookie is not None:
+      struct.pack_into("!Q", data, self._COOKIE, cookie)
+    if buffer_id is not None:
+      struct.pack_into("!L", data, self._BUFFER_ID, buffer_id & 0xffffffff)
+    return bytes(data)
+
+  def make (self, **kw):
+    """
+    Like pack(), but returns an ofp_flow_mod which is only unpacked if its
+    fields are accessed (see ofp_header.unpack_lazy()).  Until then,
+    Connection.send() sends its bytes as they are.
+    """
+    return ofp_flow_mod.unpack_lazy(self.pack(**kw))
+
 ofp_flow_mod_command_rev_map = {
   'OFPFC_ADD'           : 0,
   'OFPFC_MODIFY'        : 1,
@@ -1951,7 +2194,7 @@ class ofp_port_mod (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2013,7 +2256,7 @@ class ofp_queue_get_config_request (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2061,7 +2304,7 @@ class ofp_queue_get_config_reply (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2128,7 +2371,7 @@ class ofp_stats_request (ofp_header):
         self.type = OFPST_AGGREGATE
       elif self.body_data == b'':
         self.type = OFPST_DESC # Maybe shouldn't assume this?
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2211,7 +2454,7 @@ class ofp_stats_reply (ofp_header):
       self.type = ofp_stats_reply_class_to_type_map[type(self.body)]
 
     self.length = len(self)
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2230,7 +2473,7 @@ class ofp_stats_reply (ofp_header):
 
   def __len__ (self):
     l = 12
-    l += len(self.body)
+    l += len(self.body_data)
     return l
 
   def __eq__ (self, other):
@@ -2300,7 +2543,7 @@ class ofp_desc_stats (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2357,7 +2600,7 @@ class ofp_flow_stats_request (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2415,26 +2658,26 @@ class ofp_flow_stats (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
-    packed = ""
-    packed += struct.pack("!HBB", self.length, self.table_id, 0)
-    packed += self.match.pack()
-    packed += struct.pack("!LLHHH", self.duration_sec, self.duration_nsec, self.priority, self.idle_timeout, self.hard_timeout)
-    packed += _PAD6 # Pad
-    packed += struct.pack("!QQQ", self.cookie, self.packet_count, self.byte_count)
+    parts = [_flow_stats_head_struct.pack(self.length, self.table_id),
+             self.match.pack(),
+             _flow_stats_struct.pack(self.duration_sec, self.duration_nsec,
+                                     self.priority, self.idle_timeout,
+                                     self.hard_timeout, self.cookie,
+                                     self.packet_count, self.byte_count)]
     for i in self.actions:
-      packed += i.pack(assertstruct)
-    return packed
+      parts.append(i.pack(assertstruct))
+    return b''.join(parts)
 
   def unpack (self, binaryString):
     if (len(binaryString) < 48 + len(self.match)):
       return binaryString
-    (self.length, self.table_id, pad) = struct.unpack_from("!HBB", binaryString, 0)
-    self.match.unpack(binaryString[4:])
-    (self.duration_sec, self.duration_nsec, self.priority, self.idle_timeout, self.hard_timeout) = struct.unpack_from("!LLHHH", binaryString, 4 + len(self.match))
-    (self.cookie, self.packet_count, self.byte_count) = struct.unpack_from("!QQQ", binaryString, 24 + len(self.match))
+    (self.length, self.table_id) = _flow_stats_head_struct.unpack_from(binaryString, 0)
+    self.match._unpack_from(binaryString, 4)
+    (self.duration_sec, self.duration_nsec, self.priority, self.idle_timeout, self.hard_timeout,
+     self.cookie, self.packet_count, self.byte_count) = _flow_stats_struct.unpack_from(binaryString, 4 + len(self.match))
     self.actions,offset = _unpack_actions(binaryString, self.length - (48 + len(self.match)), 48 + len(self.match))
     assert offset == self.length
     assert self.length == len(self)
@@ -2497,7 +2740,7 @@ class ofp_aggregate_stats_request (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2544,7 +2787,7 @@ class ofp_aggregate_stats (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2598,7 +2841,7 @@ class ofp_table_stats (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2652,7 +2895,7 @@ class ofp_port_stats_request (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2703,7 +2946,7 @@ class ofp_port_stats (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2786,7 +3029,7 @@ class ofp_queue_stats_request (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2833,7 +3076,7 @@ class ofp_queue_stats (object):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -2922,7 +3165,7 @@ class ofp_packet_out (ofp_header):
     return True
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if self._assert() is not True:
         raise RuntimeError(self._assert())
 
@@ -2935,19 +3178,19 @@ class ofp_packet_out (ofp_header):
 
     if self.data is not None:
       return b''.join((ofp_header.pack(self),
-      struct.pack("!LHH", self.buffer_id & 0xffFFffFF, self.in_port, actions_len),
+      _packet_out_struct.pack(self.buffer_id & 0xffFFffFF, self.in_port, actions_len),
       actions,
       self.data))
     else:
       return b''.join((ofp_header.pack(self),
-      struct.pack("!LHH", self.buffer_id & 0xffFFffFF, self.in_port, actions_len),
+      _packet_out_struct.pack(self.buffer_id & 0xffFFffFF, self.in_port, actions_len),
       actions))
 
   def unpack (self, binaryString):
     if (len(binaryString) < 16):
       return binaryString
-    ofp_header.unpack(self, binaryString[0:])
-    (self.buffer_id, self.in_port, actions_len) = struct.unpack_from("!LHH", binaryString, 8)
+    ofp_header.unpack(self, binaryString)
+    (self.buffer_id, self.in_port, actions_len) = _packet_out_struct.unpack_from(binaryString, 8)
     if self.buffer_id == 0xffFFffFF:
       self.buffer_id = -1
     self.actions,offset = _unpack_actions(binaryString, actions_len, 16)
@@ -2993,7 +3236,7 @@ class ofp_barrier_reply (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         raise RuntimeError("assertstruct failed")
     packed = ""
@@ -3033,7 +3276,7 @@ class ofp_barrier_request (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -3096,29 +3339,31 @@ class ofp_packet_in (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         raise AssertionError(self._assert()[1])
-    packed = ""
     # need to update the self.length field for ofp_header.pack to put the correct value in the packed
     # array. this sucks.
     self.length = len(self)
     self._total_len = len(self) # TODO: Is this correct?
-    packed += ofp_header.pack(self)
-    packed += struct.pack("!LHHBB", self.buffer_id & 0xffFFffFF, self._total_len, self.in_port, self.reason, 0)
-    packed += self.data
-    return packed
+    return b''.join((ofp_header.pack(self),
+                     _packet_in_struct.pack(self.buffer_id & 0xffFFffFF,
+                                            self._total_len, self.in_port,
+                                            self.reason),
+                     self.data))
 
   def unpack (self, binaryString):
     if (len(binaryString) < 18):
       return binaryString
-    ofp_header.unpack(self, binaryString[0:])
-    (self.buffer_id, self._total_len, self.in_port, self.reason, pad) = struct.unpack_from("!LHHBB", binaryString, 8)
+    ofp_header.unpack(self, binaryString)
+    (self.buffer_id, self._total_len, self.in_port, self.reason) = _packet_in_struct.unpack_from(binaryString, 8)
     if self.buffer_id == 0xFFffFFff:
       self.buffer_id = -1
     if (len(binaryString) < self.length):
       return binaryString
-    self.data = binaryString[18:self.length]
+    # Slices of str and buffer are str, so the data setter's checks aren't
+    # needed
+    self._data = binaryString[18:self.length]
     return binaryString[self.length:]
 
   def __len__ (self):
@@ -3176,7 +3421,7 @@ class ofp_flow_removed (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -3256,7 +3501,7 @@ class ofp_port_status (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -3315,7 +3560,7 @@ class ofp_error (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     self.length = len(self)
@@ -3437,7 +3682,7 @@ class ofp_hello (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -3477,7 +3722,7 @@ class ofp_echo_request (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = b""
@@ -3525,7 +3770,7 @@ class ofp_echo_reply (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = b""
@@ -3574,7 +3819,7 @@ class ofp_vendor_header (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -3620,7 +3865,7 @@ class ofp_vendor (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     self.length = 12 + len(self.data)
@@ -3675,7 +3920,7 @@ class ofp_features_request (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -3715,7 +3960,7 @@ class ofp_get_config_request (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -3758,7 +4003,7 @@ class ofp_get_config_reply (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -3807,7 +4052,7 @@ class ofp_set_config (ofp_header):
     return (True, None)
 
   def pack (self, assertstruct=True):
-    if(assertstruct):
+    if(assertstruct and ASSERT_STRUCTS):
       if(not self._assert()[0]):
         return None
     packed = ""
@@ -3894,7 +4139,7 @@ def _unpack_actions (b, length, offset=0):
   actions = []
   end = length + offset
   while offset < end:
-    (t,l) = struct.unpack_from("!HH", b, offset)
+    (t,l) = _action_header_struct.unpack_from(b, offset)
     if (len(b) - offset) < l: return ([], offset)
     a = _action_map.get(t)
     if a is None:
@@ -4071,3 +4316,48 @@ ofp_match_data = {
 #  'mpls_label': (0, OFPFW_MPLS_LABEL),
 #  'mpls_tc': (0, OFPFW_MPLS_TC),
 }
+
+def _make_match_property (name, wildcard):
+  """ Makes the property for ofp_match field name """
+  slot = '_' + name
+  if name == 'nw_src' or name == 'nw_dst':
+    # Special handling
+    getter = getattr(ofp_match, 'get_' + name)
+    setter = getattr(ofp_match, 'set_' + name)
+    return property(lambda self: getter(self)[0], setter)
+
+  get = operator.attrgetter(slot)
+  if name == 'dl_src' or name == 'dl_dst':
+    default = _EMPTY_ETH_RAW
+    def fget (self):
+      if self.wildcards & wildcard:
+        # It's wildcarded -- always return None
+        return None
+      return _eth_from_raw(get(self))
+    def fset (self, value):
+      if value is None:
+        setattr(self, slot, default)
+        self.wildcards |= wildcard
+      else:
+        setattr(self, slot, _eth_to_raw(value))
+        self.wildcards &= ~wildcard
+  else:
+    default = ofp_match_data[name][0]
+    def fget (self):
+      if self.wildcards & wildcard:
+        # It's wildcarded -- always return None
+        return None
+      return get(self)
+    def fset (self, value):
+      if value is None:
+        setattr(self, slot, default)
+        self.wildcards |= wildcard
+      else:
+        setattr(self, slot, value)
+        self.wildcards &= ~wildcard
+
+  return property(fget, fset)
+
+for _name, (_default, _wildcard) in ofp_match_data.iteritems():
+  setattr(ofp_match, _name, _make_match_property(_name, _wildcard))
+del _name, _default, _wildcard
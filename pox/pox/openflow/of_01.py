@@ -27,8 +27,9 @@ import pox.lib.util
 from pox.lib.revent.revent import EventMixin
 import datetime
 from pox.lib.socketcapture import CaptureSocket
+from pox.lib.epoll_select import EdgeTriggeredEpoll
 import pox.openflow.debug
-from pox.openflow.util import make_type_to_class_table
+from pox.openflow.util import make_type_to_class_table, ReceiveBuffer
 from pox.openflow.connection_arbiter import *
 
 from pox.openflow import *
@@ -38,24 +39,15 @@ log = core.getLogger()
 import socket
 import select
 
-try:
-  PIPE_BUF = select.PIPE_BUF
-except:
-  try:
-    # Try to get it from where PyPy (sometimes) has it
-    import IN
-    PIPE_BUF = IN.PIPE_BUF
-  except:
-    # (Hopefully) reasonable default
-    PIPE_BUF = 512
-
 import pox.openflow.libopenflow_01 as of
 
 import threading
+import collections
 import os
 import sys
+import time
 import exceptions
-from errno import EAGAIN, ECONNRESET
+from errno import EAGAIN, EWOULDBLOCK, ECONNRESET
 
 
 import traceback
@@ -187,11 +179,9 @@ def handle_OFPST_DESC (con, parts):
   con.raiseEventNoErrors(SwitchDescReceived, con, parts[0], msg)
 
 def handle_OFPST_FLOW (con, parts):
-  msg = []
-  for part in parts:
-    msg += _processStatsBody(part.body, of.ofp_flow_stats())
-  con.ofnexus.raiseEventNoErrors(FlowStatsReceived, con, parts, msg)
-  con.raiseEventNoErrors(FlowStatsReceived, con, parts, msg)
+  # The entries are only unpacked if a listener asks for event.stats
+  con.ofnexus.raiseEventNoErrors(FlowStatsReceived, con, parts)
+  con.raiseEventNoErrors(FlowStatsReceived, con, parts)
 
 def handle_OFPST_AGGREGATE (con, parts):
   msg = of.ofp_aggregate_stats_reply()
@@ -253,114 +243,6 @@ statsHandlerMap = {
   of.OFPST_QUEUE : handle_OFPST_QUEUE,
 }
 
-# Deferred sending should be unusual, so don't worry too much about
-# efficiency
-class DeferredSender (threading.Thread):
-  """
-  Class that handles sending when a socket write didn't complete
-  """
-  def __init__ (self):
-    # Threads, not recoco?
-    threading.Thread.__init__(self)
-    self._dataForConnection = {}
-    self._lock = threading.RLock()
-    self._waker = pox.lib.util.makePinger()
-    self.daemon = True
-    self.sending = False
-
-    self.start()
-
-  def _sliceup (self, data):
-    """
-    Takes an array of data bytes, and slices into elements of
-    PIPE_BUF bytes each
-    """
-    out = []
-    while len(data) > PIPE_BUF:
-      out.append(data[0:PIPE_BUF])
-      data = data[PIPE_BUF:]
-    if len(data) > 0:
-      out.append(data)
-    return out
-
-  def send (self, con, data):
-    with self._lock:
-      self.sending = True
-
-      data = self._sliceup(data)
-
-      if con not in self._dataForConnection:
-        self._dataForConnection[con] = data
-      else:
-        self._dataForConnection[con].extend(data)
-
-      self._waker.ping()
-
-  def kill (self, con):
-    with self._lock:
-      try:
-        del self._dataForConnection[con]
-      except:
-        pass
-
-      self._waker.ping()
-
-  def run (self):
-    while core.running:
-
-      with self._lock:
-        cons = self._dataForConnection.keys()
-
-      rlist, wlist, elist = select.select([self._waker], cons, cons, 1)
-      if not core.running: break
-
-      with self._lock:
-        if len(rlist) > 0:
-          self._waker.pongAll()
-
-        for con in elist:
-          try:
-            del self._dataForConnection[con]
-          except:
-            pass
-
-        for con in wlist:
-          try:
-            alldata = self._dataForConnection[con]
-            while len(alldata):
-              data = alldata[0]
-              try:
-                l = con.sock.send(data)
-                if l != len(data):
-                  alldata[0] = data[l:]
-                  break
-                del alldata[0]
-              except socket.error as (errno, strerror):
-                if errno != EAGAIN:
-                  con.msg("DeferredSender/Socket error: " + strerror)
-                  con.disconnect()
-                  del self._dataForConnection[con]
-                break
-              except:
-                con.msg("Unknown error doing deferred sending")
-                break
-            if len(alldata) == 0:
-              try:
-                del self._dataForConnection[con]
-                if len(self._dataForConnection) == 0:
-                  self.sending = False
-                  break
-              except:
-                pass
-          except:
-            try:
-              del self._dataForConnection[con]
-            except:
-              pass
-
-# Used by the Connection class below
-deferredSender = DeferredSender()
-
 class DummyOFNexus (object):
   def raiseEventNoErrors (self, event, *args, **kw):
     log.warning("%s raised on dummy OpenFlow nexus" % event)
@@ -426,6 +308,10 @@ class OFCaptureSocket (CaptureSocket):
 
   def _send_out (self, buf, r):
     if not self._enabled: return
+    # Only what was sent; from the send queue, buf is a memoryview
+    buf = buf[:r]
+    if isinstance(buf, memoryview):
+      buf = buf.tobytes()
     self._sbuf += buf
     l = len(self._sbuf)
     while l > 4:
@@ -469,11 +355,20 @@ class Connection (EventMixin):
     PortStatsReceived,
     QueueStatsReceived,
     FlowRemoved,
+    SendBacklogHigh,
+    SendBacklogLow,
   ])
   
   # Globally unique identifier for the Connection instance
   ID = 0
 
+  # Bytes waiting for the switch's socket above which SendBacklogHigh is
+  # raised, down to which it has to drain for SendBacklogLow, and above
+  # which the switch is considered stuck and disconnected
+  send_high_water = 1 << 20
+  send_low_water = 1 << 18
+  max_send_backlog = 1 << 26
+
   def msg (self, m):
     #print str(self), m
     log.debug(str(self) + " " + str(m))
@@ -485,14 +380,34 @@ class Connection (EventMixin):
     #print str(self), m
     log.info(str(self) + " " + str(m))
 
-  def __init__ (self, sock):
+  def __init__ (self, sock, received = None):
+    """
+    received holds bytes that were already read from sock by someone that
+    also sent our HELLO (see pox.openflow.sharding); they are parsed with
+    process_buffer() before anything else is read.
+    """
     self._previous_stats = []
 
     self.ofnexus = _dummyOFNexus
     self.sock = sock
     self._sock_lock = threading.Lock()
-    self._delayed_action = DelayedAction()
-    self.buf = ''
+    self._delayed_action = DelayedAction(self._receive)
+    # Messages released together by the DelayedAction, waiting to be written
+    # to the socket in one send()
+    self._send_batch = []
+    self._send_batch_lock = threading.Lock()
+    self._send_message_count = 0
+    self._send_call_count = 0
+    # What the socket didn't take yet, as memoryviews, in order.  The
+    # OpenFlow task writes it out with flush_send_queue() when the socket
+    # becomes writable; _send_waker (set by the task) tells it to look.
+    self._send_queue = collections.deque()
+    self._send_backlog = 0
+    self._send_backlog_high = False
+    self._send_waker = None
+    self._create_time = time.time()
+    # Messages are unpacked when a handler first looks past the header
+    self.buf = ReceiveBuffer(classes, lazy = True)
     Connection.ID += 1
     self.ID = Connection.ID
     # TODO: dpid and features don't belong here; they should be eventually
@@ -502,7 +417,10 @@ class Connection (EventMixin):
     self.disconnected = False
     self.connect_time = None
 
-    self.send(of.ofp_hello())
+    if received is None:
+      self.send(of.ofp_hello())
+    else:
+      self.buf.feed(received)
 
     #TODO: set a time that makes sure we actually establish a connection by
     #      some timeout
@@ -549,13 +467,10 @@ class Connection (EventMixin):
     if self.dpid != None:
       self.ofnexus.raiseEventNoErrors(ConnectionDown(self))
 
-    try:
-      #deferredSender.kill(self)
-      pass
-    except:
-      pass
     try:
         with self._sock_lock:
+            self._send_queue.clear()
+            self._send_backlog = 0
             self.sock.shutdown(socket.SHUT_RDWR)
     except:
       pass
@@ -577,33 +492,135 @@ class Connection (EventMixin):
     if self.disconnected: return
     data_bytes = data
     if type(data) is not bytes:
-      if hasattr(data, 'pack'):
+      # A message from unpack_lazy() that hasn't been unpacked yet (e.g., from
+      # a flow_mod_template) still holds its bytes
+      if isinstance(data, of.ofp_header):
+        data_bytes = data.pack_lazy()
+      elif hasattr(data, 'pack'):
         data_bytes = data.pack()
 
     self._delayed_action.add_job(data, self._delayed_send, data_bytes)
 
 
-  def _delayed_send(self, data):
-    
-    if deferredSender.sending:
-      log.debug("deferred sender is sending!")
-      deferredSender.send(self, data)
+  def _delayed_send (self, data):
+    """
+    Sends data once the DelayedAction releases it.  Messages released
+    together are concatenated and written with a single send().
+    """
+    with self._send_batch_lock:
+      self._send_batch.append(data)
+      if len(self._send_batch) > 1:
+        return
+
+    if not self._delayed_action.call_after_release(self._flush_send_batch):
+      self._flush_send_batch()
+
+  def _flush_send_batch (self):
+    with self._send_batch_lock:
+      batch = self._send_batch
+      if not batch: return
+      self._send_batch = []
+      self._send_message_count += len(batch)
+      self._send_call_count += 1
+    if len(batch) == 1:
+      self._send_now(batch[0])
+    else:
+      self._send_now(b''.join(batch))
+
+  def get_send_stats (self):
+    """
+    Returns a dict with the number of messages sent, the number of
+    socket send() calls used for them, and the send() calls per second that
+    coalescing saved since this connection was created.
+    """
+    saved = self._send_message_count - self._send_call_count
+    return {'messages' : self._send_message_count,
+            'send_calls' : self._send_call_count,
+            'saved_send_calls_per_sec' :
+              saved / max(time.time() - self._create_time, 1e-6)}
+
+  @property
+  def send_backlog (self):
+    """
+    Bytes sent to this connection that the socket hasn't taken yet
+    """
+    return self._send_backlog
+
+  def _send_now (self, data):
+    """
+    Writes data to the socket.  Whatever the socket doesn't take is queued,
+    and so is everything sent while the queue isn't empty.
+    """
+    if self.disconnected: return
+    error = None
+    raise_high = False
+    wake = False
+    with self._sock_lock:
+      if not self._send_queue:
+        try:
+          l = self.sock.send(data)
+        except socket.error as (errno, strerror):
+          if errno != EAGAIN:
+            error = strerror
+          l = 0
+        if l == len(data) or error is not None:
+          data = None
+        else:
+          data = memoryview(data)[l:]
+          wake = True
+      if data is not None:
+        self._send_queue.append(memoryview(data))
+        self._send_backlog += len(data)
+        if self._send_backlog > self.max_send_backlog:
+          error = "%i bytes not taken by the switch" % (self._send_backlog,)
+        elif (self._send_backlog > self.send_high_water and
+              not self._send_backlog_high):
+          self._send_backlog_high = True
+          raise_high = True
+
+    if error is not None:
+      self.msg("Socket error: " + error)
+      self.disconnect()
+      return
+    if wake and self._send_waker is not None:
+      self._send_waker.ping()
+    if raise_high:
+      self.ofnexus.raiseEventNoErrors(SendBacklogHigh, self)
+      self.raiseEventNoErrors(SendBacklogHigh, self)
+
+  def flush_send_queue (self):
+    """
+    Writes as much of the queued data as the socket takes.  Called by the
+    OpenFlow task when the socket is writable.
+    """
+    error = None
+    raise_low = False
+    with self._sock_lock:
+      queue = self._send_queue
+      while queue:
+        data = queue[0]
+        try:
+          l = self.sock.send(data)
+        except socket.error as (errno, strerror):
+          if errno != EAGAIN:
+            error = strerror
+          break
+        self._send_backlog -= l
+        if l != len(data):
+          queue[0] = data[l:]
+          break
+        queue.popleft()
+      if self._send_backlog_high and self._send_backlog <= self.send_low_water:
+        self._send_backlog_high = False
+        raise_low = True
+
+    if error is not None:
+      self.msg("Socket error: " + error)
+      self.disconnect()
       return
-    try:
-      with self._sock_lock:
-        l = self.sock.send(data)
-      if l != len(data):
-        self.msg("Didn't send complete buffer.")
-        data = data[l:]
-        deferredSender.send(self, data)
-    except socket.error as (errno, strerror):
-      if errno == EAGAIN:
-        self.msg("Out of send buffer space.  " +
-                 "Consider increasing SO_SNDBUF.")
-        deferredSender.send(self, data)
-      else:
-        self.msg("Socket error: " + strerror)
-        self.disconnect()
+    if raise_low:
+      self.ofnexus.raiseEventNoErrors(SendBacklogLow, self)
+      self.raiseEventNoErrors(SendBacklogLow, self)
 
 
 
@@ -615,29 +632,26 @@ class Connection (EventMixin):
     Note: This function will block if data is not available.
     """
     with self._sock_lock:
-        d = self.sock.recv(2048)
-    if len(d) == 0:
+        n = self.buf.recv(self.sock)
+    if n == 0:
       return False
-    self.buf += d
-    l = len(self.buf)
-    while l > 4:
-      if ord(self.buf[0]) != of.OFP_VERSION:
-        log.warning("Bad OpenFlow version (" + str(ord(self.buf[0])) +
-                    ") on connection " + str(self))
-        return False
+    return self.process_buffer()
+
+  def process_buffer (self):
+    """
+    Handles the complete messages that have been received.  Returns False
+    if the stream is not OpenFlow 1.0.
+    """
+    while True:
       # OpenFlow parsing occurs here:
-      ofp_type = ord(self.buf[1])
-      packet_length = ord(self.buf[2]) << 8 | ord(self.buf[3])
-      if packet_length > l: break
-      msg = classes[ofp_type]()
-      # msg.unpack implicitly only examines its own bytes, and not trailing
-      # bytes 
-      msg.unpack(self.buf)
-      self.buf = self.buf[packet_length:]
-      l = len(self.buf)
       try:
-        h = handlers[ofp_type]
-        self._delayed_action.add_job(msg, h, self, msg)
+        msg = self.buf.next_message()
+      except ValueError as e:
+        log.warning(str(e) + " on connection " + str(self))
+        return False
+      if msg is None: break
+      try:
+        self._receive(msg)
       except:
         log.exception("%s: Exception while handling OpenFlow message:\n" +
                       "%s %s", self,self,
@@ -645,6 +659,14 @@ class Connection (EventMixin):
         continue
     return True
 
+  def _receive (self, msg):
+    """
+    Hands a message from the switch to its handler, once the DelayedAction
+    releases it.
+    """
+    h = handlers[msg.header_type]
+    self._delayed_action.add_job(msg, h, self, msg)
+
   def _incoming_stats_reply (self, ofp):
     # This assumes that you don't receive multiple stats replies
     # to different requests out of order/interspersed.
@@ -705,11 +727,18 @@ from pox.lib.recoco.recoco import *
 class OpenFlow_01_Task (Task):
   """
   The main recoco thread for listening to openflow messages
+
+  With use_epoll, the listener and connections stay registered with an
+  edge-triggered epoll, and the task only selects on the epoll fd, so that
+  a wakeup costs in proportion to the ready connections rather than all of
+  them.  This also lifts select()'s FD_SETSIZE limit.
   """
-  def __init__ (self, port = 6633, address = '0.0.0.0'):
-    Task.__init__(self)
+  def __init__ (self, port = 6633, address = '0.0.0.0', use_epoll = False):
+    # run() is called by Task.__init__
     self.port = int(port)
     self.address = address
+    self.use_epoll = use_epoll
+    Task.__init__(self)
 
     core.addListener(pox.core.GoingUpEvent, self._handle_GoingUpEvent)
 
@@ -717,15 +746,37 @@ class OpenFlow_01_Task (Task):
     self.start()
 
   def run (self):
-    # List of open sockets/connections to select on
-    sockets = []
+    if self.use_epoll:
+      return self._run_epoll()
+    return self._run_select()
 
+  def _listen (self):
     listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     listener.bind((self.address, self.port))
-    listener.listen(16)
+    listener.listen(16 if not self.use_epoll else socket.SOMAXCONN)
+    return listener
+
+  def _accept (self, listener):
+    new_sock = listener.accept()[0]
+    if pox.openflow.debug.pcap_traces:
+      new_sock = wrap_socket(new_sock)
+    new_sock.setblocking(0)
+    # Note that instantiating a Connection object fires a
+    # ConnectionUp event (after negotation has completed)
+    return Connection(new_sock)
+
+  def _run_select (self):
+    # List of open sockets/connections to select on
+    sockets = []
+
+    listener = self._listen()
     sockets.append(listener)
 
+    # Pinged by connections that start queueing data, so that we select on
+    # them for writing
+    waker = pox.lib.util.makePinger()
+
     log.debug("Listening for connections on %s:%s" %
               (self.address, self.port))
 
@@ -734,7 +785,9 @@ class OpenFlow_01_Task (Task):
       try:
         while True:
           con = None
-          rlist, wlist, elist = yield Select(sockets, [], sockets, 5)
+          writers = [c for c in sockets if c is not listener and c.send_backlog]
+          rlist, wlist, elist = yield Select(sockets + [waker], writers,
+                                             sockets, 5)
           if len(rlist) == 0 and len(wlist) == 0 and len(elist) == 0:
             """
             try:
@@ -759,16 +812,18 @@ class OpenFlow_01_Task (Task):
               except:
                 pass
 
+          for con in wlist:
+            if con in sockets:
+              con.flush_send_queue()
+
           for con in rlist:
-            if con is listener:
-              new_sock = listener.accept()[0]
-              if pox.openflow.debug.pcap_traces:
-                new_sock = wrap_socket(new_sock)
-              new_sock.setblocking(0)
-              # Note that instantiating a Connection object fires a
-              # ConnectionUp event (after negotation has completed)
-              newcon = Connection(new_sock)
-              sockets.append( newcon )
+            if con is waker:
+              waker.pongAll()
+            elif con is listener:
+              newcon = self._accept(listener)
+              if newcon is not None:
+                newcon._send_waker = waker
+                sockets.append( newcon )
               #print str(newcon) + " connected"
             else:
               if con.read() is False:
@@ -802,6 +857,86 @@ class OpenFlow_01_Task (Task):
 
     #pox.core.quit()
 
+  def _run_epoll (self):
+    # Connections are registered for writability too.  Being edge-triggered,
+    # that is only reported when a full socket buffer drains, which is when
+    # their send queues need flushing.
+    poller = EdgeTriggeredEpoll()
+    con_mask = select.EPOLLIN | select.EPOLLPRI | select.EPOLLOUT
+
+    listener = self._listen()
+    listener.setblocking(0)
+    poller.register(listener)
+
+    log.debug("Listening for connections on %s:%s (epoll)" %
+              (self.address, self.port))
+
+    def drop (con):
+      poller.unregister(con)
+      try:
+        con.close()
+      except:
+        pass
+
+    while core.running:
+      rlist, wlist, elist = yield Select([poller], [], [], 5)
+      if not core.running: break
+      if len(rlist) == 0: continue
+
+      rlist, wlist, elist = poller.poll(0)
+
+      for con in wlist:
+        if con is not listener:
+          con.flush_send_queue()
+
+      # Events are only reported when readiness changes, so we accept and
+      # read until the socket would block.
+      for con in rlist:
+        try:
+          if con is listener:
+            while True:
+              try:
+                newcon = self._accept(listener)
+              except socket.error as e:
+                if e.args[0] in (EAGAIN, EWOULDBLOCK): break
+                raise
+              if newcon is not None:
+                poller.register(newcon, con_mask)
+          else:
+            while True:
+              try:
+                if con.read() is False:
+                  drop(con)
+                  break
+              except socket.error as e:
+                if e.args[0] in (EAGAIN, EWOULDBLOCK): break
+                raise
+        except exceptions.KeyboardInterrupt:
+          poller.close()
+          return
+        except:
+          if con is listener:
+            log.exception("Exception on OpenFlow listener.  Aborting.")
+            poller.close()
+            return
+          if (sys.exc_info()[0] is socket.error and
+              sys.exc_info()[1][0] == ECONNRESET):
+            con.info("Connection reset")
+          else:
+            log.exception("Exception reading connection " + str(con))
+          drop(con)
+
+      for con in elist:
+        if con is listener:
+          log.error("Error on OpenFlow listener.  Aborting.")
+          poller.close()
+          return
+        if con in poller:
+          drop(con)
+
+    poller.close()
+    log.debug("No longer listening for connections")
+
 classes.extend( make_type_to_class_table())
 
 handlers.extend([None] * (1 + sorted(handlerMap.keys(), reverse=True)[0]))
@@ -810,10 +945,25 @@ for h in handlerMap:
   #print handlerMap[h]
 
 
-def launch (port = 6633, address = "0.0.0.0"):
+def launch (port = 6633, address = "0.0.0.0", epoll = False, workers = 0,
+            unchecked = False):
+  """
+  With workers > 1, switch connections are sharded by DPID across that many
+  worker processes; see pox.openflow.sharding.  With unchecked, messages
+  are packed without running their _assert() checks.
+  """
   if core.hasComponent('of_01'):
     return None
-  l = OpenFlow_01_Task(port = int(port), address = address)
+  use_epoll = pox.lib.util.str_to_bool(epoll)
+  if pox.lib.util.str_to_bool(unchecked):
+    of.ASSERT_STRUCTS = False
+  if int(workers) > 1:
+    from pox.openflow.sharding import ShardFrontEnd
+    l = ShardFrontEnd(int(workers), port = int(port), address = address,
+                      use_epoll = use_epoll)
+  else:
+    l = OpenFlow_01_Task(port = int(port), address = address,
+                         use_epoll = use_epoll)
   core.register("of_01", l)
   return l
 
@@ -0,0 +1,359 @@
+"""
+Shards switch connections across worker processes.
+
+With "openflow.of_01 --workers=N", this process becomes a front end that
+only accepts switch connections.  Once it has learned a switch's DPID, it
+hands the socket to worker dpid % N.  The workers are forks of the
+controller, made while going up, each with its own recoco scheduler.  They
+run the OpenFlow connections they are handed, and with them DelayedAction
+and the components' handlers, so that the control plane uses N cores.
+
+To learn the DPID, the front end sends HELLO and a FEATURES_REQUEST and
+waits for the FEATURES_REPLY.  It then passes the socket on, along with
+everything the switch has sent except that reply.  So the worker's
+Connection sees the switch's HELLO, sends its own FEATURES_REQUEST and
+connects as usual.
+
+Components that need a global view (topology, discovery) can exchange events
+across processes through core.shards: publish(name, *args) raises a
+ShardEvent in every process, including the one that published it, and in
+the same order everywhere.  Arguments must be picklable.  Workers publish
+ConnectionUp and ConnectionDown with the DPID, so core.shards.dpids maps
+every connected DPID to its worker in all processes.
+
+Workers are forked first thing when going up, after all components have
+launched.  GoingUpEvent and UpEvent handlers run in every process, but
+tasks and timers that components started before going up only run in the
+front end.
+"""
+
+from pox.core import core
+import pox
+import pox.lib.util
+import pox.lib.recoco.recoco as recoco
+from pox.lib.recoco.recoco import Task, Select
+from pox.lib.revent import Event, EventMixin
+from pox.openflow.of_01 import OpenFlow_01_Task, Connection, wrap_socket
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.debug
+
+import multiprocessing
+from multiprocessing import reduction
+import os
+import socket
+import struct
+import threading
+import time
+from errno import EAGAIN
+
+log = core.getLogger()
+
+# How long a switch has to answer our FEATURES_REQUEST
+HANDSHAKE_TIMEOUT = 30
+
+# Priority of the GoingUpEvent handler that forks the workers, so that the
+# handlers of all other components run after the fork, in every process
+FORK_PRIORITY = 1 << 30
+
+
+class ShardEvent (Event):
+  """
+  An event published through core.shards.  shard is the worker that
+  published it, or None for the front end.
+  """
+  def __init__ (self, shard, name, args):
+    Event.__init__(self)
+    self.shard = shard
+    self.name = name
+    self.args = args
+
+
+class ShardChannel (EventMixin):
+  """
+  Registered as core.shards in the front end and in every worker.
+  """
+  _eventMixin_events = set([ShardEvent])
+
+  def __init__ (self, workers):
+    self.workers = workers
+    self.shard = None      # Our worker index, or None in the front end
+    self.dpids = {}        # DPID -> worker index
+    self._conns = []       # Front end: pipes to the workers, by index
+    self._conn = None      # Worker: pipe to the front end
+    self._lock = threading.Lock()
+
+  def publish (self, name, *args):
+    """
+    Raises ShardEvent(shard, name, args) in all processes.  May be called
+    from any thread.
+    """
+    if self.shard is None:
+      self._relay(('event', None, name, args))
+    else:
+      with self._lock:
+        self._conn.send(('event', self.shard, name, args))
+
+  def _relay (self, item):
+    """ Front end: passes an event on to all workers and raises it here """
+    kind, shard, name, args = item
+    with self._lock:
+      for conn in self._conns:
+        if conn is None: continue
+        try:
+          conn.send(item)
+        except (IOError, OSError):
+          pass
+    self._raise(shard, name, args)
+
+  def _raise (self, shard, name, args):
+    if name == 'ConnectionUp':
+      self.dpids[args[0]] = shard
+    elif name == 'ConnectionDown':
+      self.dpids.pop(args[0], None)
+    self.raiseEventNoErrors(ShardEvent, shard, name, args)
+
+  def _send_socket (self, shard, dpid, sock, received):
+    """ Front end: hands sock over to a worker """
+    with self._lock:
+      conn = self._conns[shard]
+      conn.send(('socket', dpid, received))
+      reduction.send_handle(conn, sock.fileno(), None)
+
+  def _receive (self):
+    """
+    Worker: handles one item from the front end.  Returns (dpid, sock,
+    received) for a handed-over switch, or None for an event.  Raises
+    socket.error with EAGAIN if nothing is pending, and EOFError if the
+    front end is gone.
+    """
+    if not self._conn.poll():
+      raise socket.error(EAGAIN, "Nothing pending")
+    item = self._conn.recv()
+    if item[0] == 'event':
+      self._raise(*item[1:])
+      return None
+    kind, dpid, received = item
+    fd = reduction.recv_handle(self._conn)
+    sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+    os.close(fd)
+    return (dpid, sock, received)
+
+  # Lets a worker task select on the channel like on a listening socket
+  def fileno (self):
+    return self._conn.fileno()
+
+  def setblocking (self, flag):
+    pass
+
+  def close (self):
+    self._conn.close()
+
+
+class PendingSwitch (object):
+  """
+  A switch connection that the front end is waiting on for its DPID
+  """
+  def __init__ (self, sock):
+    self.sock = sock
+    self.peer = sock.getpeername()
+    self.dpid = None
+    self.start_time = time.time()
+    self._data = b''
+    self._forward = []
+
+    request = of.ofp_features_request()
+    data = of.ofp_hello().pack() + request.pack() # Assigns the xid
+    self._xid = request.xid
+    sock.sendall(data)
+
+  def fileno (self):
+    return self.sock.fileno()
+
+  def read (self):
+    """
+    Reads what the switch has sent.  Returns False if it has closed the
+    connection or does not speak OpenFlow 1.0.
+    """
+    d = self.sock.recv(4096)
+    if len(d) == 0:
+      return False
+    self._data += d
+    while len(self._data) >= 4:
+      version, ofp_type, length = struct.unpack_from("!BBH", self._data)
+      if version != of.OFP_VERSION or length < of.OFP_HEADER_BYTES:
+        return False
+      if length > len(self._data): break
+      raw = self._data[:length]
+      self._data = self._data[length:]
+      if (self.dpid is None and ofp_type == of.OFPT_FEATURES_REPLY
+          and struct.unpack_from("!L", raw, 4)[0] == self._xid):
+        reply = of.ofp_features_reply()
+        reply.unpack(raw)
+        self.dpid = reply.datapath_id
+      else:
+        self._forward.append(raw)
+    return True
+
+  def received (self):
+    """ What the switch has sent, except the FEATURES_REPLY """
+    return b''.join(self._forward) + self._data
+
+
+class ShardWorkerTask (OpenFlow_01_Task):
+  """
+  Runs the connections that the front end hands to this worker
+  """
+  def __init__ (self, channel, port, address, use_epoll = False):
+    # Not OpenFlow_01_Task.__init__(); this is started directly
+    self.channel = channel
+    self.port = port
+    self.address = address
+    self.use_epoll = use_epoll
+    Task.__init__(self)
+
+  def _listen (self):
+    return self.channel
+
+  def _accept (self, listener):
+    try:
+      item = self.channel._receive()
+    except EOFError:
+      log.info("Front end is gone; worker %i exiting", self.channel.shard)
+      os._exit(0)
+    if item is None:
+      return None
+    dpid, sock, received = item
+    if pox.openflow.debug.pcap_traces:
+      sock = wrap_socket(sock)
+    sock.setblocking(0)
+    con = Connection(sock, received)
+    if con.process_buffer() is False:
+      con.close()
+      return None
+    return con
+
+
+class ShardFrontEnd (OpenFlow_01_Task):
+  """
+  Accepts switch connections and hands them to worker processes by DPID
+  """
+  def __init__ (self, workers, port = 6633, address = '0.0.0.0',
+                use_epoll = False):
+    self.workers = workers
+    self.channel = ShardChannel(workers)
+    core.register("shards", self.channel)
+    OpenFlow_01_Task.__init__(self, port, address, use_epoll)
+    core.addListener(pox.core.GoingUpEvent, self._fork_workers,
+                     priority = FORK_PRIORITY)
+
+  def _fork_workers (self, event):
+    pipes = [multiprocessing.Pipe() for i in range(self.workers)]
+    for shard in range(self.workers):
+      pid = os.fork()
+      if pid == 0:
+        for i, (a, b) in enumerate(pipes):
+          a.close()
+          if i != shard: b.close()
+        self._become_worker(shard, pipes[shard][1])
+        return
+      log.debug("Forked worker %i (pid %i)", shard, pid)
+    for a, b in pipes:
+      b.close()
+    self.channel._conns = [a for a, b in pipes]
+
+  def _become_worker (self, shard, conn):
+    self.channel.shard = shard
+    self.channel._conn = conn
+
+    # The scheduler threads did not survive the fork
+    core.scheduler = recoco.Scheduler(isDefaultScheduler = True, daemon = True)
+
+    # Leave the console to the front end
+    import __main__
+    if hasattr(__main__, '_opt_no_cli'):
+      __main__._opt_no_cli(True)
+
+    if core.hasComponent('openflow'):
+      core.openflow.addListenerByName("ConnectionUp", lambda event:
+          self.channel.publish('ConnectionUp', event.dpid))
+      core.openflow.addListenerByName("ConnectionDown", lambda event:
+          self.channel.publish('ConnectionDown', event.dpid))
+
+  def _handle_GoingUpEvent (self, event):
+    if self.channel.shard is None:
+      self.start()
+    else:
+      ShardWorkerTask(self.channel, self.port, self.address,
+                      self.use_epoll).start()
+
+  def run (self):
+    listener = self._listen()
+    pending = set()
+
+    log.debug("Listening for connections on %s:%s (%i workers)" %
+              (self.address, self.port, self.workers))
+
+    def drop (p):
+      pending.discard(p)
+      try:
+        p.sock.close()
+      except:
+        pass
+
+    while core.running:
+      workers = [c for c in self.channel._conns if c is not None]
+      rlist, wlist, elist = yield Select([listener] + workers + list(pending),
+                                         [], [], 5)
+
+      for r in rlist:
+        if r is listener:
+          new_sock = None
+          try:
+            new_sock = listener.accept()[0]
+            pending.add(PendingSwitch(new_sock))
+          except socket.error:
+            log.exception("Exception accepting connection")
+            if new_sock is not None:
+              new_sock.close()
+        elif r in pending:
+          try:
+            ok = r.read()
+          except socket.error:
+            ok = False
+          if not ok:
+            drop(r)
+          elif r.dpid is not None:
+            self._hand_off(r)
+            drop(r)
+        else:
+          try:
+            self.channel._relay(r.recv())
+          except (EOFError, IOError):
+            shard = self.channel._conns.index(r)
+            log.error("Worker %i is gone", shard)
+            self.channel._conns[shard] = None
+
+      now = time.time()
+      for p in list(pending):
+        if now - p.start_time > HANDSHAKE_TIMEOUT:
+          log.warning("No FEATURES_REPLY from %s", p.peer)
+          drop(p)
+
+    log.debug("No longer listening for connections")
+
+  def _hand_off (self, p):
+    shard = p.dpid % self.workers
+    if self.channel._conns[shard] is None:
+      log.error("Dropping %s: worker %i is gone",
+                pox.lib.util.dpidToStr(p.dpid), shard)
+      return
+    try:
+      self.channel._send_socket(shard, p.dpid, p.sock, p.received())
+    except (IOError, OSError, socket.error):
+      # It died before we saw EOF on its pipe
+      log.error("Dropping %s from %s: worker %i is gone",
+                pox.lib.util.dpidToStr(p.dpid), p.peer, shard)
+      self.channel._conns[shard] = None
+      return
+    log.debug("Handed %s to worker %i", pox.lib.util.dpidToStr(p.dpid),
+              shard)
@@ -18,7 +18,7 @@ from pox.lib.util import assert_type
 from pox.lib.revent import Event, EventMixin
 from pox.openflow.libopenflow_01 import *
 from pox.openflow.util import make_type_to_class_table
-from pox.openflow.flow_table import SwitchFlowTable
+from pox.openflow.flow_table import SwitchFlowTable, FlowTableModification
 from pox.lib.packet import *
 
 from errno import EAGAIN
@@ -38,6 +38,83 @@ class DpPacketOut (Event):
     # For backwards compatability:
     self.switch = node
 
+def _packet_key(packet, in_port):
+  """ the header fields that ofp_match.from_packet() reads, as a hashable tuple """
+  p = packet.next
+  if isinstance(p, vlan):
+    dl = (in_port, packet.src, packet.dst, p.eth_type, p.id, p.pcp)
+    p = p.next
+  else:
+    dl = (in_port, packet.src, packet.dst, packet.type)
+  if isinstance(p, ipv4):
+    q = p.next
+    if isinstance(q, udp) or isinstance(q, tcp):
+      return (dl, p.srcip, p.dstip, p.protocol, p.tos, q.srcport, q.dstport)
+    elif isinstance(q, icmp):
+      return (dl, p.srcip, p.dstip, p.protocol, p.tos, q.type, q.code)
+    return (dl, p.srcip, p.dstip, p.protocol, p.tos)
+  elif isinstance(p, arp):
+    return (dl, arp, p.opcode, p.protosrc, p.protodst)
+  return dl
+
+class MicroflowCache(object):
+  """
+  Exact-match cache of flow table lookups in front of a SwitchFlowTable,
+  keyed on the header fields of the packets, like the microflow cache of
+  Open vSwitch.  Cached results carry the table's generation, which goes up
+  with every FlowTableModification that adds or removes entries, so they
+  are only used while the table is unchanged.  (Modified actions need no
+  invalidation, as the cache holds the entries themselves.)
+
+  Eviction is LRU in batches, without bookkeeping on hits: results go into
+  a dict of up to max_size/2, and when it is full it becomes the old one,
+  replacing the previous old one.  Hits in the old dict move to the new.
+  """
+  def __init__(self, table, max_size=4096):
+    self.table = table
+    self.max_size = max_size
+    self.generation = 0
+    self.hits = 0
+    self.misses = 0
+    self._recent = {}
+    self._old = {}
+    table.addListener(FlowTableModification, self._handle_FlowTableModification)
+
+  def _handle_FlowTableModification(self, event):
+    if event.added or event.removed:
+      self.generation += 1
+
+  def __len__(self):
+    return len(self._recent) + len(self._old)
+
+  @property
+  def hit_rate(self):
+    lookups = self.hits + self.misses
+    return float(self.hits) / lookups if lookups else 0.0
+
+  def entry_for_packet(self, packet, in_port):
+    """ same as SwitchFlowTable.entry_for_packet() """
+    key = _packet_key(packet, in_port)
+    cached = self._recent.get(key)
+    if cached is None:
+      cached = self._old.pop(key, None)
+      if cached is not None:
+        self._store(key, cached)
+    if cached is not None and cached[0] == self.generation:
+      self.hits += 1
+      return cached[1]
+    self.misses += 1
+    entry = self.table.entry_for_packet(packet, in_port)
+    self._store(key, (self.generation, entry))
+    return entry
+
+  def _store(self, key, value):
+    recent = self._recent
+    if len(recent) >= self.max_size // 2 and key not in recent:
+      self._old = recent
+      recent = self._recent = {}
+    recent[key] = value
+
 def _default_port_list(num_ports=4, prefix=0):
   return [ofp_phy_port(port_no=i, hw_addr=EthAddr("00:00:00:00:%2x:%2x" % (prefix % 255, i))) for i in range(1, num_ports+1)]
 
@@ -46,7 +123,7 @@ class SwitchImpl(EventMixin):
 
   # ports is a list of ofp_phy_ports
   def __init__(self, dpid, name=None, ports=4, miss_send_len=128,
-      n_buffers=100, n_tables=1, capabilities=None):
+      n_buffers=100, n_tables=1, capabilities=None, microflow_cache_size=4096):
     """Initialize switch"""
     ##Datapath id of switch
     self.dpid = dpid
@@ -61,6 +138,10 @@ class SwitchImpl(EventMixin):
     self.n_tables= n_tables
     # Note that there is one switch table in the OpenFlow 1.0 world
     self.table = SwitchFlowTable()
+    # Lookups for process_packet(); None if disabled
+    self.microflow_cache = None
+    if microflow_cache_size:
+      self.microflow_cache = MicroflowCache(self.table, microflow_cache_size)
     # buffer for packets during packet_in
     self.packet_buffer = []
     if(ports == None or isinstance(ports, int)):
@@ -195,7 +276,7 @@ class SwitchImpl(EventMixin):
     def aggregate_stats(ofp):
       req = ofp_aggregate_stats_request().unpack(ofp.body)
       assert(self.table_id == TABLE_ALL)
-      return self.table.aggregate_stats(req.match, out_port)
+      return self.table.aggregate_stats(req.match, req.out_port)
 
     def table_stats(ofp):
       return self.table.table_stats()
@@ -298,7 +379,10 @@ class SwitchImpl(EventMixin):
     assert_type("packet", packet, ethernet, none_ok=False)
     assert_type("in_port", in_port, int, none_ok=False)
 
-    entry = self.table.entry_for_packet(packet, in_port)
+    if self.microflow_cache is not None:
+      entry = self.microflow_cache.entry_for_packet(packet, in_port)
+    else:
+      entry = self.table.entry_for_packet(packet, in_port)
     if(entry != None):
       entry.touch_packet(len(packet))
       self._process_actions_for_packet(entry.actions, packet, in_port)
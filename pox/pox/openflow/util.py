@@ -4,8 +4,19 @@ Created on Feb 27, 2012
 @author: rcs
 '''
 
+import array
+import struct
+
 import pox.openflow.libopenflow_01 as of
 
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+# version, type, length
+_header_struct = struct.Struct("!BBH")
+
 # See "classes"
 def make_type_to_class_table ():
   classes = {}
@@ -22,4 +33,240 @@ def make_type_to_class_table ():
   if len(classes) != max + 1:
     raise "Bad protocol to class mapping"
 
-  return [classes[i] for i in range(0, max)]
\ No newline at end of file
+  return [classes[i] for i in range(0, max)]
+
+
+class ReceiveBuffer (object):
+  """
+  Receive buffer for the OpenFlow byte stream of one connection.
+
+  Data is received straight into a bytearray with recv_into(), and messages
+  are unpacked from a read-only buffer() view at the read offset, so no bytes
+  are copied per message.  Unread bytes are moved to the front only when
+  there isn't enough room left behind them, and the buffer grows only when a
+  single message doesn't fit.
+
+  With lazy, messages are returned with only their header unpacked (see
+  ofp_header.unpack_lazy()), and hold a copy of their bytes instead.
+  """
+  def __init__ (self, classes = None, size = 65536, recv_size = 2048,
+                lazy = False):
+    """
+    classes maps OFPT_* types to message classes; see
+    make_type_to_class_table().  Each recv() reads at least recv_size bytes
+    if that many are available.
+    """
+    if classes is None:
+      classes = make_type_to_class_table()
+    self._classes = classes
+    self._recv_size = recv_size
+    self._lazy = lazy
+    self._data = bytearray(max(size, recv_size))
+    self._start = 0 # Read offset
+    self._end = 0   # Write offset
+
+  def __len__ (self):
+    return self._end - self._start
+
+  def _reserve (self, size):
+    """
+    Makes sure there are at least size free bytes after the write offset.
+    """
+    if self._start == self._end:
+      self._start = self._end = 0
+    if len(self._data) - self._end >= size:
+      return
+    if self._start:
+      l = self._end - self._start
+      self._data[0:l] = self._data[self._start:self._end]
+      self._start = 0
+      self._end = l
+    if len(self._data) - self._end < size:
+      self._data.extend(bytearray(max(size, len(self._data))))
+
+  def recv (self, sock):
+    """
+    Receives as much as fits from sock.  Returns the number of bytes read,
+    which is 0 if the peer has closed the connection.
+    """
+    self._reserve(self._recv_size)
+    view = memoryview(self._data)
+    try:
+      n = sock.recv_into(view[self._end:])
+    finally:
+      del view
+    self._end += n
+    return n
+
+  def feed (self, data):
+    """
+    Appends data, as if it had been received.
+    """
+    self._reserve(len(data))
+    self._data[self._end:self._end + len(data)] = data
+    self._end += len(data)
+
+  def next_message (self):
+    """
+    Unpacks and returns the next message, or None if the buffer does not
+    hold a complete one yet.  Raises ValueError if the stream is not
+    OpenFlow 1.0.
+    """
+    start = self._start
+    available = self._end - start
+    if available < _header_struct.size:
+      return None
+    version, ofp_type, length = _header_struct.unpack_from(self._data, start)
+    if version != of.OFP_VERSION:
+      raise ValueError("Bad OpenFlow version (" + str(version) + ")")
+    if length < of.OFP_HEADER_BYTES:
+      raise ValueError("Bad OpenFlow message length (" + str(length) + ")")
+    if length > available:
+      return None
+    if self._lazy:
+      msg = self._classes[ofp_type].unpack_lazy(
+          buffer(self._data, start, length)[:])
+    else:
+      msg = self._classes[ofp_type]()
+      msg.unpack(buffer(self._data, start, length))
+    self._start = start + length
+    return msg
+
+
+# length, table_id
+_flow_stats_prefix_struct = struct.Struct("!HB")
+
+def walk_flow_stats (parts):
+  """
+  Walks the ofp_flow_stats entries in the bodies of the OFPST_FLOW
+  ofp_stats_reply parts without unpacking them.  Yields (table_id, entry)
+  for each one, where entry is a buffer() over its bytes.  Raises
+  ValueError if an entry's length is bad.
+  """
+  for part in parts:
+    body = part.body
+    offset = 0
+    end = len(body)
+    while offset < end:
+      if end - offset < of.OFP_FLOW_STATS_BYTES:
+        raise ValueError("Truncated flow stats entry")
+      length, table_id = _flow_stats_prefix_struct.unpack_from(body, offset)
+      if length < of.OFP_FLOW_STATS_BYTES or length > end - offset:
+        raise ValueError("Bad flow stats entry length (" + str(length) + ")")
+      yield table_id, buffer(body, offset, length)
+      offset += length
+
+def iter_flow_stats (parts):
+  """
+  Yields the ofp_flow_stats entries in the bodies of the OFPST_FLOW
+  ofp_stats_reply parts, unpacking each one as it is reached.
+  """
+  for table_id, entry in walk_flow_stats(parts):
+    stats = of.ofp_flow_stats()
+    stats.unpack(entry)
+    yield stats
+
+def count_flow_stats (parts):
+  """
+  Returns a dict of table_id -> number of flow stats entries in the
+  OFPST_FLOW ofp_stats_reply parts, without unpacking the entries.
+  """
+  counts = {}
+  for table_id, entry in walk_flow_stats(parts):
+    counts[table_id] = counts.get(table_id, 0) + 1
+  return counts
+
+
+# The fixed part of ofp_flow_stats, as (name, struct format, numpy dtype,
+# array typecode).  Names starting with "_" are padding.
+_flow_stats_fields = [
+  ('length',        'H',  '>u2', 'H'),
+  ('table_id',      'B',  'u1',  'B'),
+  ('_pad',          'x',  'V1',  None),
+  ('wildcards',     'L',  '>u4', 'I'),
+  ('in_port',       'H',  '>u2', 'H'),
+  ('dl_src',        '6s', 'S6',  None),
+  ('dl_dst',        '6s', 'S6',  None),
+  ('dl_vlan',       'H',  '>u2', 'H'),
+  ('dl_vlan_pcp',   'B',  'u1',  'B'),
+  ('_pad1',         'x',  'V1',  None),
+  ('dl_type',       'H',  '>u2', 'H'),
+  ('nw_tos',        'B',  'u1',  'B'),
+  ('nw_proto',      'B',  'u1',  'B'),
+  ('_pad2',         '2x', 'V2',  None),
+  ('nw_src',        'L',  '>u4', 'I'),
+  ('nw_dst',        'L',  '>u4', 'I'),
+  ('tp_src',        'H',  '>u2', 'H'),
+  ('tp_dst',        'H',  '>u2', 'H'),
+  ('duration_sec',  'L',  '>u4', 'I'),
+  ('duration_nsec', 'L',  '>u4', 'I'),
+  ('priority',      'H',  '>u2', 'H'),
+  ('idle_timeout',  'H',  '>u2', 'H'),
+  ('hard_timeout',  'H',  '>u2', 'H'),
+  ('_pad3',         '6x', 'V6',  None),
+  ('cookie',        'Q',  '>u8', 'L'),
+  ('packet_count',  'Q',  '>u8', 'L'),
+  ('byte_count',    'Q',  '>u8', 'L'),
+]
+
+_flow_stats_fixed_struct = struct.Struct(
+    "!" + "".join(f[1] for f in _flow_stats_fields))
+assert _flow_stats_fixed_struct.size == of.OFP_FLOW_STATS_BYTES
+
+if np is not None:
+  _flow_stats_dtype = np.dtype([(f[0], f[2]) for f in _flow_stats_fields])
+  assert _flow_stats_dtype.itemsize == of.OFP_FLOW_STATS_BYTES
+
+class FlowStatsColumns (object):
+  """
+  The ofp_flow_stats entries of OFPST_FLOW ofp_stats_reply parts, decoded
+  straight from the raw bodies into one column per field of the fixed part
+  (length, table_id, the match fields, durations, priority, timeouts,
+  cookie and counters; not the actions).
+
+  With numpy, every column is a numpy array in native byte order, so that
+  e.g. (cols.table_id == 2).sum() or cols.byte_count[cols.tp_dst == 80]
+  work as usual.  Without numpy, the columns are array.array (lists of
+  strings for dl_src and dl_dst).
+
+  The match columns hold what the switch sent, also for wildcarded fields;
+  look at the wildcards column to tell them apart.  nw_src and nw_dst are
+  unsigned ints, and dl_src and dl_dst raw 6-byte strings.
+  """
+  names = [f[0] for f in _flow_stats_fields if not f[0].startswith('_')]
+
+  def __init__ (self, parts):
+    fixed = [entry[:of.OFP_FLOW_STATS_BYTES]
+             for table_id, entry in walk_flow_stats(parts)]
+    self._len = len(fixed)
+    if np is not None:
+      records = np.frombuffer(b''.join(fixed), dtype=_flow_stats_dtype)
+      for name in self.names:
+        column = records[name]
+        setattr(self, name,
+                column.astype(column.dtype.newbyteorder('=')))
+      return
+
+    columns = []
+    for name, fmt, dtype, typecode in _flow_stats_fields:
+      if name.startswith('_'): continue
+      column = [] if typecode is None else array.array(typecode)
+      setattr(self, name, column)
+      columns.append(column.append)
+    unpack = _flow_stats_fixed_struct.unpack
+    for data in fixed:
+      for append, value in zip(columns, unpack(data)):
+        append(value)
+
+  def __len__ (self):
+    return self._len
+
+  def table_counts (self):
+    """ Returns a dict of table_id -> number of entries """
+    if np is not None:
+      counts = np.bincount(self.table_id)
+      return dict((i, int(n)) for i, n in enumerate(counts) if n)
+    counts = {}
+    for table_id in self.table_id:
+      counts[table_id] = counts.get(table_id, 0) + 1
+    return counts
@@ -12,7 +12,7 @@ from copy import copy
 
 sys.path.append(os.path.dirname(__file__) + "/../../..")
 
-from pox.lib.epoll_select import EpollSelect
+from pox.lib.epoll_select import EpollSelect, EdgeTriggeredEpoll
 
 class TCPEcho(SocketServer.StreamRequestHandler):
   def handle(self):
@@ -85,5 +85,44 @@ class EpollSelectTest(unittest.TestCase):
       check( ([],[],[]), self.es.select(sockets, [], sockets, 0))
       check( ([],sockets,[]), self.es.select(sockets, sockets, sockets, 0))
 
+class EdgeTriggeredEpollTest(unittest.TestCase):
+  def setUp(self):
+    self.ep = EdgeTriggeredEpoll()
+    self.a, self.b = socket.socketpair()
+    self.b.setblocking(0)
+
+  def tearDown(self):
+    self.ep.close()
+    self.a.close()
+    self.b.close()
+
+  def test_reported_once_per_edge(self):
+    self.ep.register(self.b)
+    self.assertTrue(self.b in self.ep)
+    self.assertEqual(([],[],[]), self.ep.poll(0))
+    self.a.send("Hallo")
+    self.assertEqual(([self.b],[],[]), self.ep.poll(0.5))
+    # not read yet, but no new edge either
+    self.assertEqual(([],[],[]), self.ep.poll(0))
+    self.assertEqual(self.b.recv(100), "Hallo")
+    self.a.send("Servus")
+    self.assertEqual(([self.b],[],[]), self.ep.poll(0.5))
+
+  def test_select_on_epoll(self):
+    import select
+    self.ep.register(self.b)
+    self.assertEqual([], select.select([self.ep], [], [], 0)[0])
+    self.a.send("Hallo")
+    self.assertEqual([self.ep], select.select([self.ep], [], [], 0.5)[0])
+
+  def test_unregister(self):
+    self.ep.register(self.b)
+    self.ep.unregister(self.b)
+    self.assertEqual(0, len(self.ep))
+    self.a.send("Hallo")
+    self.assertEqual(([],[],[]), self.ep.poll(0))
+    # unregistering twice is harmless
+    self.ep.unregister(self.b)
+
 if __name__ == '__main__':
   unittest.main()
@@ -40,6 +40,15 @@ class TableEntryTest(unittest.TestCase):
     self.assertEqual(e.cookie, 0xDEADBEEF)
     self.assertEqual(e.actions, [ ofp_action_output(port=1)])
 
+  def test_flow_stats(self):
+    e = TableEntry(priority=5, match=ofp_match(), actions=[ofp_action_output(port=1)], now=0)
+    e.touch_packet(12, now=1)
+    e.touch_packet(30, now=2)
+    s = e.flow_stats(now=3)
+    self.assertEqual(s.packet_count, 2)
+    self.assertEqual(s.byte_count, 42)
+    self.assertEqual(s.duration_sec, 3)
+
   def test_is_expired(self):
     e = TableEntry(now=0, idle_timeout=5, hard_timeout=10)
     self.assertEqual(e.idle_timeout, 5)
@@ -81,7 +90,7 @@ class FlowTableTest(unittest.TestCase):
           ):
       t=table()
       t.remove_matching_entries(match, priority=priority, strict=strict)
-      self.assertEqual([e.cookie for e in t._table], remaining)
+      self.assertEqual([e.cookie for e in t.entries], remaining)
 
   def test_remove_expired_entries(self):
     """ test that flow can get expired as time passes """
@@ -101,13 +110,138 @@ class FlowTableTest(unittest.TestCase):
       t.remove_expired_entries(now=time)
       self.assertEqual([e.cookie for e in t.entries ], remaining)
 
+  def test_expiry_heap(self):
+    """ test that the expiry heap agrees with is_expired() as entries come, go and get touched """
+    import random
+    rng = random.Random(2)
+    t = FlowTable()
+    seen = []
+    t.addListener(FlowTableModification, lambda event: seen.append(event.removed))
+    for now in range(200):
+      for i in range(10):
+        t.add_entry(TableEntry(now=now, cookie=now * 10 + i, match=ofp_match(tp_src=i),
+                               idle_timeout=rng.choice((0, 3, 10)),
+                               hard_timeout=rng.choice((0, 5, 30))))
+      for e in rng.sample(t.entries, min(len(t.entries), 20)):
+        if rng.random() < 0.2:
+          t.remove_entry(e)
+        else:
+          e.touch_packet(1, now=now)
+      expired = [ e for e in t.entries if e.is_expired(now=now + 0.5) ]
+      self.assertEqual(t.expired_entries(now=now + 0.5), expired)
+      del seen[:]
+      self.assertEqual(set(t.remove_expired_entries(now=now + 0.5)), set(expired))
+      self.assertEqual(len(seen), 1)
+      self.assertEqual(set(seen[0]), set(expired))
+      self.assertFalse(any(e.is_expired(now=now + 0.5) for e in t.entries))
+    # Stale heap items don't pile up
+    self.assertTrue(len(t._expiry_heap) <= 2 * len(t.entries) + 64)
+
+  def test_counters(self):
+    """ test that counters move in and out of the table, and add up """
+    t = FlowTable()
+    entries = [ TableEntry(now=0, cookie=i, match=ofp_match(tp_src=i), actions=[ofp_action_output(port=1 + i % 2)])
+                for i in range(3000) ]
+    entries[0].touch_packet(5, now=1)
+    for e in entries:
+      t.add_entry(e)
+    for i, e in enumerate(entries):
+      e.touch_packet(i, now=2)
+    self.assertEqual(entries[0].counters, { 'created': 0, 'last_touched': 2, 'bytes': 5, 'packets': 2 })
+    self.assertEqual(entries[7].flow_stats(now=3).byte_count, 7)
+
+    s = t.aggregate_stats(ofp_match())
+    self.assertEqual((s.flow_count, s.packet_count, s.byte_count), (3000, 3001, sum(range(3000)) + 5))
+    s = t.aggregate_stats(ofp_match(), out_port=2)
+    self.assertEqual((s.flow_count, s.packet_count, s.byte_count), (1500, 1500, sum(range(1, 3000, 2))))
+
+    t.remove_entry(entries[7])
+    entries[7].touch_packet(1, now=4)
+    self.assertEqual(entries[7].counters, { 'created': 0, 'last_touched': 4, 'bytes': 8, 'packets': 2 })
+    # The slot is reused, without the counters of the removed entry
+    e = TableEntry(now=5, match=ofp_match(tp_src=7))
+    t.add_entry(e)
+    self.assertEqual(e.counters, { 'created': 5, 'last_touched': 5, 'bytes': 0, 'packets': 0 })
+
+  def test_entry_for_match(self):
+    """ test that the indexed lookup finds the first entry in table order """
+    import random
+    rng = random.Random(1)
+    def random_match():
+      m = ofp_match(in_port=rng.randint(1, 2), dl_type=0x800, nw_proto=6,
+                    dl_src=EthAddr("00:00:00:00:00:0%i" % rng.randint(1, 2)),
+                    nw_src="10.0.%i.%i" % (rng.randint(0, 1), rng.randint(0, 3)),
+                    nw_dst="10.1.0.%i" % rng.randint(0, 3),
+                    tp_src=rng.randint(1, 2), tp_dst=80,
+                    dl_dst=EthAddr("00:00:00:00:00:03"), dl_vlan=OFP_VLAN_NONE,
+                    dl_vlan_pcp=0, nw_tos=0)
+      return m
+    def linear(t, packet_match):
+      for entry in t.entries:
+        if entry.match.matches_with_wildcards(packet_match, consider_other_wildcards=False):
+          return entry
+      return None
+
+    t = FlowTable()
+    for i in range(300):
+      m = random_match()
+      for field in ('in_port', 'dl_src', 'dl_dst', 'dl_vlan', 'nw_proto', 'tp_src', 'tp_dst'):
+        if rng.random() < 0.5:
+          setattr(m, field, None)
+      if rng.random() < 0.7:
+        m.nw_src = "%s/%i" % (m.nw_src, rng.choice((0, 16, 24, 31)))
+      t.add_entry(TableEntry(priority=rng.randint(1, 5), cookie=i, match=m))
+      if i % 3 == 0:
+        t.remove_entry(rng.choice(t.entries))
+    for i in range(500):
+      p = random_match()
+      if i % 5 == 0:
+        p.tp_src = None
+      self.assertTrue(t.entry_for_match(p) is linear(t, p))
+    # Exact matches go first, whatever their priority
+    p.tp_src = 1
+    exact = TableEntry(priority=0, cookie=1000, match=p.clone())
+    t.add_entry(exact)
+    self.assertTrue(t.entry_for_match(p) is exact)
+    self.assertEqual(t.entries[0], exact)
+
+  def test_matching_entries(self):
+    """ test that the non-strict index agrees with checking every entry """
+    import random
+    rng = random.Random(3)
+    def random_match():
+      m = ofp_match(in_port=rng.randint(1, 2), dl_type=0x800, nw_proto=6,
+                    dl_src=EthAddr("00:00:00:00:00:0%i" % rng.randint(1, 2)),
+                    nw_src="10.0.%i.%i/%i" % (rng.randint(0, 1), rng.randint(0, 3),
+                                              rng.choice((32, 32, 30, 24, 16, 0))),
+                    nw_dst="10.1.0.%i/%i" % (rng.randint(0, 3), rng.choice((32, 24, 0))),
+                    tp_src=rng.randint(1, 2), tp_dst=80)
+      for field in ('in_port', 'dl_src', 'dl_type', 'nw_proto', 'tp_src', 'tp_dst'):
+        if rng.random() < 0.4:
+          setattr(m, field, None)
+      return m
+
+    t = FlowTable()
+    for i in range(300):
+      t.add_entry(TableEntry(priority=rng.randint(1, 5), cookie=i, match=random_match(),
+                             actions=[ofp_action_output(port=rng.randint(1, 3))]))
+    for i in range(300):
+      if i % 10 == 0:
+        m = rng.choice(t.entries).match.clone()
+      else:
+        m = random_match()
+      out_port = rng.choice((None, 1))
+      self.assertEqual(t.matching_entries(m, out_port=out_port),
+                       [ e for e in t.entries if e.is_matched_by(m, out_port=out_port) ])
+    self.assertEqual(t.matching_entries(ofp_match()), t.entries)
+
 class SwitchFlowTableTest(unittest.TestCase):
   def test_process_flow_mod_add(self):
     """ test that simple insertion of a flow works"""
     t = SwitchFlowTable()
     t.process_flow_mod(ofp_flow_mod(priority=5, cookie=0x31415926, actions=[ofp_action_output(port=5)]))
-    self.assertEqual(len(t._table), 1)
-    e = t._table[0]
+    self.assertEqual(len(t.entries), 1)
+    e = t.entries[0]
     self.assertEqual(e.priority, 5)
     self.assertEqual(e.cookie, 0x31415926)
     self.assertEqual(e.actions, [ ofp_action_output(port=5)])
@@ -156,6 +290,23 @@ class SwitchFlowTableTest(unittest.TestCase):
     self.assertEquals([e.cookie for e in t.entries if e.actions == [ofp_action_output(port=8)] ], [2])
     self.assertEquals(len(t.entries), 3)
 
+  def test_process_flow_mod_delete(self):
+    """ test that non-strict deletion removes every covered flow """
+    t = SwitchFlowTable()
+    t.add_entry(TableEntry(priority=6, cookie=0x1, match=ofp_match(dl_src=EthAddr("00:00:00:00:00:01"),nw_src="1.2.3.4"), actions=[ofp_action_output(port=5)]))
+    t.add_entry(TableEntry(priority=5, cookie=0x2, match=ofp_match(dl_src=EthAddr("00:00:00:00:00:02"), nw_src="1.2.3.0/24"), actions=[ofp_action_output(port=6)]))
+    t.add_entry(TableEntry(priority=1, cookie=0x3, match=ofp_match(), actions=[]))
+
+    (kind, removed) = t.process_flow_mod(ofp_flow_mod(command = OFPFC_DELETE, match=ofp_match(nw_src="1.2.0.0/16")))
+    self.assertEquals(kind, "removed")
+    self.assertEquals([e.cookie for e in removed], [1,2])
+    self.assertEquals([e.cookie for e in t.entries], [3])
+
+    t.process_flow_mod(ofp_flow_mod(command = OFPFC_DELETE_STRICT, priority=2, match=ofp_match()))
+    self.assertEquals([e.cookie for e in t.entries], [3])
+    t.process_flow_mod(ofp_flow_mod(command = OFPFC_DELETE, match=ofp_match()))
+    self.assertEquals(t.entries, [])
+
 class MockSwitch(EventMixin):
   _eventMixin_events = [FlowRemoved, BarrierIn, SwitchConnectionUp, SwitchConnectionDown ]
   def __init__(self):
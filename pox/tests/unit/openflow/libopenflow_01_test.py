@@ -119,6 +119,45 @@ class ofp_match_test(unittest.TestCase):
     assertMatch(create(nw_src="10.0.0.0/25"), create(nw_src="10.0.0.127"))
     assertNoMatch(create(nw_src="10.0.0.0/25"), create(nw_src="10.0.0.128"))
 
+  def test_from_raw(self):
+    """ ofp_match: from_raw gives the same match as from_packet """
+    import struct
+    eth = "\x00\x00\x00\x00\x00\x02\x00\x00\x00\x00\x00\x01"
+    def ip(proto, segment, iplen=None, vhl=0x45):
+      if iplen is None: iplen = 20 + len(segment)
+      return struct.pack("!BBHHHBBHLL", vhl, 0x10, iplen, 0, 0, 64, proto, 0,
+                         0x0a000001, 0x0a000002) + segment
+    udp = struct.pack("!HHHH", 10000, 9, 8, 0)
+    tcp = struct.pack("!HHLLBBHHH", 1234, 80, 0, 0, 0x50, 2, 0, 0, 0)
+    tcp_mss = struct.pack("!HHLLBBHHH", 1234, 80, 0, 0, 0x60, 2, 0, 0, 0) \
+              + "\x02\x04\x05\xb4"
+    tcp_bad_option = tcp_mss[:20] + "\x02\x03\x05\xb4"
+    arp = struct.pack("!HHBBH6sL6sL", 1, 0x800, 6, 4, 1, "\x01" * 6,
+                      0x0a000001, "\x00" * 6, 0x0a000002)
+    frames = [ eth + "\x08\x00" + ip(17, udp) + "\x00" * 18,
+               eth + "\x08\x00" + ip(6, tcp),
+               eth + "\x08\x00" + ip(6, tcp_mss),
+               eth + "\x08\x00" + ip(6, tcp_bad_option),
+               eth + "\x08\x00" + ip(6, tcp[:10]),
+               eth + "\x08\x00" + ip(1, "\x08\x00\x00\x00"),
+               eth + "\x08\x00" + ip(17, udp, iplen=24),
+               eth + "\x08\x00" + ip(17, udp, vhl=0x46),
+               eth + "\x08\x00" + ip(17, udp)[:15],
+               eth + "\x81\x00\xa0\x05\x08\x00" + ip(17, udp),
+               eth + "\x81\x00\xa0\x05\x08\x06" + arp,
+               eth + "\x08\x06" + arp,
+               eth + "\x08\x06" + arp[:20],
+               eth + "\x12\x34" + "\x00" * 46,
+               eth ]
+    for data in frames:
+      for in_port in (None, 3):
+        expected = ofp_match.from_packet(ethernet(data), in_port)
+        match = ofp_match.from_raw(data, in_port)
+        self.assertEqual(match.wildcards, expected.wildcards)
+        self.assertEqual(match.pack(), expected.pack())
+    self.assertEqual(ofp_match.from_raw(frames[0]).tp_src, 10000)
+    self.assertEqual(ofp_match.from_raw(frames[9]).dl_vlan, 5)
+
 class ofp_command_test(unittest.TestCase):
   # custom map of POX class to header type, for validation
   ofp_type = {
@@ -283,6 +322,55 @@ class ofp_command_test(unittest.TestCase):
             for (check_attr,val) in attrs.iteritems():
               self.assertEqual(getattr(unpacked, check_attr), val)
 
+  def test_pack_unchecked(self):
+    import pox.openflow.libopenflow_01 as of
+    o = ofp_packet_out(xid=1, buffer_id=5, data="\x00" * 60,
+                       actions=[ofp_action_output(port=2)])
+    self.assertRaises(RuntimeError, o.pack)
+    of.ASSERT_STRUCTS = False
+    try:
+      packed = o.pack()
+    finally:
+      of.ASSERT_STRUCTS = True
+    self.assertEqual(len(packed), 16 + 8 + 60)
+    unpacked = ofp_packet_out()
+    unpacked.unpack(packed)
+    self.assertEqual(unpacked.buffer_id, 5)
+    self.assertEqual(unpacked.data, o.data)
+
+  def test_flow_mod_template(self):
+    def make_flow_mod(**kw):
+      match = ofp_match(in_port=1, dl_type=0x0800, nw_proto=17,
+                        nw_src="10.0.0.1", nw_dst="11.0.0.1")
+      for k in ('in_port', 'tp_src', 'tp_dst'):
+        if k in kw: setattr(match, k, kw.pop(k))
+      return ofp_flow_mod(match=match, idle_timeout=10, hard_timeout=30,
+                          actions=[ofp_action_output(port=2)], **kw)
+
+    template = flow_mod_template(make_flow_mod())
+    for kw in ( { 'xid': 1 },
+                { 'xid': 2, 'tp_src': 1234, 'tp_dst': 53 },
+                { 'xid': 3, 'in_port': 7, 'cookie': 0x1234567890,
+                  'buffer_id': 42 },
+                { 'xid': 4, 'tp_dst': 80, 'buffer_id': -1 } ):
+      self.assertEqual(template.pack(**kw), make_flow_mod(**kw).pack())
+    o = template.make(tp_src=5, tp_dst=6)
+    self.assertTrue(isinstance(o, ofp_flow_mod))
+    self.assertEqual((o.match.tp_src, o.match.tp_dst), (5, 6))
+    self.assertNotEqual(template.make().xid, template.make().xid)
+
+    # pack_lazy() reuses the bytes, but not a header that has been changed
+    o = template.make(xid=1)
+    o.xid = 1234
+    self.assertEqual(o.pack_lazy(), template.pack(xid=1234))
+    self.assertTrue('_lazy_data' in o.__dict__)
+    o.priority = 5
+    self.assertEqual(o.pack_lazy(),
+                     make_flow_mod(xid=1234, priority=5).pack())
+
+    no_tp = flow_mod_template(ofp_flow_mod(match=ofp_match(dl_type=0x0806)))
+    self.assertRaises(ValueError, no_tp.pack, tp_src=1)
+
 class ofp_action_test(unittest.TestCase):
   def assert_packed_action(self, cls, packed, a_type, length):
     self.assertEqual(extract_num(packed, 0,2), a_type, "Action %s: expected type %d (but is %d)" % (cls, a_type, extract_num(packed, 0,2)))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path
+import socket
+import struct
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+# of_01 imports DelayedAction from the top of the repository, which needs its
+# profiles chosen in the environment
+top_dir = os.path.dirname(__file__) + "/../../../.."
+sys.path.append(top_dir)
+os.environ.setdefault('DELAY_PROFILE', 'noop')
+os.environ.setdefault('FLOW_TABLE_PROFILE', 'none')
+
+from pox.openflow.libopenflow_01 import *
+try:
+  from pox.openflow.of_01 import Connection, SendBacklogHigh, SendBacklogLow
+except ImportError:
+  # DelayedAction needs pcap
+  Connection = None
+
+BUFFER_SIZE = 4096
+CHUNK_SIZE = 1000
+
+class RecordingNexus (object):
+  """ stands in for core.openflow and records what the connection raises """
+  def __init__ (self):
+    self.events = []
+    self.disconnected = []
+  def raiseEventNoErrors (self, event, *args, **kw):
+    self.events.append(event)
+  def _disconnect (self, dpid):
+    self.disconnected.append(dpid)
+
+class Waker (object):
+  pings = 0
+  def ping (self):
+    self.pings += 1
+
+def chunk (i):
+  """ CHUNK_SIZE bytes that tell where they are in the stream """
+  return struct.pack("!L", i) * (CHUNK_SIZE // 4)
+
+@unittest.skipIf(Connection is None, "of_01 can't be imported")
+class SendQueueTest(unittest.TestCase):
+  def setUp(self):
+    self.switch, sock = socket.socketpair()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, BUFFER_SIZE)
+    self.switch.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUFFER_SIZE)
+    sock.setblocking(0)
+    # DelayedAction loads its profiles relative to the top of the repository
+    cwd = os.getcwd()
+    os.chdir(top_dir)
+    try:
+      self.con = Connection(sock)
+    finally:
+      os.chdir(cwd)
+    self.nexus = self.con.ofnexus = RecordingNexus()
+    self.waker = self.con._send_waker = Waker()
+    self.events = []
+    for event in (SendBacklogHigh, SendBacklogLow):
+      self.con.addListener(event,
+          lambda event: self.events.append(event.__class__))
+    self.con.send_high_water = 40 * CHUNK_SIZE
+    self.con.send_low_water = 10 * CHUNK_SIZE
+    self.con.max_send_backlog = 100 * CHUNK_SIZE
+    hello = ofp_hello()
+    self.sent = [self.switch.recv(100)]
+    hello.unpack(self.sent[0])
+    self.assertEqual(hello.header_type, OFPT_HELLO)
+    self.received = self.sent[0]
+
+  def tearDown(self):
+    self.switch.close()
+    self.con.close()
+
+  def send(self, count):
+    for i in range(count):
+      data = chunk(len(self.sent))
+      self.sent.append(data)
+      self.con.send(data)
+
+  def queued(self):
+    return sum(len(data) for data in self.con._send_queue)
+
+  def drain(self):
+    """ reads what the switch has got, and lets the connection flush """
+    while True:
+      try:
+        data = self.switch.recv(BUFFER_SIZE, socket.MSG_DONTWAIT)
+      except socket.error:
+        break
+      self.received += data
+    self.con.flush_send_queue()
+
+  def test_partial_write(self):
+    # Fill the socket until it only takes part of a chunk
+    while not self.con._send_queue:
+      self.send(1)
+    self.assertEqual(self.waker.pings, 1)
+    self.assertEqual(self.con.send_backlog, self.queued())
+    self.assertTrue(0 < self.con.send_backlog <= CHUNK_SIZE)
+
+    # Everything sent from now on is queued behind it, in order
+    self.send(3)
+    self.assertEqual(len(self.con._send_queue), 4)
+    self.assertEqual(self.con.send_backlog, self.queued())
+    self.assertEqual(self.waker.pings, 1)
+
+    while self.con.send_backlog:
+      self.drain()
+      self.assertEqual(self.con.send_backlog, self.queued())
+    self.drain()
+    self.assertEqual(self.received, b''.join(self.sent))
+    self.assertEqual(self.events, [])
+    self.assertFalse(self.con.disconnected)
+
+  def test_high_and_low_water(self):
+    while self.con.send_backlog <= self.con.send_high_water:
+      self.assertEqual(self.events, [])
+      self.send(1)
+    self.assertEqual(self.events, [SendBacklogHigh])
+    self.assertEqual(self.nexus.events, [SendBacklogHigh])
+
+    # Only once while above the low water mark
+    self.send(5)
+    self.assertEqual(self.events, [SendBacklogHigh])
+
+    while self.con.send_backlog > self.con.send_low_water:
+      self.assertEqual(self.events, [SendBacklogHigh])
+      self.drain()
+    self.assertEqual(self.events, [SendBacklogHigh, SendBacklogLow])
+    self.assertEqual(self.nexus.events, [SendBacklogHigh, SendBacklogLow])
+
+    while self.con.send_backlog:
+      self.drain()
+    self.drain()
+    self.assertEqual(self.received, b''.join(self.sent))
+    self.assertEqual(len(self.events), 2)
+    self.assertFalse(self.con.disconnected)
+
+  def test_max_send_backlog(self):
+    while not self.con.disconnected:
+      self.assertTrue(self.con.send_backlog <= self.con.max_send_backlog)
+      self.send(1)
+    self.assertEqual(self.nexus.disconnected, [None])
+    self.assertEqual(self.con.send_backlog, 0)
+    self.assertEqual(len(self.con._send_queue), 0)
+
+    # Nothing more is sent or queued
+    self.send(1)
+    self.assertEqual(self.con.send_backlog, 0)
+
+if __name__ == '__main__':
+  unittest.main()
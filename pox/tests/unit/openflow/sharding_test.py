@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+import os
+import os.path
+import socket
+import struct
+import multiprocessing
+from errno import EAGAIN
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+# of_01 imports DelayedAction from the top of the repository, which needs its
+# profiles chosen in the environment
+sys.path.append(os.path.dirname(__file__) + "/../../../..")
+os.environ.setdefault('DELAY_PROFILE', 'noop')
+os.environ.setdefault('FLOW_TABLE_PROFILE', 'none')
+
+from pox.openflow.libopenflow_01 import *
+try:
+  from pox.openflow.sharding import ShardChannel, ShardEvent, PendingSwitch, \
+       ShardFrontEnd
+except ImportError:
+  # DelayedAction needs pcap
+  ShardChannel = None
+
+def tcp_pair ():
+  """ returns two ends of a loopback TCP connection """
+  listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  listener.bind(("127.0.0.1", 0))
+  listener.listen(1)
+  client = socket.create_connection(listener.getsockname())
+  server = listener.accept()[0]
+  listener.close()
+  return client, server
+
+def make_channels ():
+  """ returns a front end's ShardChannel and that of its worker 0 """
+  front_conn, worker_conn = multiprocessing.Pipe()
+  front = ShardChannel(2)
+  front._conns = [front_conn, None]
+  worker = ShardChannel(2)
+  worker.shard = 0
+  worker._conn = worker_conn
+  return front, worker
+
+@unittest.skipIf(ShardChannel is None, "of_01 can't be imported")
+class ShardChannelTest(unittest.TestCase):
+  def test_socket_handoff(self):
+    front, worker = make_channels()
+    self.assertRaises(socket.error, worker._receive)
+    try:
+      worker._receive()
+    except socket.error as e:
+      self.assertEqual(e.errno, EAGAIN)
+
+    switch, sock = tcp_pair()
+    front._send_socket(0, 0x42, sock, "already received")
+    sock.close()
+
+    dpid, handed, received = worker._receive()
+    self.assertEqual(dpid, 0x42)
+    self.assertEqual(received, "already received")
+    # Still the same connection after the front end closed its copy
+    switch.sendall("to controller")
+    self.assertEqual(handed.recv(100), "to controller")
+    handed.sendall("to switch")
+    self.assertEqual(switch.recv(100), "to switch")
+    handed.close()
+    self.assertEqual(switch.recv(100), "")
+    switch.close()
+
+  def test_events(self):
+    front, worker = make_channels()
+    raised = []
+    worker.addListener(ShardEvent,
+        lambda event: raised.append((event.shard, event.name, event.args)))
+
+    # From the front end: raised there and relayed to the worker
+    front.publish('ConnectionUp', 5)
+    self.assertEqual(front.dpids, {5: None})
+    self.assertEqual(worker._receive(), None)
+    self.assertEqual(raised, [(None, 'ConnectionUp', (5,))])
+    self.assertEqual(worker.dpids, {5: None})
+
+    # From a worker: only raised once the front end relays it
+    worker.publish('ConnectionUp', 6)
+    self.assertEqual(worker.dpids, {5: None})
+    front._relay(front._conns[0].recv())
+    self.assertEqual(front.dpids, {5: None, 6: 0})
+    self.assertEqual(worker._receive(), None)
+    self.assertEqual(worker.dpids, {5: None, 6: 0})
+
+    front.publish('ConnectionDown', 5)
+    worker._receive()
+    self.assertEqual(worker.dpids, {6: 0})
+    self.assertEqual(len(raised), 3)
+
+    front._conns[0].close()
+    self.assertRaises(EOFError, worker._receive)
+
+  def test_hand_off_to_dead_worker(self):
+    class FrontEnd (object):
+      workers = 2
+    front_end = FrontEnd()
+    front_end.channel, worker = make_channels()
+    worker._conn.close()
+
+    switch, sock = tcp_pair()
+    p = PendingSwitch(sock)
+    p.dpid = 0x42
+    # Doesn't raise, and no more hand-offs to that worker
+    ShardFrontEnd._hand_off.im_func(front_end, p)
+    self.assertEqual(front_end.channel._conns, [None, None])
+    ShardFrontEnd._hand_off.im_func(front_end, p)
+    switch.close()
+    sock.close()
+
+@unittest.skipIf(ShardChannel is None, "of_01 can't be imported")
+class PendingSwitchTest(unittest.TestCase):
+  def handshake(self):
+    """ returns the PendingSwitch, the switch's end and the xid of its request """
+    switch, sock = socket.socketpair()
+    p = PendingSwitch(sock)
+    data = switch.recv(100)
+    hello = ofp_hello()
+    data = hello.unpack(data)
+    self.assertEqual(hello.header_type, OFPT_HELLO)
+    request = ofp_features_request()
+    request.unpack(data)
+    self.assertEqual(request.header_type, OFPT_FEATURES_REQUEST)
+    return p, switch, request.xid
+
+  def test_features_reply(self):
+    p, switch, xid = self.handshake()
+    forwarded = ofp_hello(xid=1).pack() + ofp_echo_request(xid=2).pack()
+    data = forwarded + ofp_features_reply(xid=xid, datapath_id=0x1234).pack()
+
+    # In pieces, including one that ends in the middle of a header
+    for piece in (data[:3], data[3:12], data[12:30], data[30:]):
+      switch.sendall(piece)
+      self.assertTrue(p.read())
+    self.assertEqual(p.dpid, 0x1234)
+    self.assertEqual(p.received(), forwarded)
+
+    # Data after the reply is forwarded too
+    switch.sendall(ofp_echo_reply(xid=3).pack()[:5])
+    self.assertTrue(p.read())
+    self.assertEqual(p.received(), forwarded + ofp_echo_reply(xid=3).pack()[:5])
+
+  def test_other_xid(self):
+    p, switch, xid = self.handshake()
+    other = ofp_features_reply(xid=xid + 1, datapath_id=1).pack()
+    switch.sendall(other)
+    self.assertTrue(p.read())
+    self.assertEqual(p.dpid, None)
+    self.assertEqual(p.received(), other)
+
+  def test_bad_switch(self):
+    p, switch, xid = self.handshake()
+    switch.sendall(struct.pack("!BBHL", 4, OFPT_HELLO, 8, 1))
+    self.assertFalse(p.read())
+
+    p, switch, xid = self.handshake()
+    switch.close()
+    self.assertFalse(p.read())
+
+if __name__ == '__main__':
+  unittest.main()
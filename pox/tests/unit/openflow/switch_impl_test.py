@@ -127,6 +127,53 @@ class SwitchImplTest(unittest.TestCase):
     self.assertEqual(event.port.port_no,3)
     self.assertEqual(event.packet, self.packet)
     
+  def test_microflow_cache(self):
+    c = self.conn
+    s = self.switch
+    cache = s.microflow_cache
+    received = []
+    s.addListener(DpPacketOut, lambda(event): received.append(event))
+
+    s.process_packet(self.packet, in_port=1)
+    s.process_packet(self.packet, in_port=1)
+    self.assertEqual(len(c.received), 2)
+    self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    # a new flow entry invalidates the cached miss
+    c.to_switch(ofp_flow_mod(match=ofp_match(in_port=1, nw_src="1.2.3.4"),
+                             actions = [ ofp_action_output(port=3) ]))
+    s.process_packet(self.packet, in_port=1)
+    s.process_packet(self.packet, in_port=1)
+    self.assertEqual(len(received), 2)
+    self.assertEqual((cache.hits, cache.misses), (2, 2))
+    self.assertEqual(s.table.entries[0].counters["packets"], 2)
+
+    # modified actions are seen without invalidation
+    c.to_switch(ofp_flow_mod(command=OFPFC_MODIFY, match=ofp_match(in_port=1),
+                             actions = [ ofp_action_output(port=2) ]))
+    s.process_packet(self.packet, in_port=1)
+    self.assertEqual(received[-1].port.port_no, 2)
+    self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+    # other packets and ports are other flows
+    s.process_packet(self.packet, in_port=2)
+    self.assertEqual(cache.misses, 3)
+    self.assertEqual(len(c.received), 3)
+
+    # the least recently used flows are evicted
+    cache.max_size = 4
+    for i in range(10):
+      s.process_packet(ethernet(src=EthAddr("00:00:00:00:00:01"), dst=EthAddr("00:00:00:00:00:02"),
+                                type=ethernet.IP_TYPE, next=ipv4(srcip=IPAddr(i), dstip=IPAddr("1.2.3.5"))),
+                       in_port=1)
+      s.process_packet(self.packet, in_port=1)
+      self.assertTrue(len(cache) <= 4)
+    self.assertEqual((cache.hits, cache.misses), (13, 13))
+
+    s = SwitchImpl(2, microflow_cache_size=0)
+    self.assertEqual(s.microflow_cache, None)
+    s.process_packet(self.packet, in_port=1)
+
   def test_take_port_down(self):
     c = self.conn
     s = self.switch
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+import os.path
+import socket
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.openflow.libopenflow_01 import *
+from pox.openflow.util import *
+
+def make_stream ():
+  """ returns a list of messages and the byte stream they pack into """
+  msgs = [ ofp_hello(xid=1),
+           ofp_packet_in(xid=2, in_port=3, data="\x42" * 1400),
+           ofp_echo_request(xid=3),
+           ofp_flow_removed(xid=4, match=ofp_match(tp_src=5, tp_dst=6),
+                            priority=7, packet_count=8, byte_count=9),
+           ofp_packet_in(xid=5, in_port=1, data="\x17" * 60) ]
+  return msgs, b''.join(m.pack() for m in msgs)
+
+class ReceiveBufferTest(unittest.TestCase):
+  def drain (self, buf):
+    r = []
+    while True:
+      msg = buf.next_message()
+      if msg is None: return r
+      r.append(msg)
+
+  def test_feed_in_chunks(self):
+    msgs, data = make_stream()
+    for chunk_size in (1, 7, 100, 2048):
+      # Small enough that the buffer has to compact and grow
+      buf = ReceiveBuffer(size=64, recv_size=16)
+      parsed = []
+      for i in range(0, len(data), chunk_size):
+        buf.feed(data[i:i + chunk_size])
+        parsed += self.drain(buf)
+      self.assertEqual(len(buf), 0)
+      self.assertEqual([m.pack() for m in parsed], [m.pack() for m in msgs])
+      self.assertEqual(type(parsed[1].data), bytes)
+
+  def test_recv(self):
+    msgs, data = make_stream()
+    a, b = socket.socketpair()
+    try:
+      a.sendall(data * 10)
+      a.close()
+      buf = ReceiveBuffer(recv_size=512)
+      parsed = []
+      while buf.recv(b):
+        parsed += self.drain(buf)
+      self.assertEqual(len(parsed), len(msgs) * 10)
+      self.assertEqual(parsed[-1].pack(), msgs[-1].pack())
+    finally:
+      b.close()
+
+  def test_bad_version(self):
+    buf = ReceiveBuffer()
+    buf.feed("\x04\x00\x00\x08\x00\x00\x00\x00")
+    self.assertRaises(ValueError, buf.next_message)
+
+  def test_incomplete(self):
+    msgs, data = make_stream()
+    buf = ReceiveBuffer()
+    buf.feed(data[:20])
+    self.assertTrue(isinstance(buf.next_message(), ofp_hello))
+    self.assertEqual(buf.next_message(), None)
+    self.assertEqual(len(buf), 12)
+
+  def test_lazy(self):
+    msgs, data = make_stream()
+    buf = ReceiveBuffer(lazy=True)
+    buf.feed(data)
+    parsed = self.drain(buf)
+    # Only the header is unpacked, from a copy of the bytes
+    self.assertEqual(parsed[1].xid, 2)
+    self.assertEqual(parsed[1].header_type, OFPT_PACKET_IN)
+    self.assertTrue('data' not in parsed[1].__dict__)
+    buf.feed("\x00" * len(data))
+    self.assertEqual(parsed[1].in_port, 3)
+    self.assertEqual(parsed[1].data, "\x42" * 1400)
+    self.assertEqual(parsed[3].priority, 7)
+    eager = ReceiveBuffer()
+    eager.feed(data)
+    self.assertEqual(parsed, self.drain(eager))
+    self.assertFalse(hasattr(parsed[0], 'no_such_field'))
+
+  def test_lazy_set_before_unpack(self):
+    msgs, data = make_stream()
+    m = ofp_packet_in.unpack_lazy(msgs[1].pack())
+    m.in_port = 9
+    m.xid = 1234
+    self.assertEqual(m.data, "\x42" * 1400)
+    self.assertEqual((m.in_port, m.xid), (9, 1234))
+    self.assertEqual(m.header_type, OFPT_PACKET_IN)
+
+def make_flow_stats_reply (table_ids, xid=1):
+  body = [ofp_flow_stats(table_id=t, match=ofp_match(in_port=i),
+                         actions=[ofp_action_output(port=i)])
+          for i, t in enumerate(table_ids)]
+  for s in body:
+    s.length = len(s)
+  reply = ofp_stats_reply(xid=xid, type=OFPST_FLOW, body=body)
+  return body, reply.pack()
+
+class FlowStatsTest(unittest.TestCase):
+  def test_walk(self):
+    body, data = make_flow_stats_reply([0, 0, 2, 0, 2])
+    part = ofp_stats_reply.unpack_lazy(data)
+    self.assertEqual([t for t, entry in walk_flow_stats([part, part])],
+                     [0, 0, 2, 0, 2] * 2)
+    self.assertEqual(count_flow_stats([part, part]), {0: 6, 2: 4})
+    stats = list(iter_flow_stats([part]))
+    self.assertEqual([s.pack() for s in stats], [s.pack() for s in body])
+    self.assertEqual(stats[3].actions[0].port, 3)
+
+  def test_columns(self):
+    body, data = make_flow_stats_reply([0, 2, 2])
+    body[1].match.dl_src = EthAddr("01:02:03:04:05:06")
+    body[1].match.dl_type = 0x800
+    body[1].match.nw_dst = "10.0.0.1"
+    body[2].byte_count = 1 << 40
+    data = ofp_stats_reply(type=OFPST_FLOW, body=body).pack()
+    part = ofp_stats_reply.unpack_lazy(data)
+    cols = FlowStatsColumns([part, part])
+    self.assertEqual(len(cols), 6)
+    self.assertEqual(list(cols.table_id), [0, 2, 2] * 2)
+    self.assertEqual(list(cols.in_port), [0, 1, 2] * 2)
+    self.assertEqual(list(cols.wildcards), [s.match.wildcards for s in body] * 2)
+    self.assertEqual(cols.dl_src[1], "\x01\x02\x03\x04\x05\x06")
+    self.assertEqual(cols.nw_dst[1], 0x0a000001)
+    self.assertEqual(list(cols.byte_count), [0, 0, 1 << 40] * 2)
+    self.assertEqual(list(cols.length), [len(s) for s in body] * 2)
+    self.assertEqual(cols.table_counts(), {0: 2, 2: 4})
+
+  def test_bad_length(self):
+    body, data = make_flow_stats_reply([0])
+    part = ofp_stats_reply()
+    part.unpack(data[:-1])
+    self.assertRaises(ValueError, list, walk_flow_stats([part]))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+Measures FlowTable insertion and packet lookup at growing table sizes, and
+compares them with the old list-based table: a full re-sort on every insert
+and a linear scan with matches_with_wildcards() on every lookup.
+
+Usage: flow-table-bench.py [sizes]
+
+sizes is a comma-separated list of rule counts (default 1000,10000,100000).
+Half of the rules are exact 5-tuple matches and half are spread over a few
+wildcard masks (destination prefixes, ports, in_port), at various priorities.
+The linear scan is only timed for a few lookups at the larger sizes.
+Non-strict matching (for OFPFC_MODIFY and OFPFC_DELETE) is timed for a few
+flow-mod matches, from narrow to everything, against is_matched_by() on
+every entry.  The first of these on a field builds an index for it, so they
+are timed twice.  Last come touch_packet() on the entries that the lookups
+found, and aggregate_stats() over all entries.
+
+It then churns rules with idle_timeout=10 and hard_timeout=30 at 1000, 2000
+and 5000 flow-mods per emulated second, with traffic on a third of them, sweeping once per second with
+remove_expired_entries(), and compares the sweeps with the old ones (an
+is_expired() check of every entry and a list.remove() per expired one).
+"""
+
+import sys
+import os.path
+import time
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+from pox.openflow.libopenflow_01 import *
+from pox.openflow.flow_table import FlowTable, TableEntry
+from pox.lib.addresses import IPAddr, EthAddr
+
+
+def make_packet_match (rng):
+  """ A fully specified match, like ofp_match.from_packet() returns for TCP """
+  return ofp_match(in_port=rng.randint(1, 48),
+                   dl_src=EthAddr("00:00:00:00:%02x:%02x" % (rng.randint(0, 255),
+                                                             rng.randint(0, 255))),
+                   dl_dst=EthAddr("00:00:00:00:00:01"),
+                   dl_vlan=OFP_VLAN_NONE, dl_vlan_pcp=0, dl_type=0x800,
+                   nw_tos=0, nw_proto=6,
+                   nw_src=IPAddr(0x0a000000 | rng.randint(0, 0xffff)),
+                   nw_dst=IPAddr(0x0b000000 | rng.randint(0, 0xffff)),
+                   tp_src=rng.randint(1024, 65535), tp_dst=rng.randint(1, 1024))
+
+def make_rule (rng, i):
+  m = make_packet_match(rng)
+  kind = i % 8
+  if kind < 4:
+    return TableEntry(priority=0, cookie=i, match=m)
+  if kind == 4:
+    m = ofp_match(dl_type=0x800, nw_dst="%s/24" % (m.nw_dst,))
+  elif kind == 5:
+    m = ofp_match(dl_type=0x800, nw_proto=6, nw_dst=m.nw_dst, tp_dst=m.tp_dst)
+  elif kind == 6:
+    m = ofp_match(in_port=m.in_port, dl_src=m.dl_src)
+  else:
+    m = ofp_match(dl_type=0x800, nw_src="%s/16" % (m.nw_src,))
+  return TableEntry(priority=rng.randint(1, 100), cookie=i, match=m)
+
+
+def linear_lookup (table, packet_match):
+  for entry in table.entries:
+    if entry.match.matches_with_wildcards(packet_match,
+                                          consider_other_wildcards=False):
+      return entry
+  return None
+
+def old_add_entry (entries, entry):
+  entries.append(entry)
+  entries.sort(key=lambda e: e.priority if e.match.is_wildcarded else (1<<16) + 1,
+               reverse=True)
+
+
+def churn (rate, seconds=60):
+  rng = random.Random(rate)
+  table = FlowTable()
+  old = []
+  sweep = 0
+  old_sweep = 0
+  for second in xrange(seconds):
+    for i in xrange(rate):
+      now = second + float(i) / rate
+      rule = TableEntry(priority=rng.randint(1, 100), idle_timeout=10,
+                        hard_timeout=30, now=now,
+                        match=ofp_match(tp_src=rng.randint(0, 65535),
+                                        tp_dst=rng.randint(0, 65535)))
+      table.add_entry(rule)
+      old.append(rule)
+
+    now = second + 1
+    for rule in rng.sample(old, len(old) // 3):
+      rule.touch_packet(64, now=now)
+    start = time.time()
+    removed = table.remove_expired_entries(now=now)
+    sweep += time.time() - start
+
+    start = time.time()
+    expired = [e for e in old if e.is_expired(now)]
+    for e in expired:
+      old.remove(e)
+    old_sweep += time.time() - start
+    assert len(removed) == len(expired)
+
+  print "%6i flow-mods/s, %6i rules: sweep %7.2f ms (old %8.2f ms)" % (
+      rate, len(table), sweep / seconds * 1e3, old_sweep / seconds * 1e3)
+
+
+def main ():
+  sizes = [1000, 10000, 100000]
+  if len(sys.argv) > 1:
+    sizes = [int(s) for s in sys.argv[1].split(",")]
+
+  for size in sizes:
+    rng = random.Random(size)
+    rules = [make_rule(rng, i) for i in xrange(size)]
+    packets = [make_packet_match(rng) for i in xrange(20000)]
+    # Some of the packets hit the exact rules
+    for i in xrange(0, len(packets), 4):
+      packets[i] = rules[rng.randrange(0, size, 8)].match
+
+    table = FlowTable()
+    start = time.time()
+    for rule in rules:
+      table.add_entry(rule)
+    insert = time.time() - start
+
+    start = time.time()
+    hits = 0
+    for p in packets:
+      if table.entry_for_match(p) is not None:
+        hits += 1
+    lookup = (time.time() - start) / len(packets)
+
+    found = [table.entry_for_match(p) for p in packets]
+    found = [e for e in found if e is not None]
+    start = time.time()
+    for e in found:
+      e.touch_packet(64)
+    touch = (time.time() - start) / len(found)
+    start = time.time()
+    stats = table.aggregate_stats(ofp_match())
+    aggregate = time.time() - start
+    assert stats.packet_count == len(found)
+
+    count = min(len(packets), 2000000 // size)
+    start = time.time()
+    for p in packets[:count]:
+      assert linear_lookup(table, p) is table.entry_for_match(p)
+    linear = (time.time() - start) / count
+
+    # The old insert re-sorted the whole list each time
+    old = list(table.entries)
+    start = time.time()
+    for i in xrange(20):
+      old_add_entry(old, make_rule(rng, size))
+    old_insert = (time.time() - start) / 20
+
+    print "%6i rules: insert %5.1f us (re-sort %8.1f us), " \
+          "lookup %5.1f us (linear %9.1f us), %i%% hits" % (
+          size, insert / size * 1e6, old_insert * 1e6,
+          lookup * 1e6, linear * 1e6, hits * 100 // len(packets))
+
+    for name, match in (
+        ("/24 dst", ofp_match(dl_type=0x800, nw_dst="11.0.5.0/24")),
+        ("in_port", ofp_match(in_port=5)),
+        ("tcp dst", ofp_match(dl_type=0x800, nw_proto=6, tp_dst=80)),
+        ("all", ofp_match())):
+      start = time.time()
+      table.matching_entries(match)
+      first = time.time() - start
+      start = time.time()
+      found = table.matching_entries(match)
+      indexed = time.time() - start
+      start = time.time()
+      assert found == [e for e in table.entries if e.is_matched_by(match)]
+      linear = time.time() - start
+      print "%6s        non-strict %-8s %6i entries: %7.2f ms, first %7.2f ms " \
+            "(linear %8.2f ms)" % ("", name, len(found), indexed * 1e3,
+                                   first * 1e3, linear * 1e3)
+
+    print "%6s        touch_packet %5.2f us, aggregate_stats %6.2f ms" % (
+        "", touch * 1e6, aggregate * 1e3)
+
+    start = time.time()
+    for rule in rules:
+      table.remove_entry(rule)
+    print "%6s        remove %5.1f us" % ("", (time.time() - start) / size * 1e6)
+
+  for rate in (1000, 2000, 5000):
+    churn(rate)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Measures SwitchImpl.process_packet() with and without the microflow cache.
+
+Usage: microflow-bench.py [rules] [flows] [packets]
+
+The switch gets rules (default 10000) wildcarded and exact rules, and then
+sees packets (default 200000) from flows (default 1000) distinct flows, with
+Zipf-like popularity so that a few elephant flows carry most of the traffic.
+Reports packets/s and the hit rate for the classification alone, for all of
+process_packet(), and for the classification with a flow-mod every 10000
+and every 1000 packets (each of which invalidates the cache).
+"""
+
+import sys
+import os.path
+import time
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+from pox.openflow.libopenflow_01 import *
+from pox.openflow.switch_impl import SwitchImpl, MicroflowCache
+from pox.lib.packet import *
+from pox.lib.addresses import IPAddr, EthAddr
+
+
+def make_packet (rng):
+  return ethernet(src=EthAddr("00:00:00:00:00:%02x" % rng.randint(1, 255)),
+                  dst=EthAddr("00:00:00:00:00:01"), type=ethernet.IP_TYPE,
+                  next=ipv4(srcip=IPAddr(0x0a000000 | rng.randint(0, 0xffff)),
+                            dstip=IPAddr(0x0b000000 | rng.randint(0, 0xffff)),
+                            protocol=ipv4.TCP_PROTOCOL,
+                            next=tcp(srcport=rng.randint(1024, 65535),
+                                     dstport=rng.choice((80, 443, 22)))))
+
+def make_rule (rng, i, packet=None):
+  if packet is not None:
+    match = ofp_match.from_packet(packet, 1)
+  elif i % 2:
+    match = ofp_match(dl_type=0x800, nw_dst="11.0.%i.0/24" % rng.randint(0, 255))
+  else:
+    match = ofp_match(dl_type=0x800, nw_proto=6, tp_dst=rng.randint(1, 1024),
+                      nw_src=IPAddr(0x0a000000 | rng.randint(0, 0xffff)))
+  return ofp_flow_mod(match=match, priority=rng.randint(1, 100),
+                      actions=[ofp_action_output(port=2)])
+
+
+def run (name, rule_count, flows, packet_count, cache_size):
+  rng = random.Random(1)
+  switch = SwitchImpl(1, microflow_cache_size=cache_size)
+  flow_packets = [make_packet(rng) for i in xrange(flows)]
+  for i in xrange(rule_count):
+    # A tenth of the flows get exact rules
+    p = flow_packets[i] if i < flows // 10 else None
+    switch.table.process_flow_mod(make_rule(rng, i, p))
+  weights = [1.0 / (i + 1) for i in xrange(flows)]
+  total = sum(weights)
+  packets = []
+  for p, w in zip(flow_packets, weights):
+    packets += [p] * int(round(w / total * packet_count))
+  rng.shuffle(packets)
+
+  cache = switch.microflow_cache
+  lookup = switch.table if cache is None else cache
+  results = []
+  for flow_mod_interval in (None, 10000, 1000):
+    if cache is not None:
+      cache.hits = cache.misses = 0
+    start = time.time()
+    for i, p in enumerate(packets):
+      if flow_mod_interval and i % flow_mod_interval == 0:
+        switch.table.process_flow_mod(make_rule(rng, i))
+      lookup.entry_for_packet(p, 1)
+    rate = len(packets) / (time.time() - start)
+    results.append("%7.0f" % rate + (" (%2.0f%%)" % (cache.hit_rate * 100) if cache is not None else ""))
+
+  start = time.time()
+  for p in packets:
+    switch.process_packet(p, 1)
+  process = time.time() - start
+
+  print "%-9s %s, process_packet %6.0f" % (
+      name, ", ".join(results), len(packets) / process)
+
+
+def main ():
+  rules = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+  flows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+  packets = int(sys.argv[3]) if len(sys.argv) > 3 else 200000
+  print "%i rules, %i flows, %i packets" % (rules, flows, packets)
+  print "packets/s: classify (hits), with a flow-mod per 10000, per 1000, " \
+        "and process_packet"
+  run("no cache", rules, flows, packets, 0)
+  run("cache", rules, flows, packets, 4096)
+
+
+if __name__ == '__main__':
+  main()
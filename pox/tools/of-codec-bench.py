@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Measures pack() and unpack() throughput of the hot libopenflow_01 types.
+
+Usage: of-codec-bench.py [seconds_per_test]
+
+Each type is packed and unpacked repeatedly for about the given time (0.5 s
+by default).  pack() is measured with and without the _assert() checks (see
+ASSERT_STRUCTS); unpack() goes into a fresh object each time, like
+Connection does.
+"""
+
+import sys
+import os.path
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+
+
+def make_match ():
+  return of.ofp_match(in_port=1, dl_src=EthAddr("00:11:22:33:44:55"),
+                      dl_dst=EthAddr("66:77:88:99:aa:bb"), dl_type=0x800, nw_proto=6,
+                      nw_src="10.0.0.1", nw_dst="10.0.0.2", tp_src=5001,
+                      tp_dst=6379)
+
+def make_samples ():
+  stats = of.ofp_flow_stats(match=make_match(), table_id=2, priority=100,
+                            packet_count=12, byte_count=3456,
+                            actions=[of.ofp_action_output(port=2)])
+  stats.length = len(stats)
+  return [
+    of.ofp_header(header_type=of.OFPT_HELLO, xid=1),
+    make_match(),
+    of.ofp_action_output(port=2),
+    of.ofp_flow_mod(xid=2, match=make_match(), idle_timeout=10,
+                    actions=[of.ofp_action_output(port=2)]),
+    of.ofp_packet_in(xid=3, in_port=1, buffer_id=7, data="\x00" * 128),
+    of.ofp_packet_out(xid=4, data="\x00" * 128,
+                      actions=[of.ofp_action_output(port=2)]),
+    stats,
+  ]
+
+
+def rate (f, seconds):
+  """ Calls f repeatedly for about seconds; returns calls per second """
+  n = 0
+  batch = 100
+  start = time.time()
+  while True:
+    for i in xrange(batch):
+      f()
+    n += batch
+    elapsed = time.time() - start
+    if elapsed >= seconds:
+      return n / elapsed
+
+
+def main ():
+  seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+  print "%-18s %12s %12s %12s" % ("type", "pack/s", "unchecked/s",
+                                  "unpack/s")
+  for obj in make_samples():
+    cls = type(obj)
+    data = obj.pack()
+    def unpack ():
+      cls().unpack(data)
+    of.ASSERT_STRUCTS = True
+    checked = rate(obj.pack, seconds)
+    of.ASSERT_STRUCTS = False
+    unchecked = rate(obj.pack, seconds)
+    of.ASSERT_STRUCTS = True
+    print "%-18s %12.0f %12.0f %12.0f" % (cls.__name__, checked, unchecked,
+                                          rate(unpack, seconds))
+
+
+if __name__ == '__main__':
+  main()
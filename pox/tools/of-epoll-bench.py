@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Measures the cost of listener wakeups with many connected switches.
+
+Usage: of-epoll-bench.py [switch_count] [rounds] [active_per_round]
+
+Connects switch_count simulated switches to a listener over loopback.  In each
+round, active_per_round random switches send an echo request, and the server
+side waits for readiness and reads and parses what arrived, the way
+OpenFlow_01_Task does:
+
+  select        select.select() over all sockets (as with the default
+                SelectHub); fails beyond FD_SETSIZE
+  EpollSelect   SelectHub with useEpoll: the socket dicts are rebuilt and the
+                lists handed to EpollSelect every cycle
+  edge epoll    EdgeTriggeredEpoll with persistent registration, as used by
+                "openflow.of_01 --epoll"
+"""
+
+import sys
+import os.path
+import time
+import random
+import select
+import socket
+from errno import EAGAIN, EWOULDBLOCK
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.util import ReceiveBuffer
+from pox.lib.epoll_select import EpollSelect, EdgeTriggeredEpoll
+
+
+class Switch (object):
+  """ Server side of one simulated switch connection """
+  def __init__ (self, sock):
+    self.sock = sock
+    self.buf = ReceiveBuffer()
+
+  def fileno (self):
+    return self.sock.fileno()
+
+  def read (self):
+    """ Reads until the socket would block; returns the message count """
+    count = 0
+    while True:
+      try:
+        if self.buf.recv(self.sock) == 0:
+          return count
+      except socket.error as e:
+        if e.args[0] in (EAGAIN, EWOULDBLOCK):
+          return count
+        raise
+      while self.buf.next_message() is not None:
+        count += 1
+
+
+def connect (switch_count):
+  listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  listener.bind(("127.0.0.1", 0))
+  listener.listen(socket.SOMAXCONN)
+
+  clients = []
+  switches = []
+  for i in xrange(switch_count):
+    c = socket.create_connection(listener.getsockname())
+    s = listener.accept()[0]
+    s.setblocking(0)
+    clients.append(c)
+    switches.append(Switch(s))
+  return listener, clients, switches
+
+
+def wait_select (switches):
+  rlist, wlist, xlist = select.select(switches, [], switches, 5)
+  return rlist
+
+def make_wait_epoll_select ():
+  ep = EpollSelect()
+  def wait (switches):
+    # SelectHub rebuilds its dicts from every task's lists each cycle
+    rl = {}
+    xl = {}
+    for s in switches:
+      rl[s] = None
+      xl[s] = None
+    rlist, wlist, xlist = ep.select(rl.keys(), [], xl.keys(), 5)
+    return rlist
+  return wait
+
+def make_wait_edge (poller, switches):
+  for s in switches:
+    poller.register(s)
+  def wait (switches):
+    select.select([poller], [], [], 5)
+    rlist, wlist, xlist = poller.poll(0)
+    return rlist
+  return wait
+
+
+def run (name, wait, clients, switches, rounds, active):
+  msg = of.ofp_echo_request().pack()
+  sent = 0
+  received = 0
+  elapsed = 0
+  for r in xrange(rounds):
+    for i in random.sample(xrange(len(clients)), active):
+      clients[i].send(msg)
+    sent += active
+    start = time.time()
+    while received < sent:
+      for s in wait(switches):
+        received += s.read()
+    elapsed += time.time() - start
+  print "%-12s %8.0f rounds/s, %7.1f us per round" % (
+      name, rounds / elapsed, elapsed / rounds * 1e6)
+
+
+def main ():
+  switch_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+  rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+  active = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+  # Created first, like in OpenFlow_01_Task, so that its fd is low enough
+  # for select()
+  poller = EdgeTriggeredEpoll()
+  listener, clients, switches = connect(switch_count)
+  print "%i switches connected, %i sending per round" % (switch_count, active)
+
+  try:
+    run("select", wait_select, clients, switches, rounds, active)
+  except ValueError as e:
+    print "%-12s fails: %s" % ("select", e)
+  run("EpollSelect", make_wait_epoll_select(), clients, switches, rounds,
+      active)
+  run("edge epoll", make_wait_edge(poller, switches), clients, switches, rounds,
+      active)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Measures the speed and memory use of ofp_match.
+
+Usage: of-match-bench.py [other_libopenflow_01.py]
+
+Reports the rate of the common ofp_match operations and the memory held by
+an unpacked match, counting the objects it references.  Given the path of another libopenflow_01.py
+(e.g. an older one from "git show"), it is measured alongside for
+comparison.
+"""
+
+import sys
+import os.path
+import imp
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+def rate (f, seconds = 0.5):
+  """ Calls f repeatedly for about seconds; returns calls per second """
+  n = 0
+  batch = 100
+  start = time.time()
+  while True:
+    for i in xrange(batch):
+      f()
+    n += batch
+    elapsed = time.time() - start
+    if elapsed >= seconds:
+      return n / elapsed
+
+
+def footprint (obj, seen = None):
+  """ Size of obj and of the objects it holds through attributes, in bytes """
+  if seen is None: seen = set()
+  if id(obj) in seen: return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  values = []
+  if hasattr(obj, '__dict__'):
+    size += footprint(obj.__dict__, seen)
+    values += obj.__dict__.values()
+  for slot in getattr(type(obj), '__slots__', ()):
+    if hasattr(obj, slot):
+      values.append(getattr(obj, slot))
+  for v in values:
+    # Small ints are shared
+    if not (type(v) is int and -5 <= v <= 256):
+      size += footprint(v, seen)
+  return size
+
+
+def measure (lib):
+  """ Returns [(name, value)] for the ofp_match in module lib """
+  def make ():
+    return lib.ofp_match(in_port=1, dl_src=EthAddr("00:11:22:33:44:55"),
+                         dl_dst=EthAddr("66:77:88:99:aa:bb"), dl_type=0x800,
+                         nw_proto=6, nw_src="10.0.0.1", nw_dst="10.0.0.2",
+                         tp_src=5001, tp_dst=6379)
+  match = make()
+  other = make()
+  data = match.pack()
+  def unpack ():
+    m = lib.ofp_match()
+    m.unpack(data)
+    return m
+  def read ():
+    return (match.in_port, match.dl_src, match.nw_src, match.tp_dst)
+  def write ():
+    match.tp_src = 1234
+    match.tp_dst = 80
+
+  results = [
+    ("construct empty/s", rate(lib.ofp_match)),
+    ("construct 9 fields/s", rate(make)),
+    ("unpack/s", rate(unpack)),
+    ("pack/s", rate(match.pack)),
+    ("4 reads/s", rate(read)),
+    ("2 writes/s", rate(write)),
+    ("== /s", rate(lambda: match == other)),
+    ("hash_code/s", rate(match.hash_code)),
+  ]
+  results.append(("bytes per match", footprint(unpack())))
+  return results
+
+
+def main ():
+  libs = [("current", of)]
+  if len(sys.argv) > 1:
+    libs.append(("other", imp.load_source("other_libopenflow_01",
+                                          sys.argv[1])))
+  columns = [measure(lib) for name, lib in libs]
+  print "%-22s" % ("",) + "".join("%14s" % (name,) for name, lib in libs)
+  for i, (label, value) in enumerate(columns[0]):
+    print "%-22s" % (label,) + "".join("%14.0f" % (c[i][1],) for c in columns)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Feeds an OpenFlow byte stream through the Connection.read() parser and reports
+messages/s, comparing the old string-concatenating parser with ReceiveBuffer.
+
+Usage: of-parse-bench.py [stream_file]
+
+stream_file holds the raw switch-to-controller bytes of an OpenFlow 1.0
+connection, e.g. the TCP payload of a capture written by "openflow.of_01
+--capture".  Without it, a packet-in storm with the occasional echo and
+flow-removed is generated.
+
+Each parser is run with the socket returning up to 2 KB per call (the old
+recv size) and up to 64 KB per call (what a busy socket hands to recv_into()
+when there is room).
+"""
+
+import sys
+import os.path
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.util import make_type_to_class_table, ReceiveBuffer
+
+classes = make_type_to_class_table()
+
+
+class StreamSocket (object):
+  """
+  Serves a byte stream like a socket would, at most chunk_size bytes per call.
+  """
+  def __init__ (self, data, chunk_size):
+    self._data = data
+    self._view = memoryview(data)
+    self._offset = 0
+    self._chunk_size = chunk_size
+
+  def recv (self, bufsize):
+    n = min(bufsize, self._chunk_size)
+    r = self._data[self._offset:self._offset + n]
+    self._offset += len(r)
+    return r
+
+  def recv_into (self, buf, nbytes = 0):
+    n = min(nbytes or len(buf), self._chunk_size, len(self._data) - self._offset)
+    buf[:n] = self._view[self._offset:self._offset + n]
+    self._offset += n
+    return n
+
+
+def make_stream (count):
+  msgs = []
+  for i in xrange(count):
+    if i % 100 == 0:
+      msgs.append(of.ofp_echo_request(xid=i))
+    elif i % 100 == 1:
+      msgs.append(of.ofp_flow_removed(xid=i, match=of.ofp_match(tp_src=i % 65536)))
+    else:
+      msgs.append(of.ofp_packet_in(xid=i, in_port=1, data="\x00" * 128))
+  return b''.join(m.pack() for m in msgs)
+
+
+def parse_old (sock):
+  """ The parser of Connection.read() before ReceiveBuffer """
+  count = 0
+  buf = ''
+  while True:
+    d = sock.recv(1 << 16)
+    if len(d) == 0:
+      return count
+    buf += d
+    l = len(buf)
+    while l > 4:
+      ofp_type = ord(buf[1])
+      packet_length = ord(buf[2]) << 8 | ord(buf[3])
+      if packet_length > l: break
+      msg = classes[ofp_type]()
+      msg.unpack(buf)
+      buf = buf[packet_length:]
+      l = len(buf)
+      count += 1
+
+
+def parse_new (sock):
+  count = 0
+  buf = ReceiveBuffer(classes)
+  while buf.recv(sock):
+    while buf.next_message() is not None:
+      count += 1
+  return count
+
+
+def main ():
+  if len(sys.argv) > 1:
+    with open(sys.argv[1], 'rb') as f:
+      data = f.read()
+  else:
+    data = make_stream(200000)
+
+  for chunk_size in (2048, 1 << 16):
+    for name, parse in (("string concatenation", parse_old),
+                        ("ReceiveBuffer", parse_new)):
+      start = time.time()
+      count = parse(StreamSocket(data, chunk_size))
+      elapsed = time.time() - start
+      print "%5i B reads, %-22s %8i messages, %10.0f messages/s, %6.1f MB/s" % (
+          chunk_size, name, count, count / elapsed, len(data) / elapsed / 1e6)
+
+
+if __name__ == '__main__':
+  main()
@@ -65,6 +65,10 @@ def main(client_pcap=None, pox_csv=None, server_pcap=None):
     # Extract event timings.
     pkt_in_durations = []
     flow_mod_durations = []
+    
+    # Lists of (start_time, duration) for replaying the delays in order.
+    pkt_in_trace = []
+    flow_mod_trace = []
 
     for event_id in event_dict:
         
@@ -74,6 +78,7 @@ def main(client_pcap=None, pox_csv=None, server_pcap=None):
         for (start_event, end_event) in [('ingress_from_client', 'pkt_in_from_client_to_server'),
                                          ('ingress_from_server', 'pkt_in_from_server_to_client')]:
         
+            pkt_in_start = None
             try:
                 pkt_in_start = filter(lambda (t, e): e == start_event, event_list)[0][0]
                 pkt_in_end   = filter(lambda (t, e): e == end_event,   event_list)[0][0]
@@ -81,10 +86,13 @@ def main(client_pcap=None, pox_csv=None, server_pcap=None):
                 pkt_in_durations.append((pkt_in_end - pkt_in_start) * 1000.0)
             except (IndexError, AssertionError):
                 pkt_in_durations.append(1000000 * 1000.0) # Lost packet
+            if pkt_in_start is not None:
+                pkt_in_trace.append((pkt_in_start, pkt_in_durations[-1]))
             
         for (start_event, end_event) in [('flow_mod_from_client_to_server', 'egress_to_server'),
                                          ('flow_mod_from_server_to_client', 'egress_to_client')]:
 
+            flow_mod_start = None
             try:        
                 flow_mod_start = filter(lambda (t, e): e == start_event, event_list)[0][0]
                 flow_mod_end   = filter(lambda (t, e): e == end_event,   event_list)[0][0]
@@ -92,6 +100,8 @@ def main(client_pcap=None, pox_csv=None, server_pcap=None):
                 flow_mod_durations.append((flow_mod_end - flow_mod_start) * 1000.0)
             except (IndexError, AssertionError):
                 flow_mod_durations.append(1000000 * 1000.0) # Lost packet
+            if flow_mod_start is not None:
+                flow_mod_trace.append((flow_mod_start, flow_mod_durations[-1]))
 
     #pprint(event_dict)
 
@@ -104,6 +114,15 @@ def main(client_pcap=None, pox_csv=None, server_pcap=None):
     with open('data/flow_mod_durations.csv', 'w') as flow_mod_f:
         for (v, p) in lib.util.make_cdf_table(flow_mod_durations):
             print >> flow_mod_f, '%.4f,%.4f' % (v, p)
+
+    # Same delays in the order of the events, for DelayedAction to replay.
+    for (trace, trace_file) in [(pkt_in_trace, 'data/pkt_in_trace.csv'),
+                                (flow_mod_trace, 'data/flow_mod_trace.csv')]:
+        print 'Writing to %s...' % trace_file
+        trace.sort()
+        with open(trace_file, 'w') as trace_f:
+            for (start_time, duration) in trace:
+                print >> trace_f, '%.4f,%.6f' % (duration, start_time)
     
     
     